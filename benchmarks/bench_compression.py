@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+'''
+Shows the CPU versus bytes trade-off of compressing a list response body at
+each gzip level.
+
+Usage: python benchmarks/bench_compression.py [iterations]
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hoops.json_encoding import get_backend
+from hoops.restful import _gzip
+
+from bench_json import page
+
+
+def main(iterations):
+    for rows in (10, 100):
+        body = get_backend().dumps(page(rows))
+        print "%d row page, %d bytes uncompressed, %d iterations" % (rows, len(body), iterations)
+        for level in (1, 3, 6, 9):
+            size = len(_gzip(body, level))
+            seconds = timeit.timeit(lambda: _gzip(body, level), number=iterations) / iterations
+            print "  gzip level %d: %8.2f usec  %6d bytes  %5.1fx" % (level, seconds * 1e6, size, float(len(body)) / size)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+'''
+Streams tables of growing size through ExportOperation and reports the
+process' peak RSS growth, which should stay flat as the table grows, then
+compares it with loading the largest table in one query.
+
+Usage: python benchmarks/bench_export.py [rows ...]
+'''
+
+import os
+import sys
+import resource
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from flask.ext.sqlalchemy import SQLAlchemy
+
+from hoops.base import APIResource
+from hoops.common import BareModel
+from hoops.core import create_api
+from hoops.generic import ExportOperation
+
+db = SQLAlchemy()
+
+
+class Model(db.Model, BareModel):
+    __abstract__ = True
+
+
+class ExportRow(Model):
+    __tablename__ = 'export_row'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.Unicode(64))
+    email = db.Column(db.Unicode(128))
+    notes = db.Column(db.UnicodeText)
+
+
+class ExportRowAPI(APIResource):
+    route = '/export'
+    model = ExportRow
+
+
+@ExportRowAPI.method('list')
+class ExportRows(ExportOperation):
+    pass
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main(sizes):
+    (app, _, api) = create_api('bench_export', flask_config={'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    db.init_app(app)
+    db.app = app
+    client = app.test_client()
+    with app.app_context():
+        db.create_all()
+    loaded = 0
+    for size in sizes:
+        with app.app_context():
+            for start in range(loaded, size, 5000):
+                db.session.execute(ExportRow.__table__.insert(), [
+                    {'name': u'row %d' % i, 'email': u'%d@example.com' % i, 'notes': u'x' * 200}
+                    for i in range(start, min(start + 5000, size))
+                ])
+                db.session.commit()
+        loaded = size
+        before = peak_rss_kb()
+        started = time.time()
+        response = client.get('/export', buffered=False)
+        lines = sum(chunk.count('\n') for chunk in response.response)
+        print "%7d rows: %7d lines in %5.2fs, peak RSS growth %6d KB" % (
+            size, lines, time.time() - started, peak_rss_kb() - before)
+    with app.app_context():
+        before = peak_rss_kb()
+        rows = [row.to_json() for row in ExportRow.query.order_by(ExportRow.id).all()]
+        print "%7d rows loaded at once: peak RSS growth %6d KB" % (len(rows), peak_rss_kb() - before)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 50000, 200000])
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+'''
+Measures response body encoding: the old sorted/indented stdlib output against
+compact output from each available encoder backend.
+
+Usage: python benchmarks/bench_json.py [iterations]
+'''
+
+import os
+import sys
+import json
+import datetime
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hoops.json_encoding import get_backend
+
+
+def page(rows):
+    now = datetime.datetime(2014, 1, 1)
+    return {
+        'api_version': '1.0.0',
+        'status_code': 1000,
+        'status_message': 'OK',
+        'pagination': {'page': 1, 'limit': rows, 'next_page': 2, 'total': 1000, 'sort_by': 'id', 'sort_dir': 'asc'},
+        'response_data': [{
+            'id': i,
+            'name': u'customer %d' % i,
+            'email': u'customer%d@example.com' % i,
+            'status': u'active',
+            'partner_id': 1,
+            'created_at': unicode(now),
+            'updated_at': unicode(now),
+        } for i in range(rows)],
+    }
+
+
+def main(iterations):
+    data = page(100)
+    legacy = lambda: json.dumps(data, sort_keys=True, indent=4, separators=(',', ': '))
+    print "100 row page, %d iterations" % iterations
+    print "%-28s %8.2f usec  %6d bytes" % ('json sorted+indent (legacy)', timeit.timeit(legacy, number=iterations) / iterations * 1e6,
+                                           len(legacy()))
+    for name in ('json', 'simplejson'):
+        try:
+            backend = get_backend(name)
+        except ImportError:
+            continue
+        compact = lambda: backend.dumps(data)
+        print "%-28s %8.2f usec  %6d bytes" % (name + ' compact', timeit.timeit(compact, number=iterations) / iterations * 1e6,
+                                               len(compact()))
+    print "default backend: %s" % get_backend().name
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+'''
+Measures the per-request cost of obtaining the merged resource/operation
+schemas, with and without the registration-time schema cache.
+
+Usage: python benchmarks/bench_schema.py [iterations]
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from formencode.validators import Int, String, UnicodeString
+
+from hoops.base import APIResource, parameter, url_parameter, schema_cache
+from hoops.generic import ListOperation
+
+
+@parameter('name', UnicodeString(max=64, if_missing=None), "Name")
+@parameter('status', String(if_missing=None), "Status")
+class BenchResource(APIResource):
+    route = '/bench'
+    object_route = '/bench/<int:bench_id>'
+    object_id_param = 'bench_id'
+
+
+@BenchResource.method('list')
+@url_parameter('bench_id', Int(if_missing=None), "Bench ID")
+@parameter('include_inactive', String(if_missing=None), "Include inactive")
+class ListBench(ListOperation):
+    pass
+
+
+def per_request_uncached(op):
+    # what every request paid before: two deep-copy merges
+    op._merge_schema('url_schema')
+    op._merge_schema('schema')
+
+
+def per_request_cached(op):
+    op._combine_schema('url_schema')
+    op._combine_schema('schema')
+
+
+def main(iterations=10000):
+    op = BenchResource.list
+    schema_cache.clear()
+    op.compile_schemas()
+    for (label, func) in (('uncached', per_request_uncached), ('cached', per_request_cached)):
+        elapsed = timeit.timeit(lambda: func(op), number=iterations)
+        print '%-10s %8.2f usec/request' % (label, elapsed / iterations * 1e6)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
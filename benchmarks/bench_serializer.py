@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+'''
+Measures BareModel.to_json over a page of rows, comparing the precompiled
+per-class serializer with the regex/instance-dict based implementation it
+replaced.
+
+Usage: python benchmarks/bench_serializer.py [iterations]
+'''
+
+import os
+import re
+import sys
+import datetime
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import create_engine, Column, Integer, Unicode, DateTime, Boolean
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from hoops.common import BareModel
+
+Base = declarative_base(cls=BareModel)
+
+
+class BenchModel(Base):
+    __tablename__ = 'bench_model'
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(64))
+    email = Column(Unicode(128))
+    status = Column(Unicode(16))
+    active = Column(Boolean)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    _secret = Column('secret', Unicode(64))
+
+
+def legacy_to_json(self):
+    value = self._sa_instance_state.dict
+    return_value = {}
+    props = value.keys()
+    if self.__props__:
+        props.extend(self.__props__)
+    for k in props:
+        if not re.match('_\w+', k):
+            v = getattr(self, k)
+            if type(v) == datetime.datetime:
+                v = unicode(v)
+            return_value[k] = v
+    return return_value
+
+
+def main(iterations):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    now = datetime.datetime(2014, 1, 1)
+    for i in range(100):
+        session.add(BenchModel(name=u'name %d' % i, email=u'%d@example.com' % i, status=u'active',
+                               active=True, created_at=now, updated_at=now, _secret=u'x'))
+    session.commit()
+    rows = session.query(BenchModel).all()
+
+    assert [legacy_to_json(r) for r in rows] == [r.to_json() for r in rows]
+
+    legacy = timeit.timeit(lambda: [legacy_to_json(r) for r in rows], number=iterations)
+    compiled = timeit.timeit(lambda: [r.to_json() for r in rows], number=iterations)
+    print "100 rows, %d iterations" % iterations
+    print "legacy to_json:      %8.2f usec/page" % (legacy / iterations * 1e6)
+    print "precompiled to_json: %8.2f usec/page" % (compiled / iterations * 1e6)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+'''
+Compares formencode's Schema.to_python with the compiled validator from
+hoops.validation for the ListOperation pagination parameters.
+
+Usage: python benchmarks/bench_validation.py [iterations]
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hoops.base import APIResource
+from hoops.generic import ListOperation
+from hoops.validation import compile_schema
+
+
+class BenchResource(APIResource):
+    route = '/bench'
+
+
+@BenchResource.method('list')
+class ListBench(ListOperation):
+    pass
+
+
+INPUTS = (
+    ('defaults', {}),
+    ('all params', {'limit': u'50', 'page': u'3', 'sort_by': u'name', 'sort_order': u'desc'}),
+)
+
+
+def main(iterations=20000):
+    schema = BenchResource.list._combine_schema('schema')
+    compiled = compile_schema(schema)
+    for (label, params) in INPUTS:
+        assert schema.to_python(params) == compiled(params)
+        generic = timeit.timeit(lambda: schema.to_python(params), number=iterations)
+        fast = timeit.timeit(lambda: compiled(params), number=iterations)
+        print '%-12s formencode %7.2f usec  compiled %6.2f usec  (%.1fx)' % (
+            label,
+            generic / iterations * 1e6,
+            fast / iterations * 1e6,
+            generic / fast
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -1,19 +1,62 @@
+import collections
 import copy
+import hashlib
 import json
 import re
 import logging
-from flask import g, request
+from flask import current_app, g, request
+from flask.ext.babel import get_locale
 from flask.ext.restful import abort
 from formencode import Invalid, Schema
 from formencode.validators import Validator
+from sqlalchemy.orm import class_mapper, load_only
 
-from hoops.restful import Resource
+from hoops.restful import LogExcerpt, Resource, log_body_sampled, oauth_credentials, require_oauth
+from hoops.cache import result_cache
 from hoops.exc import APIValidationException
+from hoops.json_encoding import to_plain
+from hoops.read_only import use_read_only
+from hoops.replica import route_request
+from hoops.response import APIResponse, CachedAPIResponse
 from hoops.status import library as status_library
+from hoops.timing import phase
+from hoops.validation import compile_schema
 
 request_logger = logging.getLogger('api.request')
 
 
+class SchemaCache(object):
+    '''
+    Merged resource/operation schemas, keyed by (resource, operation, schema kind).
+    Compiled validators for those schemas are kept under a fourth 'compiled' key part.
+
+    Entries are built when an APIResource is registered (or lazily on first
+    use) and dropped whenever a parameter decorator modifies one of the
+    classes involved.
+    '''
+
+    def __init__(self):
+        self._schemas = {}
+
+    def get(self, key):
+        return self._schemas.get(key)
+
+    def set(self, key, schema):
+        self._schemas[key] = schema
+
+    def invalidate(self, klass):
+        '''Drops all cached schemas built from klass or any of its subclasses.'''
+        for key in self._schemas.keys():
+            (resource, operation) = key[:2]
+            if any(isinstance(cls, type) and issubclass(cls, klass) for cls in (resource, operation)):
+                del self._schemas[key]
+
+    def clear(self):
+        self._schemas.clear()
+
+schema_cache = SchemaCache()
+
+
 class APIOperation(object):
 
     '''
@@ -25,18 +68,42 @@ class APIOperation(object):
     '''
     field_map = {}
 
+    '''
+    If set, schemas are compiled into specialized validation functions (see
+    hoops.validation) instead of going through formencode's Schema.to_python.
+    '''
+    compiled_validation = False
+
+    '''
+    Whether this operation may read from a read replica, when replicas are configured
+    (see hoops.replica): None for GET requests only, True or False to force it.
+    '''
+    read_replica = None
+
+    '''
+    Whether this operation runs in a read-only transaction (see hoops.read_only):
+    None for GET requests only, True or False to force it.
+    '''
+    read_only_transaction = None
+
     def __call__(self, *args, **kwargs):
         # logging parameters
-        self.url_params = self.validate_url(**kwargs)
-        self.params = self.validate_input()
+        with phase('validate'):
+            self.url_params = self.validate_url(**kwargs)
+            self.params = self.validate_input()
 
         remote_addr = request.remote_addr or 'localhost'
         request_method = request.environ.get('REQUEST_METHOD')
         path_info = request.environ.get('PATH_INFO')
-        request_logger.debug(
-            'Request: %s %s %s %s',
-            remote_addr, request_method, path_info, unicode(self.params)
-        )
+        if request_logger.isEnabledFor(logging.DEBUG) and log_body_sampled():
+            request_logger.debug(
+                'Request: %s %s %s %s',
+                remote_addr, request_method, path_info, LogExcerpt(self.params, current_app.config.get('LOG_BODY_MAX_BYTES'))
+            )
+        return self.respond(*args, **kwargs)
+
+    def respond(self, *args, **kwargs):
+        '''Produces the response to the validated request.'''
         if hasattr(self, 'setup'):
             self.setup(*args, **kwargs)
         return self.process_request(*args, **kwargs)
@@ -44,6 +111,28 @@ class APIOperation(object):
     def __init__(self, resource=None, method='get'):
         self.resource = resource
 
+    def wants_read_replica(self):
+        if self.read_replica is None:
+            return request.method == 'GET'
+        return self.read_replica
+
+    def wants_read_only(self):
+        if self.read_only_transaction is None:
+            return request.method == 'GET'
+        return self.read_only_transaction
+
+    def for_request(self):
+        '''
+        Returns a lightweight copy of this operation to handle a single request.
+
+        Operations are bound once per resource and shared by every request in the
+        process; per-request state (params, url_params, object, ...) is stored on the
+        copy so concurrent requests (threads/greenlets) never see each other's values.
+        '''
+        operation = object.__new__(type(self))
+        operation.__dict__.update(self.__dict__)
+        return operation
+
     @property
     def combined_params(self):
         params = copy.deepcopy(getattr(self, 'params', {}))
@@ -63,7 +152,22 @@ class APIOperation(object):
             del params[param_name]
         return params
 
+    def _schema_key(self, attr_name):
+        resource = self.resource
+        if resource is not None and not isinstance(resource, type):
+            resource = type(resource)
+        return (resource, type(self), attr_name)
+
     def _combine_schema(self, attr_name='schema'):
+        '''Returns the merged schema for this resource/operation pair, building it once.'''
+        key = self._schema_key(attr_name)
+        schema = schema_cache.get(key)
+        if schema is None:
+            schema = self._merge_schema(attr_name)
+            schema_cache.set(key, schema)
+        return schema
+
+    def _merge_schema(self, attr_name='schema'):
         resource_schema = getattr(self.resource, attr_name, None)
         operation_schema = getattr(self, attr_name, None)
 
@@ -78,13 +182,33 @@ class APIOperation(object):
 
         return schema or Schema()
 
+    def _schema_validator(self, attr_name='schema'):
+        '''Returns the callable used to validate against the merged schema.'''
+        if not self.compiled_validation:
+            return self._combine_schema(attr_name).to_python
+        key = self._schema_key(attr_name) + ('compiled',)
+        validator = schema_cache.get(key)
+        if validator is None:
+            validator = compile_schema(self._combine_schema(attr_name))
+            schema_cache.set(key, validator)
+        return validator
+
+    def cached_models(self):
+        '''Models whose writes invalidate the cached responses of this operation (see hoops.cache).'''
+        return []
+
+    def compile_schemas(self):
+        '''Builds and caches the merged URL and input schemas ahead of the first request.'''
+        for attr_name in ('url_schema', 'schema'):
+            self._schema_validator(attr_name)
+
     def validate_url(self, *args, **kwargs):
         schema = self._combine_schema('url_schema')
         if not schema:  # pragma: no cover
             return {}
 
         try:
-            return schema.to_python(kwargs)
+            return self._schema_validator('url_schema')(kwargs)
         except Invalid as e:
             if e.error_dict:
                 failures = {}
@@ -95,9 +219,8 @@ class APIOperation(object):
             raise APIValidationException(status_library.API_INPUT_VALIDATION_FAILED, failures)
 
     def validate_input(self):
-        schema = self._combine_schema('schema')
         try:
-            params = schema.to_python(self.resource.get_parameters())
+            params = self._schema_validator('schema')(self.resource.get_parameters())
         except Invalid as e:
             if e.error_dict:
                 failures = {}
@@ -114,10 +237,100 @@ class APIOperation(object):
 
 class APIModelOperation(APIOperation):
 
+    '''
+    If set, GET responses are cached for this many seconds (see hoops.cache).
+    Falls back to the resource's cache_ttl.
+    '''
+    cache_ttl = None
+
+    '''
+    Models, besides the resource's, the responses are built from; writing any of
+    them invalidates the cached responses. Falls back to the resource's cache_depends_on.
+    '''
+    cache_depends_on = ()
+
+    '''
+    Model attribute updated on every write (such as coaster's updated_at) from
+    which Retrieve and List operations derive weak ETags; None disables them.
+    '''
+    etag_column = 'updated_at'
+
     @property
     def model(self):
         return self.resource.model
 
+    def etag_attribute(self):
+        '''Returns etag_column if ETags apply to this request: the model has it and no related objects are included.'''
+        if not self.etag_column or self.model is None or not hasattr(self.model, self.etag_column):
+            return None
+        if any(self.combined_params.get(param) for param in getattr(self, 'related', {})):
+            return None
+        return self.etag_column
+
+    def make_etag(self, signature):
+        '''
+        Returns the ETag of the response to this request, given the (id, etag_column)
+        pairs of the rows it holds. Like cached responses, ETags are specific to the
+        cache_scope() of the request.
+        '''
+        return hashlib.sha1(repr((
+            self._schema_key('etag'),
+            sorted(self.combined_params.items()),
+            unicode(get_locale()),
+            self.cache_scope(),
+            signature,
+        ))).hexdigest()
+
+    def get_cache_ttl(self):
+        return self.cache_ttl or getattr(self.resource, 'cache_ttl', None)
+
+    def cached_models(self):
+        if not self.get_cache_ttl() or self.model is None:
+            return []
+        models = [self.model]
+        models.extend(self.cache_depends_on or getattr(self.resource, 'cache_depends_on', ()))
+        # models brought in by include_related
+        relationships = class_mapper(self.model).relationships
+        for column in getattr(self, 'related', {}).values():
+            if column in relationships:
+                models.append(relationships[column].mapper.class_)
+        return models
+
+    def cache_scope(self):
+        '''
+        What, besides its parameters, a cached response is specific to: by default
+        the OAuth consumer key and token the request was verified with, wherever
+        the client put them (None without OAuth). Override for resources scoped by
+        anything else.
+        '''
+        credentials = oauth_credentials()
+        if credentials is None:
+            return None
+        return (credentials.consumer_key, credentials.token)
+
+    def respond(self, *args, **kwargs):
+        models = self.cached_models() if request.method == 'GET' else []
+        scope = self.cache_scope() if models else None
+        # a response of an OAuth resource is never shared between unknown clients
+        if scope is None and require_oauth in getattr(self.resource, 'method_decorators', ()):
+            models = []
+        if not models:
+            return super(APIModelOperation, self).respond(*args, **kwargs)
+        key = result_cache.key(models, (
+            self._schema_key('cache'),
+            sorted(self.combined_params.items()),
+            unicode(get_locale()),
+            scope,
+        ))
+        cached = result_cache.get(key)
+        if cached is not None:
+            return CachedAPIResponse(*cached)
+        output = super(APIModelOperation, self).respond(*args, **kwargs)
+        if isinstance(output, APIResponse):
+            result_cache.set(key, (output.status.http_status, to_plain(output.response), output.etag),
+                             self.get_cache_ttl())
+        return output
+
     def get_base_query(self, **kwargs):
         '''Obtains the base query for a model-based operation.'''
         all_params = kwargs
@@ -128,7 +341,7 @@ class APIModelOperation(APIOperation):
         item_id = self.combined_params.get(self.resource.object_id_param, None)
         id_column = getattr(self, 'id_column', 'id')
         column = getattr(self.model, id_column)
-        item = self.get_base_query(**kwargs).filter(column == item_id).first()
+        item = self.select_fields(self.get_base_query(**kwargs)).filter(column == item_id).first()
         if item is None:
             raise status_library.exception(
                 'API_DATABASE_RESOURCE_NOT_FOUND',
@@ -136,6 +349,53 @@ class APIModelOperation(APIOperation):
             )
         return item
 
+    def selected_fields(self):
+        '''
+        Returns the model columns requested with a comma separated ``fields`` parameter
+        (always including the primary key), or None if all fields are wanted.
+        '''
+        fields = getattr(self, 'params', {}).get('fields')
+        if not fields:
+            return None
+        mapper = class_mapper(self.model)
+        columns = set(prop.key for prop in mapper.column_attrs)
+        requested = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in requested if field not in columns]
+        if unknown:
+            raise APIValidationException(
+                status_library.API_INPUT_VALIDATION_FAILED,
+                {'fields': 'Unknown field(s): %s' % ', '.join(unknown)}
+            )
+        primary_key = [mapper.get_property_by_column(column).key for column in mapper.primary_key]
+        return primary_key + [field for field in requested if field not in primary_key]
+
+    def select_fields(self, query, *also_load):
+        '''Restricts the columns loaded by query to the selected fields (and also_load), if any.'''
+        fields = self.selected_fields()
+        if not fields:
+            return query
+        if self.etag_attribute():
+            also_load += (self.etag_column, )
+        return query.options(load_only(*(fields + [field for field in also_load if field not in fields])))
+
+    def serialize(self, data, include_subordinate=()):
+        '''JSONifies model object(s), honouring the selected fields.'''
+        fields = self.selected_fields()
+        with phase('serialize'):
+            if isinstance(data, collections.Iterable):
+                return self.model.to_json_list(list(data), include_subordinate=include_subordinate, fields=fields)
+            return data.to_json(include_subordinate=include_subordinate, fields=fields)
+
+    def serialize_selected(self, data):
+        '''
+        JSONifies data up front if only some fields were requested; otherwise the
+        model objects are left for the JSON encoder. Operations decorated with
+        include_related are serialized (with the selected fields) by that decorator.
+        '''
+        if not self.selected_fields() or getattr(self, 'related', None):
+            return data
+        return self.serialize(data)
+
 
 class UnimplementedOperation(APIOperation):
     def __call__(self, *args, **kwargs):
@@ -154,6 +414,10 @@ class APIResource(Resource):
     update = UnimplementedOperation()
     remove = UnimplementedOperation()
     list = UnimplementedOperation()
+    # operations taking a JSON array body on the collection route (see hoops.generic.BulkOperation)
+    bulk_create = UnimplementedOperation()
+    bulk_update = UnimplementedOperation()
+    bulk_remove = UnimplementedOperation()
 
     #def __repr__(self):
     #    methods = ['create', 'retrieve', 'update', 'remove', 'list']
@@ -198,31 +462,51 @@ class APIResource(Resource):
             return cls
         return wrapper
 
+    def dispatch_operation(self, method, **kwargs):
+        '''Runs the operation bound to method against a request-scoped copy of it.'''
+        operation = getattr(self, method).for_request()
+        route_request(operation.wants_read_replica())
+        use_read_only(operation.wants_read_only())
+        return operation(**kwargs)
+
     def get(self, **kwargs):
         if self.object_id_param in kwargs:
-            return self.retrieve(**kwargs)
-        return self.list(**kwargs)
+            return self.dispatch_operation('retrieve', **kwargs)
+        return self.dispatch_operation('list', **kwargs)
+
+    def has_operation(self, method):
+        return not isinstance(getattr(self, method, None), UnimplementedOperation)
 
     def post(self, **kwargs):
         if self.object_id_param in kwargs:
             raise status_library.API_RESOURCE_NOT_FOUND  # Can't POST with arguments in URL
         if self.read_only:
             abort(405)
-        return self.create(**kwargs)
+        if isinstance(request.json, list):
+            return self.dispatch_operation('bulk_create', **kwargs)
+        return self.dispatch_operation('create', **kwargs)
 
     def put(self, **kwargs):
         if not self.object_id_param in kwargs:
-            raise status_library.API_RESOURCE_NOT_FOUND  # Can't PUT without arguments (that may have an ID)
+            if not self.has_operation('bulk_update'):
+                raise status_library.API_RESOURCE_NOT_FOUND  # Can't PUT without arguments (that may have an ID)
+            method = 'bulk_update'
+        else:
+            method = 'update'
         if self.read_only:
             abort(405)
-        return self.update(**kwargs)
+        return self.dispatch_operation(method, **kwargs)
 
     def delete(self, **kwargs):
         if not self.object_id_param in kwargs:
-            raise status_library.API_RESOURCE_NOT_FOUND  # Can't DELETE without arguments (that may have an ID)
+            if not self.has_operation('bulk_remove'):
+                raise status_library.API_RESOURCE_NOT_FOUND  # Can't DELETE without arguments (that may have an ID)
+            method = 'bulk_remove'
+        else:
+            method = 'remove'
         if self.read_only:
             abort(405)
-        return self.remove(**kwargs)
+        return self.dispatch_operation(method, **kwargs)
 
     @classmethod
     def get_base_query(self, **kwargs):
@@ -230,6 +514,15 @@ class APIResource(Resource):
         query = model.query
         return query
 
+    @classmethod
+    def operations(cls):
+        '''Returns the (method, operation) pairs bound to this resource.'''
+        return [
+            (method, getattr(cls, method))
+            for method in ('create', 'retrieve', 'update', 'remove', 'list', 'bulk_create', 'bulk_update', 'bulk_remove')
+            if isinstance(getattr(cls, method, None), APIOperation)
+        ]
+
 
 class base_parameter(object):
     schema_property = 'schema'
@@ -249,6 +542,7 @@ class base_parameter(object):
             schema = copy.deepcopy(getattr(klass, self.schema_property))
         schema.add_field(self.field, self.validator)
         setattr(klass, self.schema_property, schema)
+        schema_cache.invalidate(klass)
         return klass
 
 
@@ -0,0 +1,130 @@
+'''
+The /batch resource: runs many API calls sent in one HTTP request.
+
+The body is a JSON array of sub-requests::
+
+    [{"method": "GET", "path": "/customers", "params": {"limit": 5}},
+     {"method": "PUT", "path": "/customers/12", "params": {"name": "New name"}}]
+
+Each sub-request is dispatched in-process to the resource owning its path, in
+its own request context, and the response holds the usual API envelope of each
+call, in order. OAuth (when enabled) is only verified for the batch request
+itself; the sub-requests run with its credentials.
+'''
+
+import json
+import logging
+
+from flask import current_app, request
+from flask.ext.restful.utils import unpack
+from werkzeug.exceptions import HTTPException, MethodNotAllowed
+
+from hoops.exc import APIValidationException
+from hoops.json_encoding import to_plain
+from hoops.response import APIResponse
+from hoops.restful import OAUTH_CREDENTIALS, Resource, prepare_output
+from hoops.status import library as status_library
+
+error_logger = logging.getLogger('error')
+
+METHODS = ('GET', 'POST', 'PUT', 'DELETE')
+
+# headers of the batch request that don't describe the sub-requests
+_skipped_headers = ('Content-Length', 'Content-Type', 'Content-Encoding', 'If-None-Match')
+
+
+class BatchResource(Resource):
+    '''
+    Configure through create_api's batch_args (route, max_requests, isolate_failures).
+
+    With isolate_failures, a failing call only produces an error envelope (and a
+    rollback of whatever it did to the session) and the following calls still run;
+    without it, the batch stops at the first failure, which is the last envelope
+    returned.
+    '''
+    api = None
+    route = '/batch'
+    max_requests = 50
+    isolate_failures = True
+
+    @classmethod
+    def configure(cls, api, **batch_args):
+        '''Returns a BatchResource subclass bound to api, with batch_args as settings.'''
+        attrs = dict(api=api)
+        attrs.update(batch_args)
+        return type(cls.__name__, (cls, ), attrs)
+
+    def post(self, **kwargs):
+        calls = request.json
+        if not isinstance(calls, list):
+            raise status_library.API_INVALID_DATA_FORMAT
+        if len(calls) > self.max_requests:
+            raise status_library.API_REQUEST_ENTITY_TOO_LARGE
+        responses = []
+        for call in calls:
+            (envelope, failed) = self.run(call)
+            responses.append(envelope)
+            if failed:
+                self.rollback()
+                if not self.isolate_failures:
+                    break
+        return APIResponse(responses)
+
+    def check_call(self, call):
+        if not isinstance(call, dict):
+            return {'unknown': 'An object is required'}
+        failures = {}
+        method = call.get('method', 'GET')
+        if not isinstance(method, basestring) or method.upper() not in METHODS:
+            failures['method'] = 'Must be one of %s' % ', '.join(METHODS)
+        path = call.get('path')
+        if not isinstance(path, basestring) or not path.startswith('/'):
+            failures['path'] = 'An absolute path is required'
+        elif path.split('?')[0].rstrip('/') == self.route.rstrip('/'):
+            failures['path'] = 'Batches can\'t be nested'
+        if not isinstance(call.get('params', {}), dict):
+            failures['params'] = 'An object is required'
+        return failures
+
+    def run(self, call):
+        '''Dispatches one sub-request; returns (its response envelope, whether it failed).'''
+        failures = self.check_call(call)
+        if failures:
+            e = APIValidationException(status_library.get('API_INPUT_VALIDATION_FAILED'), failures)
+            return (self.api.error_response(e).to_json(), True)
+
+        method = call.get('method', 'GET').upper()
+        params = call.get('params', {})
+        if method == 'GET':
+            # params given in the path's own query string are kept when there are no others
+            body = dict(query_string=params) if params else {}
+        else:
+            body = dict(data=json.dumps(params), content_type='application/json')
+        headers = [(key, value) for (key, value) in request.headers if key not in _skipped_headers]
+        environ = {'REMOTE_ADDR': request.remote_addr}
+        # the sub-requests aren't verified themselves, but cached responses are scoped by the credentials
+        if OAUTH_CREDENTIALS in request.environ:
+            environ[OAUTH_CREDENTIALS] = request.environ[OAUTH_CREDENTIALS]
+        with current_app.test_request_context(call['path'], method=method, headers=headers,
+                                              environ_base=environ, **body):
+            try:
+                if request.routing_exception is not None:
+                    raise request.routing_exception
+                view_class = current_app.view_functions[request.url_rule.endpoint].__dict__.get('view_class')
+                handler = getattr(view_class(), method.lower(), None) if view_class else None
+                if handler is None:
+                    raise MethodNotAllowed()
+                (data, code, headers) = unpack(handler(**request.view_args))
+                (out, code) = prepare_output(data, code)
+                # serialize now, while the objects are still in the state this call left them
+                return (to_plain(out), code >= 400)
+            except Exception as e:
+                response = self.api.error_response(e)
+                if response.status.http_status >= 500 and not isinstance(e, HTTPException):
+                    error_logger.exception('Batch call %s %s failed', method, call['path'])
+                return (to_plain(response.to_json()), True)
+
+    def rollback(self):
+        db = getattr(current_app, 'db', None)
+        if db is not None:
+            db.session.rollback()
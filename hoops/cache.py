@@ -0,0 +1,168 @@
+'''
+Result cache for read operations.
+
+Operations opt in with ``cache_ttl`` (seconds), set on the operation or on its
+resource; only GET requests are cached. The response envelope is stored, as
+plain JSON data, under a key made of the resource, operation, parameters, locale
+and ``cache_scope()`` (the OAuth consumer key and token by default), and of the
+current generation of every model the response depends on: the resource's model,
+models pulled in through include_related, and those listed in ``cache_depends_on``.
+Responses of resources requiring OAuth aren't cached when the scope is unknown.
+
+Writing a model starts a new generation for it, which retires every entry built
+from it. The ORM's after_insert/after_update/after_delete events (and Query.update
+/ Query.delete) do this at the end of the flush and again once the session commits, so
+entries filled in by other requests in between don't outlive the write. Writes
+going around the ORM (such as executemany statements) must call
+``result_cache.written(session, model)`` themselves.
+
+Entries live in an in-process LRUBackend unless another backend is given to
+create_api (``cache_backend``), such as a memcache.Client shared by all workers:
+any object with ``get(key)`` returning None on a miss and ``set(key, value, ttl)``,
+where a ttl of 0 never expires, will do.
+'''
+
+import collections
+import hashlib
+import threading
+import time
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, class_mapper, object_session
+
+# keys of Session.info holding the models written in the current flush / transaction
+_FLUSHED = 'hoops_cache_flushed'
+_WRITTEN = 'hoops_cache_written'
+
+
+class LRUBackend(object):
+    '''In-process cache of up to max_entries values, dropping the least recently used first.'''
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[1] and entry[1] <= time.time():
+                return None
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value, ttl=0):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + ttl if ttl else 0)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def model_key(model):
+    '''Models sharing a base mapper (inheritance) share their generation.'''
+    base = class_mapper(model).base_mapper.class_
+    return '%s.%s' % (base.__module__, base.__name__)
+
+
+class ResultCache(object):
+
+    def __init__(self, backend=None):
+        self.backend = backend or LRUBackend()
+        self._watched = set()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.invalidations = 0
+
+    def stats(self):
+        '''Counters of this process.'''
+        return {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations}
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def generation(self, model):
+        key = 'hoops:generation:%s' % model_key(model)
+        generation = self.backend.get(key)
+        if generation is None:
+            # a lost generation (evicted, or never set) must not bring back older entries
+            generation = uuid.uuid4().hex
+            self.backend.set(key, generation, 0)
+        return generation
+
+    def key(self, models, parts):
+        '''Returns the cache key for parts (any repr-able values) and the current generations of models.'''
+        for model in models:
+            self.watch(model)
+        generations = [self.generation(model) for model in models]
+        digest = hashlib.sha1(repr((generations, parts))).hexdigest()
+        return 'hoops:result:%s:%s' % (model_key(models[0]), digest)
+
+    def get(self, key):
+        value = self.backend.get(key)
+        self._count('misses' if value is None else 'hits')
+        return value
+
+    def set(self, key, value, ttl):
+        self.backend.set(key, value, ttl)
+
+    def invalidate(self, model):
+        '''Retires every entry depending on model.'''
+        self.backend.set('hoops:generation:%s' % model_key(model), uuid.uuid4().hex, 0)
+        self._count('invalidations')
+
+    def written(self, session, model):
+        '''Invalidates model now, and again when session commits.'''
+        self.invalidate(model)
+        if session is not None:
+            session.info.setdefault(_WRITTEN, set()).add(class_mapper(model).base_mapper.class_)
+
+    def watch(self, model):
+        '''Invalidates model whenever the ORM writes it.'''
+        base = class_mapper(model).base_mapper.class_
+        if base in self._watched:
+            return
+        with self._lock:
+            if base in self._watched:
+                return
+            for name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(base, name, self._on_write, propagate=True)
+            self._watched.add(base)
+
+    def _on_write(self, mapper, connection, target):
+        # invalidated once per flush rather than once per row
+        session = object_session(target)
+        if session is None:
+            self.invalidate(mapper.class_)
+        else:
+            session.info.setdefault(_FLUSHED, set()).add(mapper.base_mapper.class_)
+
+    def _on_flush(self, session, flush_context):
+        for model in session.info.pop(_FLUSHED, ()):
+            self.written(session, model)
+
+    def _on_bulk_write(self, context):
+        entity = context.query.column_descriptions[0]['type']
+        if class_mapper(entity).base_mapper.class_ in self._watched:
+            self.written(context.session, entity)
+
+    def _on_commit(self, session):
+        # releasing a savepoint commits nothing yet
+        if session.transaction is not None and session.transaction.nested:
+            return
+        for model in session.info.pop(_WRITTEN, ()):
+            self.invalidate(model)
+
+result_cache = ResultCache()
+
+event.listen(Session, 'after_bulk_update', result_cache._on_bulk_write)
+event.listen(Session, 'after_bulk_delete', result_cache._on_bulk_write)
+event.listen(Session, 'after_flush', result_cache._on_flush)
+event.listen(Session, 'after_commit', result_cache._on_commit)
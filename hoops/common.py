@@ -1,10 +1,16 @@
 import re
 import datetime
+import decimal
 
 from coaster.sqlalchemy import BaseMixin
 from flask.ext.sqlalchemy import SQLAlchemy
 from passlib.hash import sha512_crypt
-from sqlalchemy import event
+from sqlalchemy import event, types
+from sqlalchemy.orm import class_mapper, mapper, object_session
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.expression import BinaryExpression
+
+from hoops.json_encoding import register_type
 
 
 class Slugify:
@@ -85,6 +91,93 @@ class HashUtils(object):
         return sha512_crypt.verify(string_value, hash_value)
 
 
+def _to_unicode(value):
+    return unicode(value)
+
+
+def _enum_value(value):
+    return getattr(value, 'value', value)
+
+
+# value type => JSON friendly converter, for values whose column type doesn't tell us
+_value_converters = {
+    datetime.datetime: _to_unicode,
+    datetime.date: _to_unicode,
+    decimal.Decimal: _to_unicode,
+}
+
+
+def _convert_value(value):
+    converter = _value_converters.get(type(value))
+    return value if converter is None else converter(value)
+
+
+class ModelSerializer(object):
+    """Precompiled to_json for one model class.
+
+    Holds the fixed list of public column and __props__ names of the class, each paired
+    with a converter chosen from the column type, so output doesn't depend on which
+    attributes happen to be loaded and no per-value type checks are needed for columns.
+
+    """
+    def __init__(self, cls, model_mapper=None):
+        self.props = cls.__props__
+        fields = []
+        for prop in (model_mapper or class_mapper(cls)).column_attrs:
+            if not prop.key.startswith('_'):
+                fields.append((prop.key, self._column_converter(prop.columns[0].type)))
+        names = set(name for (name, converter) in fields)
+        props = cls.__props__ or ()
+        if isinstance(props, basestring):
+            props = (props,)
+        for name in props:
+            if not name.startswith('_') and name not in names:
+                fields.append((name, _convert_value))
+        self.fields = tuple(fields)
+
+    @staticmethod
+    def _column_converter(column_type):
+        if isinstance(column_type, types.Enum):
+            return _enum_value
+        try:
+            python_type = column_type.python_type
+        except NotImplementedError:
+            return _convert_value
+        if python_type in _value_converters:
+            return _value_converters[python_type]
+        if python_type in (int, long, float, bool, str, unicode):
+            return None
+        return _convert_value
+
+    def __call__(self, obj, fields=None):
+        loaded = obj.__dict__
+        return_value = {}
+        for (name, converter) in self.fields:
+            if fields is not None and name not in fields:
+                continue
+            value = loaded[name] if name in loaded else getattr(obj, name)
+            if converter is not None and value is not None:
+                value = converter(value)
+            return_value[name] = value
+        return return_value
+
+    @classmethod
+    def for_class(cls, model_class, model_mapper=None):
+        """Returns the serializer for model_class, (re)building it if __props__ changed"""
+        serializer = model_class.__dict__.get('__serializer__')
+        if serializer is None or serializer.props is not model_class.__props__:
+            serializer = cls(model_class, model_mapper)
+            model_class.__serializer__ = serializer
+        return serializer
+
+
+def _build_serializer(model_mapper, model_class):
+    if issubclass(model_class, BareModel):
+        ModelSerializer.for_class(model_class, model_mapper)
+
+event.listen(mapper, 'mapper_configured', _build_serializer)
+
+
 class BareModel(object):
     """ Abstract class based which should be used to define other
     models. This will contain the common implementation details for those
@@ -112,25 +205,66 @@ class BareModel(object):
             getattr(self, field)
         ) for field in self.__repr_fields__])
 
-    def to_json(self, include_subordinate=()):
-        #db.session.refresh(self)
-        value = self._sa_instance_state.dict
-        return_value = {}
-        props = value.keys()
-        if self.__props__:
-            props.extend(self.__props__)
-        # props = props if unsafe_props is None else list(set(props) - set(unsafe_props))
-        for k in props:
-            if not re.match('_\w+', k):
-                v = getattr(self, k)
-                if type(v) == datetime.datetime:
-                    v = unicode(v)
-                return_value[k] = v
+    def to_json(self, include_subordinate=(), subordinates=None, fields=None):
+        return_value = ModelSerializer.for_class(type(self))(self, fields=fields)
 
         for field in include_subordinate:
-            return_value[field] = self._include_subordinate(field)
+            if subordinates and field in subordinates:
+                return_value[field] = subordinates[field]
+            else:
+                return_value[field] = self._include_subordinate(field)
         return return_value
 
+    @classmethod
+    def to_json_list(cls, items, include_subordinate=(), fields=None):
+        """JSONify a list of items, loading each subordinate field for all of them at once"""
+        loaded = {}
+        for field in include_subordinate:
+            subordinates = cls._load_subordinates(items, field)
+            if subordinates is not None:
+                loaded[field] = subordinates
+        return [
+            item.to_json(
+                include_subordinate=include_subordinate,
+                subordinates=dict((field, loaded[field][index]) for field in loaded),
+                fields=fields
+            )
+            for (index, item) in enumerate(items)
+        ]
+
+    @classmethod
+    def _load_subordinates(cls, items, field):
+        """Load a subordinate field for all items with a single IN (...) query.
+
+        Returns a list of jsonified subordinates per item (with the referent key removed,
+        as in _include_subordinate), or None if the relationship isn't a plain foreign key
+        one-to-many that can be loaded this way.
+
+        """
+        prop = class_mapper(cls).get_property(field)
+        pairs = prop.local_remote_pairs
+        if prop.secondary is not None or len(pairs) != 1 or not items:
+            return None
+        join = prop.primaryjoin
+        if not isinstance(join, BinaryExpression) or join.operator is not operators.eq:
+            # extra join criteria we'd have to reproduce
+            return None
+        (local_column, remote_column) = pairs[0]
+        local_key = class_mapper(cls).get_property_by_column(local_column).key
+        remote_key = prop.mapper.get_property_by_column(remote_column).key
+        keys = set(getattr(item, local_key) for item in items)
+        keys.discard(None)
+
+        grouped = dict((key, []) for key in keys)
+        if keys:
+            query = object_session(items[0]).query(prop.mapper).filter(remote_column.in_(keys))
+            query = query.order_by(*(prop.order_by or prop.mapper.primary_key))
+            for subordinate in query:
+                data = subordinate.to_json()
+                data.pop(remote_column.name, None)
+                grouped[getattr(subordinate, remote_key)].append(data)
+        return [grouped.get(getattr(item, local_key), []) for item in items]
+
     def _include_subordinate(self, field):
         """Include a subordinate field and remove the primary referent key and jsonify recursively"""
         exclude_subordinate_column = getattr(self, field).attr.parent_token.local_remote_pairs[0][1].name
@@ -156,6 +290,9 @@ class BareModel(object):
         return cls.query.filter_by(**kwargs).one()
 
 
+register_type(BareModel, BareModel.to_json)
+
+
 class SluggableModel(BareModel, Slugify):
     """ Model class which extends the Slugify behavior to BaseModel class. All
     models which require slug generation feature should inherit from this model.
@@ -7,16 +7,24 @@ import warnings
 import yaml
 
 from hoops.base import APIResource
+from hoops.cache import result_cache
+from hoops.json_encoding import get_backend
 from hoops.logger import configure_logging
+from hoops.metrics import init_metrics
+from hoops.pool import instrument_pools, pool_config
+from hoops.queries import init_query_stats
+from hoops.read_only import end_read_only
+from hoops.replica import REPLICA_BIND_PREFIX, use_replicas
+from hoops.timing import init_timing
 from hoops.utils import find_subclasses
-import hoops.json_add_to_json_hack
 
 SQLALCHEMY_DATABASE_URI = None
 api = None
 flask_app = None
 
 
-def create_api(app_name, rest_args=None, database=None, db_config=None, log_config=None, flask_config=None, oauth_args=None):
+def create_api(app_name, rest_args=None, database=None, db_config=None, log_config=None, flask_config=None, oauth_args=None,
+               json_encoder=None, batch_args=None, cache_backend=None, log_args=None, metrics_args=None):
     '''
     Creates a RESTFul API to which Resource-based views can be registered.
 
@@ -24,11 +32,25 @@ def create_api(app_name, rest_args=None, database=None, db_config=None, log_conf
        app_name: The name of the API application
        rest_args: Arguments to pass on to Flask RESTful model (e.g. catch_all_404s, see http://flask-restful.readthedocs.org/en/latest/api.html#id1)
        database: SQLAlchemy object to initialize with the application
-       db_config: Dictionary of username/password/hostname/database_name
+       db_config: Dictionary of username/password/hostname/database_name (or a full SQLAlchemy uri), optionally with
+                  replicas: list of read replicas, each a hostname or a dict overriding keys of the primary's config
+                  replica_sticky_seconds: how long clients read from the primary after writing (default 5)
+                  pool_size, max_overflow, pool_recycle, pool_timeout, pool_pre_ping: connection pool settings
+                  (see hoops.pool), shared by the primary and the replicas
        log_config: Overrides default logging configuration
+       metrics_args: If given (a dict, possibly empty), records request metrics for the registered resources (see
+                     hoops.metrics) with these settings: route, directory, latency_buckets, size_buckets
+       log_args: Further arguments of hoops.logger.configure_logging, e.g. queue_size, queue_overflow and
+                 reopen_signal to write the logs from a background thread and reopen them for logrotate
        flask_config: Object from which addition flask arguments are parsed (see http://flask.pocoo.org/docs/config/)
        oauth_args: If given, the all Resources will require oauth authentication by default. The arguments given determine how the server's oauth
                    keys are selected based on oauth_provider.py (TODO: set arg signature!)
+       json_encoder: Module (or module name) used to encode responses, e.g. 'json' or 'simplejson'; defaults to
+                     the stdlib json module
+       batch_args: If given (a dict, possibly empty), registers the /batch resource (see hoops.batch.BatchResource) with these
+                   settings: route, max_requests, isolate_failures
+       cache_backend: Backend of the result cache used by operations with a cache_ttl (see hoops.cache), e.g. a
+                      memcache.Client shared by all workers; defaults to an in-process LRU cache
     '''
 
     global flask_app, api, SQLALCHEMY_DATABASE_URI
@@ -43,6 +65,9 @@ def create_api(app_name, rest_args=None, database=None, db_config=None, log_conf
     flask_app = Flask(app_name)
     if flask_config:
         flask_app.config.update(flask_config)
+    flask_app.api_encoder = get_backend(json_encoder)
+    if cache_backend is not None:
+        result_cache.backend = cache_backend
     # only import the API class needed, to avoid oauth deps
     if isinstance(oauth_args, dict):
         rest_args['oauth_args'] = oauth_args
@@ -57,21 +82,61 @@ def create_api(app_name, rest_args=None, database=None, db_config=None, log_conf
         log_level = 'DEBUG'
     else:
         log_level = 'WARNING'
-    configure_logging(app_name, logging_config=log_config, log_level=log_level)
+    configure_logging(app_name, logging_config=log_config, log_level=log_level, **(log_args or {}))
     # prep the database if needed; not all RESTFul APIs will have a database associated with it
     if database is not None and isinstance(db_config, dict):
-        SQLALCHEMY_DATABASE_URI = 'mysql://%(username)s:%(password)s@%(hostname)s/%(database)s?charset=utf8' % db_config
+        SQLALCHEMY_DATABASE_URI = database_uri(db_config)
         flask_app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
+        flask_app.config.update(pool_config(db_config))
+        replicas = replica_uris(db_config)
+        if replicas:
+            binds = dict(flask_app.config.get('SQLALCHEMY_BINDS') or {})
+            binds.update(replicas)
+            flask_app.config['SQLALCHEMY_BINDS'] = binds
+            flask_app.config.setdefault('REPLICA_STICKY_SECONDS', db_config.get('replica_sticky_seconds', 5))
+            use_replicas(database)
         database.init_app(flask_app)
         flask_app.db = database
+        # registered after Flask-SQLAlchemy's handler so that it runs first, rolling back read-only transactions
+        # before any SQLALCHEMY_COMMIT_ON_TEARDOWN commit, and only once streamed responses are done
+        flask_app.teardown_appcontext(end_read_only)
+        instrument_pools(flask_app, database, pre_ping=bool(db_config.get('pool_pre_ping')))
+    engines = [metrics.engine for metrics in getattr(flask_app, 'pool_metrics', {}).values()]
+    init_timing(flask_app)
+    init_query_stats(flask_app, engines)
+    if isinstance(metrics_args, dict):
+        init_metrics(flask_app, api, **metrics_args)
     # locate and register all of the views we can find
     for api_resource in find_subclasses(APIResource):
         if flask_app.config['DEBUG']:
             print "Adding route %s" % api_resource
         api.register(api_resource)
+    if isinstance(batch_args, dict):
+        from hoops.batch import BatchResource
+        batch_resource = BatchResource.configure(api, **batch_args)
+        api.add_resource(batch_resource, batch_resource.route, endpoint=batch_resource.route)
     return flask_app, database, api
 
 
+def database_uri(db_config):
+    '''Returns the SQLAlchemy URI for db_config: its uri, or a MySQL URI built from its parts.'''
+    if db_config.get('uri'):
+        return db_config['uri']
+    return 'mysql://%(username)s:%(password)s@%(hostname)s/%(database)s?charset=utf8' % db_config
+
+
+def replica_uris(db_config):
+    '''Returns the replica binds for db_config as {bind key: URI}.'''
+    uris = {}
+    for (n, replica) in enumerate(db_config.get('replicas') or ()):
+        if not isinstance(replica, dict):
+            replica = {'hostname': replica}
+        config = dict((key, value) for (key, value) in db_config.items() if key not in ('uri', 'replicas'))
+        config.update(replica)
+        uris['%s%d' % (REPLICA_BIND_PREFIX, n)] = database_uri(config)
+    return uris
+
+
 def load_config_file(config_file, environment):
     if not exists(config_file):
         raise Exception('Local configuration file {path} missing.'.format(path=config_file))
@@ -1,53 +1,470 @@
+import base64
 import copy
 import collections
+import csv
+import datetime
+import decimal
+import json
+import operator
+import threading
+import time
+from cStringIO import StringIO
 
-from flask import current_app
-from formencode.validators import Int, OneOf, String
+from flask import Response, current_app, request, stream_with_context
+from flask.ext.sqlalchemy import Pagination
+from formencode import Invalid
+from formencode.validators import Int, OneOf, String, StringBool
+from sqlalchemy import and_, bindparam, or_
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.properties import ColumnProperty
 from werkzeug.exceptions import NotFound
 
 from hoops.base import parameter, APIModelOperation
+from hoops.cache import result_cache
+from hoops.common import ModelSerializer
+from hoops.exc import APIValidationException
 from hoops.response import APIResponse, PaginatedAPIResponse
+from hoops.restful import default_encoder, not_modified
 from hoops.status import library as status_library
 
+# How ListOperation fills in pagination.total; see ListOperation.total_policy
+TOTAL_EXACT = 'exact'
+TOTAL_CACHED = 'cached'
+TOTAL_ESTIMATE = 'estimate'
+TOTAL_NONE = 'none'
+
 
 @parameter('limit', Int(min=1, max=100), "Page size", required=False, default=100)
 @parameter('page', Int(min=0), "Page number", required=False, default=1)
 @parameter('sort_by', String, "Sort field", required=False, default='id')
 # TODO - restrict to sortable field list
 @parameter('sort_order', OneOf(['asc', 'desc']), "Sort direction", required=False, default='asc')
-# TODO - add cursor-style listing
+@parameter('cursor', String(if_missing=None), "Cursor-style listing: next_cursor of the previous page, or empty for the first page")
+@parameter('exact_total', StringBool(if_missing=False), "Always compute an exact total, regardless of the resource's total policy")
+@parameter('fields', String(if_missing=None), "Comma separated list of fields to return")
 class ListOperation(APIModelOperation):
+    '''
+    Lists the items of a model, page by page.
+
+    By default pages are numbered (OFFSET/LIMIT plus a COUNT for the total). If a
+    ``cursor`` parameter is given, or ``cursor_pagination`` is set, keyset
+    pagination is used instead: each page continues after the sort key and id of
+    the last row of the previous page, so deep pages cost the same as the first
+    one. NULL sort keys come first in ascending order (see keyset_query).
+
+    ``total_policy`` (set on the operation or its resource) controls how numbered
+    pages fill in the total:
+       exact: COUNT(*) on every page (the default)
+       cached: COUNT(*) cached for ``total_cache_ttl`` seconds per filtered query
+       estimate: the database's row estimate (MySQL EXPLAIN; cached count elsewhere)
+       none: no total; next_page comes from fetching one extra row
+    Clients can always ask for an exact count with ``exact_total``.
+
+    Pages carry a weak ETag built from the id and etag_column of their rows and
+    their pagination; a matching If-None-Match gets a 304 before anything is
+    serialized.
+    '''
+    cursor_pagination = False
+    total_policy = None
+    total_cache_ttl = 60
 
     def process_request(self, *args, **kwargs):
         super(ListOperation, self).process_request(*args, **kwargs)
-        try:
-            pager = self.paginate_query(self.get_base_query())
-        except NotFound:
-            # 404 is raised when Flask-Alchemy's pagination finds no results with a page > 1
-            raise status_library.exception('API_VALUE_TOO_HIGH', value='page')
+        if self.cursor_pagination or self.params.get('cursor') is not None:
+            # the next cursor is built from the last row's sort key
+            query = self.select_fields(self.get_base_query(), self.params.get('sort_by', 'id'))
+            pager = self.paginate_query_by_cursor(query)
+        else:
+            try:
+                pager = self.paginate_query(self.select_fields(self.get_base_query()))
+            except NotFound:
+                # 404 is raised when Flask-Alchemy's pagination finds no results with a page > 1
+                raise status_library.exception('API_VALUE_TOO_HIGH', value='page')
+        etag = self.page_etag(pager)
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
         status = (status_library.API_NO_RECORDS_FOUND
                   if not pager.items
                   else status_library.API_OK)
-        return PaginatedAPIResponse(
-            pager.items,
+        response = PaginatedAPIResponse(
+            self.serialize_selected(pager.items),
             pagination=pager,
             params=self.params,
             status=status)
+        response.etag = etag
+        return response
+
+    def page_etag(self, pager):
+        etag_column = self.etag_attribute()
+        if etag_column is None:
+            return None
+        id_column = getattr(self, 'id_column', 'id')
+        rows = [(getattr(item, id_column), getattr(item, etag_column)) for item in pager.items]
+        return self.make_etag((
+            rows,
+            getattr(pager, 'total', None),
+            getattr(pager, 'has_next', None),
+            getattr(pager, 'next_cursor', None),
+        ))
 
     def paginate_query(self, query):
         sort_field = getattr(self.model, self.params.get('sort_by', 'id'))
         sort_field_dir = getattr(sort_field, self.params.get('sort_order', 'asc'))
         sorted_query = query.order_by(sort_field_dir())
-        result = sorted_query.paginate(self.params['page'], self.params['limit'])
-        return result
+        policy = self.get_total_policy()
+        if policy == TOTAL_EXACT:
+            return sorted_query.paginate(self.params['page'], self.params['limit'])
+        return self.paginate_query_without_count(sorted_query, query, policy)
+
+    def get_total_policy(self):
+        if self.params.get('exact_total'):
+            return TOTAL_EXACT
+        return self.total_policy or getattr(self.resource, 'total_policy', None) or TOTAL_EXACT
+
+    def paginate_query_without_count(self, sorted_query, query, policy):
+        '''Like Flask-SQLAlchemy's paginate, but probing for a next page instead of counting.'''
+        page = self.params['page']
+        limit = self.params['limit']
+        if page < 1:
+            raise NotFound()
+        items = sorted_query.limit(limit + 1).offset((page - 1) * limit).all()
+        if not items and page != 1:
+            raise NotFound()
+        has_next = len(items) > limit
+        items = items[:limit]
+        if page == 1 and not has_next:
+            (total, exact) = (len(items), True)
+        elif policy == TOTAL_CACHED:
+            (total, exact) = (total_cache.count(query, self.total_cache_ttl), True)
+        elif policy == TOTAL_ESTIMATE:
+            (total, exact) = estimate_total(query, self.total_cache_ttl)
+        else:
+            (total, exact) = (None, False)
+        return ProbedPagination(sorted_query, page, limit, total, items, has_next, exact)
+
+    def paginate_query_by_cursor(self, query):
+        sort_by = self.params.get('sort_by', 'id')
+        sort_order = self.params.get('sort_order', 'asc')
+        limit = self.params['limit']
+        sort_field = getattr(self.model, sort_by)
+        id_field = getattr(self.model, getattr(self, 'id_column', 'id'))
+        after = None
+        if self.params.get('cursor'):
+            after = decode_cursor(self.params['cursor'], sort_by, sort_order, sort_field, id_field)
+        # fetch one extra row to find out whether there is a next page, rather than counting
+        items = keyset_query(query, sort_field, id_field, sort_order, after).limit(limit + 1).all()
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            next_cursor = encode_cursor(
+                sort_by, sort_order,
+                getattr(last, sort_by), getattr(last, id_field.key)
+            )
+        return CursorPagination(items, limit, self.params.get('cursor'), next_cursor)
+
+
+def keyset_query(query, sort_field, id_field, sort_order, after=None):
+    '''
+    Orders query by sort_field (then id_field) and, if after is given as a
+    (sort value, id) pair, only keeps the rows following that position.
+
+    NULL sort values of a nullable sort_field count as lower than any other, on
+    every database: they come first in ascending order and last in descending order.
+    '''
+    nullable = sort_field is not id_field and is_nullable(sort_field)
+    if after is not None:
+        (sort_value, id_value) = after
+        following = operator.gt if sort_order == 'asc' else operator.lt
+        if sort_field is id_field:
+            query = query.filter(following(id_field, id_value))
+        elif sort_value is None:
+            # among the NULLs, then (ascending) every other row
+            position = and_(sort_field == None, following(id_field, id_value))
+            query = query.filter(or_(position, sort_field != None) if sort_order == 'asc' else position)
+        else:
+            # i.e. (sort_field, id) > (sort_value, id_value)
+            position = or_(
+                following(sort_field, sort_value),
+                and_(sort_field == sort_value, following(id_field, id_value))
+            )
+            query = query.filter(or_(position, sort_field == None) if nullable and sort_order == 'desc' else position)
+    order = [getattr(sort_field, sort_order)()]
+    if nullable:
+        order.insert(0, getattr(sort_field == None, 'desc' if sort_order == 'asc' else 'asc')())
+    if sort_field is not id_field:
+        order.append(getattr(id_field, sort_order)())
+    return query.order_by(*order)
+
+
+def is_nullable(field):
+    '''True if the column of field (a model attribute or a Column) can hold NULLs.'''
+    columns = getattr(getattr(field, 'property', None), 'columns', None) or [field]
+    return any(getattr(column, 'nullable', False) for column in columns)
+
+
+class ProbedPagination(Pagination):
+    '''A page of results whose next page was detected by fetching an extra row.'''
+
+    def __init__(self, query, page, per_page, total, items, has_next, total_exact):
+        super(ProbedPagination, self).__init__(query, page, per_page, total, items)
+        self._has_next = has_next
+        self.total_exact = total_exact
+
+    @property
+    def has_next(self):
+        return self._has_next
+
+
+class TotalCache(object):
+    '''Time limited cache of COUNT(*) results, keyed by the SQL and parameters of the filtered query.'''
+
+    max_entries = 1000
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def key(self, query):
+        statement = query.order_by(None).statement.compile()
+        return (unicode(statement), repr(sorted(statement.params.items())))
+
+    def count(self, query, ttl):
+        key = self.key(query)
+        now = time.time()
+        with self._lock:
+            entry = self._counts.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        total = query.order_by(None).count()
+        with self._lock:
+            if len(self._counts) >= self.max_entries:
+                self._counts = dict(
+                    (k, v) for (k, v) in self._counts.items() if v[1] > now
+                )
+            if len(self._counts) < self.max_entries:
+                self._counts[key] = (total, now + ttl)
+        return total
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+total_cache = TotalCache()
+
+
+def estimate_total(query, ttl):
+    '''
+    Returns (total, exact) using the database's own row estimate for query. Only
+    MySQL's EXPLAIN is supported; other databases fall back to a cached count.
+    '''
+    connection = query.session.connection()
+    if connection.dialect.name != 'mysql':
+        return (total_cache.count(query, ttl), True)
+    compiled = query.order_by(None).statement.compile(dialect=connection.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    plan = connection.execute('EXPLAIN ' + unicode(compiled), *params).fetchall()
+    if not plan or plan[0]['rows'] is None:
+        return (total_cache.count(query, ttl), True)
+    return (int(plan[0]['rows']), False)
+
+
+class CursorPagination(object):
+    '''A page of results obtained through keyset pagination.'''
+
+    def __init__(self, items, per_page, cursor, next_cursor):
+        self.items = items
+        self.per_page = per_page
+        self.cursor = cursor or None
+        self.next_cursor = next_cursor
+
+
+def _cursor_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return unicode(value)
+    return value
 
 
+def _parse_cursor_value(field, value):
+    '''Converts a value read from a cursor to the python type of field's column; raises ValueError if it can't.'''
+    if value is None or isinstance(value, (list, dict)):
+        raise ValueError('cursor value is not a scalar')
+    try:
+        python_type = field.type.python_type
+    except (AttributeError, NotImplementedError):
+        return value
+    if python_type is datetime.datetime:
+        return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S')
+    if python_type is datetime.date:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    if python_type is bool:
+        if not isinstance(value, bool):
+            raise ValueError('cursor value of the wrong type')
+        return value
+    if isinstance(value, bool):
+        raise ValueError('cursor value of the wrong type')
+    if python_type is decimal.Decimal:
+        if not isinstance(value, (basestring, int, long, float)):
+            raise ValueError('cursor value of the wrong type')
+        try:
+            number = decimal.Decimal(unicode(value))
+        except decimal.InvalidOperation:
+            raise ValueError('cursor value is not a number')
+        if not number.is_finite():
+            raise ValueError('cursor value is not a number')
+        return number
+    if python_type in (int, long, float):
+        if not isinstance(value, (int, long, float) if python_type is float else (int, long)):
+            raise ValueError('cursor value of the wrong type')
+        return python_type(value)
+    if issubclass(python_type, basestring) and not isinstance(value, basestring):
+        raise ValueError('cursor value of the wrong type')
+    return value
+
+
+def encode_cursor(sort_by, sort_order, sort_value, id_value):
+    '''Builds the opaque cursor pointing just after the row with the given sort key and id.'''
+    data = json.dumps([sort_by, sort_order, _cursor_value(sort_value), id_value], separators=(',', ':'))
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def decode_cursor(cursor, sort_by, sort_order, sort_field, id_field):
+    '''
+    Returns the (sort value, id) encoded in cursor, which must match the current
+    sorting, with both values converted to the types of sort_field and id_field.
+    The sort value may only be None if sort_field is nullable.
+    '''
+    try:
+        data = base64.urlsafe_b64decode(str(cursor) + '=' * (-len(cursor) % 4))
+        (cursor_sort_by, cursor_sort_order, sort_value, id_value) = json.loads(data)
+        if (cursor_sort_by, cursor_sort_order) != (sort_by, sort_order):
+            raise ValueError('cursor sorting mismatch')
+        if sort_value is not None or sort_field is id_field or not is_nullable(sort_field):
+            sort_value = _parse_cursor_value(sort_field, sort_value)
+        return (sort_value, _parse_cursor_value(id_field, id_value))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        raise status_library.exception('API_INVALID_VALUE', value='cursor')
+
+
+@parameter('format', OneOf(['ndjson', 'csv']), "Output format", required=False, default='ndjson')
+@parameter('sort_by', String, "Sort field", required=False, default='id')
+@parameter('sort_order', OneOf(['asc', 'desc']), "Sort direction", required=False, default='asc')
+@parameter('fields', String(if_missing=None), "Comma separated list of fields to return")
+class ExportOperation(APIModelOperation):
+    '''
+    Streams every item of a model as newline delimited JSON or CSV.
+
+    Bind it as the ``list`` operation of a resource of its own (e.g. routed at
+    /customers/export); the base query, sorting and fields work as in ListOperation.
+    Rows are read batch_size at a time with keyset queries in one transaction and
+    written out batch by batch, so memory use doesn't depend on the table size.
+    '''
+    batch_size = 1000
+
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv',
+    }
+
+    def process_request(self, *args, **kwargs):
+        super(ExportOperation, self).process_request(*args, **kwargs)
+        sort_by = self.params.get('sort_by', 'id')
+        if sort_by not in set(prop.key for prop in class_mapper(self.model).column_attrs):
+            raise APIValidationException(status_library.API_INPUT_VALIDATION_FAILED,
+                                         {'sort_by': 'Unknown field: %s' % sort_by})
+        query = self.select_fields(self.get_base_query(), sort_by)
+        output_format = self.params.get('format', 'ndjson')
+        write = getattr(self, 'write_%s' % output_format)
+        response = Response(stream_with_context(write(self.iter_batches(query))),
+                            mimetype=self.content_types[output_format])
+        if output_format == 'csv':
+            response.headers['Content-Disposition'] = 'attachment; filename=%s.csv' % self.model.__tablename__
+        return response
+
+    def iter_batches(self, query):
+        '''Yields the serialized rows of query, batch_size at a time.'''
+        sort_by = self.params.get('sort_by', 'id')
+        sort_order = self.params.get('sort_order', 'asc')
+        sort_field = getattr(self.model, sort_by)
+        id_field = getattr(self.model, getattr(self, 'id_column', 'id'))
+        fields = self.selected_fields()
+        after = None
+        while True:
+            items = keyset_query(query, sort_field, id_field, sort_order, after).limit(self.batch_size).all()
+            if not items:
+                return
+            yield [item.to_json(fields=fields) for item in items]
+            if len(items) < self.batch_size:
+                return
+            after = (getattr(items[-1], sort_by), getattr(items[-1], id_field.key))
+
+    def write_ndjson(self, batches):
+        dumps = getattr(current_app, 'api_encoder', default_encoder).dumps
+        for rows in batches:
+            yield ''.join(dumps(row) + '\n' for row in rows)
+
+    def write_csv(self, batches):
+        columns = self.selected_fields() or [name for (name, converter) in ModelSerializer.for_class(self.model).fields]
+        dumps = getattr(current_app, 'api_encoder', default_encoder).dumps
+        buf = StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        for rows in batches:
+            for row in rows:
+                writer.writerow([_csv_value(row.get(column), dumps) for column in columns])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+
+
+def _csv_value(value, dumps):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, (list, dict)):
+        return dumps(value)
+    return str(value)
+
+
+@parameter('fields', String(if_missing=None), "Comma separated list of fields to return")
 class RetrieveOperation(APIModelOperation):
+    '''
+    Responses carry a weak ETag built from the id and etag_column of the row.
+    Requests with an If-None-Match first load just those two columns, and get a
+    304 without the row being loaded if they match.
+    '''
 
     def process_request(self, *args, **kwargs):
         super(RetrieveOperation, self).process_request(*args, **kwargs)
-        return APIResponse(self.fetch())
+        etag_column = self.etag_attribute()
+        if etag_column is not None and request.if_none_match:
+            etag = self.row_etag(self.fetch_signature(etag_column))
+            if etag is not None and request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+        obj = self.fetch()
+        response = APIResponse(self.serialize_selected(obj))
+        if etag_column is not None:
+            response.etag = self.row_etag((getattr(obj, getattr(self, 'id_column', 'id')), getattr(obj, etag_column)))
+        return response
+
+    def fetch_signature(self, etag_column):
+        '''Returns the (id, etag_column) pair of the requested row, or None if there is no such row.'''
+        item_id = self.combined_params.get(self.resource.object_id_param, None)
+        column = getattr(self.model, getattr(self, 'id_column', 'id'))
+        return self.get_base_query().filter(column == item_id).with_entities(
+            column, getattr(self.model, etag_column)).first()
+
+    def row_etag(self, signature):
+        if signature is None:
+            return None
+        return self.make_etag(tuple(signature))
 
 
 class CreateOperation(APIModelOperation):
@@ -59,13 +476,29 @@ class CreateOperation(APIModelOperation):
         db = current_app.db
         db.session.add(obj)
         try:
-            db.session.commit()
+            commit_keeping_state(db.session)
         except IntegrityError:
             db.session.rollback()
             raise status_library.API_DUPLICATE_VALUE  # TODO verify that was the case
         return APIResponse(obj)
 
 
+def commit_keeping_state(session):
+    '''
+    Commits session without expiring the objects in it, so the response can
+    serialize what was just written without reloading each object. Columns the
+    database fills in itself (server defaults) are expired by the flush as usual,
+    and only those are reloaded when read.
+    '''
+    session = session()  # the scoped session's current Session
+    expire_on_commit = session.expire_on_commit
+    session.expire_on_commit = False
+    try:
+        session.commit()
+    finally:
+        session.expire_on_commit = expire_on_commit
+
+
 class NotSpecified(object):
     def __nonzero__(self):
         return False
@@ -77,14 +510,132 @@ class NotSpecified(object):
         return "<unspecified>"
 
 
-class UpdateOperation(APIModelOperation):
+class SingleStatementOperation(APIModelOperation):
+    '''
+    Base of UpdateOperation and DeleteOperation.
+
+    With single_statement set, the row is written by one UPDATE / DELETE whose
+    WHERE clause names the row and holds the model's updates_permitted_clause(),
+    the SQL counterpart of updates_permitted(), instead of going through the
+    session. Only when it touches no row is the row looked up, to tell
+    not found from forbidden. Where the database supports RETURNING, the response
+    comes from the statement itself; otherwise the row is read in the same
+    transaction.
+
+    The mode falls back to the session when the model has no
+    updates_permitted_clause (and writes aren't forced), has listeners for the
+    write (see orm_listener), or is given non-column params. The base query may
+    only filter the model's own table.
+    '''
+    single_statement = False
+    # mapper event whose listeners need the ORM path, the operation attribute forcing
+    # writes, and the status raised when the row may not be written
+    orm_listener = None
+    force_attribute = None
+    forbidden_status = None
+
+    def is_forced(self):
+        return getattr(self, self.force_attribute, False)
+
+    def use_single_statement(self, values=()):
+        if not self.single_statement:
+            return False
+        if not self.is_forced() and not hasattr(self.model, 'updates_permitted_clause'):
+            return False
+        mapper = class_mapper(self.model)
+        if getattr(mapper.dispatch, self.orm_listener):
+            return False
+        return all(mapper.has_property(key) and isinstance(mapper.get_property(key), ColumnProperty)
+                   for key in values)
+
+    def use_returning(self, dialect=None):
+        '''
+        True if the statement can return the row: the dialect (by default the
+        model's database's) has RETURNING and the model no __props__.
+        '''
+        if dialect is None:
+            dialect = current_app.db.session.get_bind(class_mapper(self.model)).dialect
+        return bool(dialect.implicit_returning) and not getattr(self.model, '__props__', None)
+
+    def row_query(self):
+        '''The base query, narrowed to the requested row.'''
+        item_id = self.combined_params.get(self.resource.object_id_param, None)
+        return self.get_base_query().filter(getattr(self.model, getattr(self, 'id_column', 'id')) == item_id)
+
+    def row_statement(self, statement, returning):
+        '''Narrows statement (an update or delete of the model's table) to the requested row, if permitted.'''
+        where = self.row_query().whereclause
+        if not self.is_forced():
+            where = and_(where, self.model.updates_permitted_clause())
+        statement = statement.where(where)
+        if returning:
+            statement = statement.returning(*class_mapper(self.model).local_table.columns)
+        return statement
+
+    def execute_statement(self, statement, returning):
+        '''
+        Executes statement against the requested row (see row_statement); returns
+        the row if returning. Raises not found or forbidden when no row was touched.
+        '''
+        db = current_app.db
+        result = db.session.execute(self.row_statement(statement, returning))
+        row = result.first() if returning else None
+        if (row is None) if returning else (result.rowcount == 0):
+            db.session.rollback()
+            if self.row_query().count() == 0:
+                raise status_library.exception('API_DATABASE_RESOURCE_NOT_FOUND', resource=self.model.__tablename__)
+            raise status_library.exception(self.forbidden_status)
+        # executed outside the ORM's events
+        result_cache.written(db.session, self.model)
+        return row
+
+    def row_object(self, row):
+        '''Returns a detached model object holding the columns of row.'''
+        mapper = class_mapper(self.model)
+        obj = mapper.class_manager.new_instance()
+        for prop in mapper.column_attrs:
+            set_committed_value(obj, prop.key, row[prop.columns[0]])
+        return obj
+
+
+class UpdateOperation(SingleStatementOperation):
+    orm_listener = 'before_update'
+    force_attribute = 'force_update'
+    forbidden_status = 'API_FORBIDDEN_UPDATE'
+
+    def changed_values(self):
+        return dict((param, value) for (param, value) in self.params.items() if not isinstance(value, NotSpecified))
 
     def setup(self, *args, **kwargs):
+        self.object = None
+        # with nothing to change, the row is only looked up and checked
+        changed_values = self.changed_values()
+        if changed_values and self.use_single_statement(changed_values):
+            return
         self.object = self.fetch()
         if not self.object.updates_permitted() and not getattr(self, 'force_update', False):
             raise status_library.API_FORBIDDEN_UPDATE
 
+    def update_row(self):
+        '''The single statement version of process_request.'''
+        mapper = class_mapper(self.model)
+        values = dict((mapper.get_property(key).columns[0], value) for (key, value) in self.changed_values().items())
+        db = current_app.db
+        try:
+            returning = self.use_returning()
+            row = self.execute_statement(mapper.local_table.update().values(values), returning)
+            # the data is serialized before commit expires the object read back
+            data = self.serialize(self.row_object(row) if returning else self.fetch())
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise status_library.exception('API_DATABASE_UPDATE_FAILED',
+                                           resource=self.model.__tablename__)
+        return APIResponse(data)
+
     def process_request(self, *args, **kwargs):
+        if self.object is None:
+            return self.update_row()
         for param in self.params:
             value = self.params.get(param, NotSpecified())
             if not isinstance(value, NotSpecified):
@@ -92,7 +643,7 @@ class UpdateOperation(APIModelOperation):
         db = current_app.db
         db.session.add(self.object)
         try:
-            db.session.commit()
+            commit_keeping_state(db.session)
         except IntegrityError:
             db.session.rollback()
             # TODO verify that was the case
@@ -101,14 +652,42 @@ class UpdateOperation(APIModelOperation):
         return APIResponse(self.object)
 
 
-class DeleteOperation(APIModelOperation):
+class DeleteOperation(SingleStatementOperation):
+    orm_listener = 'before_delete'
+    force_attribute = 'force_delete'
+    forbidden_status = 'API_FORBIDDEN_DELETE'
 
     def setup(self, *args, **kwargs):
+        self.object = None
+        if self.use_single_statement():
+            return
         self.object = self.fetch()
         if not self.object.updates_permitted() and not getattr(self, 'force_delete', False):
             raise status_library.API_FORBIDDEN_DELETE
 
+    def delete_row(self):
+        '''The single statement version of process_request.'''
+        table = class_mapper(self.model).local_table
+        db = current_app.db
+        try:
+            if self.use_returning():
+                data = self.serialize(self.row_object(self.execute_statement(table.delete(), True)))
+            else:
+                # the response holds the deleted row, which has to be read first
+                data = self.serialize(self.fetch())
+                self.execute_statement(table.delete(), False)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise status_library.exception(
+                'API_DATABASE_DELETE_FAILED',
+                resource=self.model.__tablename__
+            )
+        return APIResponse(data)
+
     def process_request(self, *args, **kwargs):
+        if self.object is None:
+            return self.delete_row()
         try:
             db = current_app.db
             db.session.delete(self.object)
@@ -124,6 +703,306 @@ class DeleteOperation(APIModelOperation):
         return APIResponse(self.object)
 
 
+class BulkOperation(APIModelOperation):
+    '''
+    Base for operations applied to every item of a JSON array body.
+
+    Each item is validated against the operation schema on its own, and written
+    chunk_size items at a time inside one transaction (or one transaction per
+    chunk with commit_per_chunk). A chunk that violates a constraint is retried
+    item by item, each in its own savepoint, so only the offending items fail.
+
+    Subclasses define write(values), which writes the values of one chunk (as
+    returned by prepare_chunk, without their indexes) without committing, and
+    returns their response_data in the same order.
+
+    The response holds one result per item, in body order, with its own
+    status_code/status_message (and validation_errors or response_data).
+    '''
+    chunk_size = 500
+    commit_per_chunk = False
+    max_items = 10000
+    # model attribute identifying existing items (update/delete)
+    id_column = 'id'
+
+    def validate_input(self):
+        body = request.json
+        if not isinstance(body, list):
+            raise status_library.API_INVALID_DATA_FORMAT
+        if len(body) > self.max_items:
+            raise status_library.API_REQUEST_ENTITY_TOO_LARGE
+        self.items = body
+        self.results = [None] * len(body)
+        return {}
+
+    def set_result(self, index, status, data=None, extra=None):
+        result = {'index': index, 'response_data': data}
+        result.update(status.get_dict())
+        if extra:
+            result.update(extra)
+        self.results[index] = result
+
+    def validate_item(self, index, item):
+        '''Validates one item of the body; returns its params, or None after recording the failure.'''
+        try:
+            if not isinstance(item, dict):
+                raise Invalid('An object is required', item, None)
+            return self._map_fields(self._schema_validator('schema')(item))
+        except Invalid as e:
+            if e.error_dict:
+                failures = {}
+                for field in e.error_dict:
+                    failures[field] = e.error_dict[field].msg
+            else:
+                failures = {"unknown": e.msg}
+            self.set_result(index, status_library.get('API_INPUT_VALIDATION_FAILED'),
+                            extra={'validation_errors': failures})
+
+    def item_id(self, index, item):
+        '''Pops the id out of an item (or takes a bare id); returns None after recording a failure.'''
+        if isinstance(item, dict) and self.id_column in item:
+            item = dict(item)
+            return (item.pop(self.id_column), item)
+        if item is not None and not isinstance(item, (dict, list)):
+            return (item, {})
+        self.set_result(index, status_library.get('API_INPUT_VALIDATION_FAILED'),
+                        extra={'validation_errors': {self.id_column: 'Missing value'}})
+
+    def fetch_chunk(self, chunk):
+        '''
+        Replaces the ids in chunk [(index, (id, value)), ...] by the objects they name,
+        loaded with a single query, recording a failure for the missing ones.
+        '''
+        column = getattr(self.model, self.id_column)
+        ids = [item_id for (index, (item_id, value)) in chunk]
+        objects = dict((unicode(getattr(obj, self.id_column)), obj)
+                       for obj in self.get_base_query().filter(column.in_(ids)))
+        found = []
+        for (index, (item_id, value)) in chunk:
+            obj = objects.get(unicode(item_id))
+            if obj is None:
+                self.set_result(index, status_library.get('API_DATABASE_RESOURCE_NOT_FOUND',
+                                                          resource=self.model.__tablename__))
+            else:
+                found.append((index, (obj, value)))
+        return found
+
+    def prepare_chunk(self, chunk):
+        '''Hook to look up / filter a chunk of (index, value) before it is written.'''
+        return chunk
+
+    def write_failed_status(self):
+        return status_library.get('API_DUPLICATE_VALUE')
+
+    def use_executemany(self, listener, values):
+        '''
+        True if the params in values can be written with plain executemany statements:
+        they only name column attributes and the model has no listener (before_insert,
+        before_update) filling in columns, such as slugs or password hashes.
+        '''
+        mapper = class_mapper(self.model)
+        if getattr(mapper.dispatch, listener):
+            return False
+        for key in set(key for params in values for key in params):
+            if not mapper.has_property(key) or not isinstance(mapper.get_property(key), ColumnProperty):
+                return False
+        return True
+
+    def execute_many(self, statement, rows):
+        '''Executes statement once per set of keys in rows, as each executemany binds the same ones.'''
+        groups = collections.OrderedDict()
+        for row in rows:
+            groups.setdefault(frozenset(row), []).append(row)
+        for group in groups.values():
+            current_app.db.session.execute(statement, group)
+
+    def column_row(self, params):
+        '''Maps params keyed by attribute name to column names.'''
+        mapper = class_mapper(self.model)
+        return dict((mapper.get_property(key).columns[0].key, value) for (key, value) in params.items())
+
+    def write_chunks(self, rows):
+        db = current_app.db
+        try:
+            for start in xrange(0, len(rows), self.chunk_size):
+                chunk = self.prepare_chunk(rows[start:start + self.chunk_size])
+                self.write_chunk(db, chunk)
+                # executemany statements don't go through the ORM's events
+                result_cache.written(db.session, self.model)
+                if self.commit_per_chunk:
+                    db.session.commit()
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+    def write_chunk(self, db, chunk):
+        if not chunk:
+            return
+        try:
+            with db.session.begin_nested():
+                written = self.write([value for (index, value) in chunk])
+        except IntegrityError:
+            if len(chunk) == 1:
+                self.set_result(chunk[0][0], self.write_failed_status())
+                return
+            # find the offending items; the others still go in
+            for (index, value) in chunk:
+                try:
+                    with db.session.begin_nested():
+                        (data, ) = self.write([value])
+                except IntegrityError:
+                    self.set_result(index, self.write_failed_status())
+                else:
+                    self.set_result(index, status_library.API_OK, data)
+            return
+        for ((index, value), data) in zip(chunk, written):
+            self.set_result(index, status_library.API_OK, data)
+
+    def response(self):
+        failed = len([result for result in self.results if result['status_code'] != status_library.API_OK.status_code])
+        return APIResponse(self.results, extra={'succeeded': len(self.results) - failed, 'failed': failed})
+
+
+class BulkCreateOperation(BulkOperation):
+    '''
+    Creates one row per item of the array body.
+
+    Rows are inserted with a single executemany INSERT per chunk, unless
+    return_objects is set or the model has before_insert listeners (slugs, password
+    hashes, ...) or is given non-column params; then the objects go through the
+    session so those run and the response carries the created objects and ids.
+    '''
+    return_objects = False
+
+    def process_request(self, *args, **kwargs):
+        rows = []
+        for (index, item) in enumerate(self.items):
+            params = self.validate_item(index, item)
+            if params is not None:
+                rows.append((index, params))
+        self.write_chunks(rows)
+        return self.response()
+
+    def write(self, values):
+        db = current_app.db
+        # Flask-SQLAlchemy's own after_insert signal tracking is on every model, so only
+        # before_insert listeners keep us from using executemany
+        if not self.return_objects and self.use_executemany('before_insert', values):
+            self.execute_many(class_mapper(self.model).local_table.insert(),
+                              [self.column_row(params) for params in values])
+            return values
+        objects = [self.model(**params) for params in values]
+        db.session.add_all(objects)
+        db.session.flush()
+        return [obj.to_json() for obj in objects]
+
+
+class BulkUpdateOperation(BulkOperation):
+    '''
+    Updates existing rows from an array of objects, each carrying its id (id_column).
+
+    The rows of a chunk are loaded with one query through the resource's base query;
+    rows changing the same columns then share one executemany UPDATE (unless the model
+    has before_update listeners, in which case the objects are updated and flushed).
+    '''
+
+    def process_request(self, *args, **kwargs):
+        rows = []
+        for (index, item) in enumerate(self.items):
+            identified = self.item_id(index, item)
+            if identified is None:
+                continue
+            (item_id, item) = identified
+            params = self.validate_item(index, item)
+            if params is not None:
+                rows.append((index, (item_id, params)))
+        self.write_chunks(rows)
+        return self.response()
+
+    def prepare_chunk(self, chunk):
+        permitted = []
+        for (index, (obj, params)) in self.fetch_chunk(chunk):
+            if not obj.updates_permitted() and not getattr(self, 'force_update', False):
+                self.set_result(index, status_library.get('API_FORBIDDEN_UPDATE'))
+            else:
+                permitted.append((index, (obj, params)))
+        return permitted
+
+    def write_failed_status(self):
+        return status_library.get('API_DATABASE_UPDATE_FAILED', resource=self.model.__tablename__)
+
+    def write(self, values):
+        db = current_app.db
+        changes = [
+            (obj, dict((param, value) for (param, value) in params.items() if not isinstance(value, NotSpecified)))
+            for (obj, params) in values
+        ]
+        if not self.use_executemany('before_update', [changed for (obj, changed) in changes]):
+            for (obj, changed) in changes:
+                for (param, value) in changed.items():
+                    setattr(obj, param, value)
+            db.session.flush()
+            return [obj.to_json() for (obj, changed) in changes]
+
+        mapper = class_mapper(self.model)
+        statement = mapper.local_table.update().where(and_(*[
+            column == bindparam('pk_' + column.key) for column in mapper.primary_key
+        ]))
+        rows = []
+        data = []
+        for (obj, changed) in changes:
+            item = obj.to_json()
+            item.update(changed)
+            data.append(item)
+            if changed:
+                row = self.column_row(changed)
+                row.update(('pk_' + column.key, value)
+                           for (column, value) in zip(mapper.primary_key, mapper.primary_key_from_instance(obj)))
+                rows.append(row)
+                # the session's copy is stale now
+                db.session.expire(obj)
+        self.execute_many(statement, rows)
+        return data
+
+
+class BulkDeleteOperation(BulkOperation):
+    '''
+    Deletes the rows named by an array of ids (or of objects carrying id_column).
+
+    The rows of a chunk are loaded with one query through the resource's base query
+    and removed with one executemany DELETE.
+    '''
+
+    def process_request(self, *args, **kwargs):
+        rows = []
+        for (index, item) in enumerate(self.items):
+            identified = self.item_id(index, item)
+            if identified is not None:
+                rows.append((index, identified))
+        self.write_chunks(rows)
+        return self.response()
+
+    def prepare_chunk(self, chunk):
+        permitted = []
+        for (index, (obj, value)) in self.fetch_chunk(chunk):
+            if not obj.updates_permitted() and not getattr(self, 'force_delete', False):
+                self.set_result(index, status_library.get('API_FORBIDDEN_DELETE'))
+            else:
+                permitted.append((index, (obj, value)))
+        return permitted
+
+    def write_failed_status(self):
+        return status_library.get('API_DATABASE_DELETE_FAILED', resource=self.model.__tablename__)
+
+    def write(self, values):
+        data = [obj.to_json() for (obj, value) in values]
+        for (obj, value) in values:
+            current_app.db.session.delete(obj)
+        current_app.db.session.flush()
+        return data
+
+
 class include_related(parameter):
 
     def __init__(self, field, column, validator, description, required=None, default=None):
@@ -146,6 +1025,8 @@ class include_related(parameter):
 
         def process_request(self, *args, **kwargs):
             output = self.orig_process_request(*args, **kwargs)
+            if not isinstance(output, APIResponse):
+                return output  # e.g. a 304
             to_include = [
                 self.related[param]
                 for param in filter(
@@ -153,10 +1034,13 @@ class include_related(parameter):
                     self.related.keys()
                 )
             ]
-            if not to_include:
+            fields = self.selected_fields() if hasattr(self, 'selected_fields') else None
+            if not to_include and not fields:
                 return output
             data = output.response['response_data']
-            if isinstance(data, collections.Iterable):
+            if hasattr(self, 'serialize'):
+                output.response['response_data'] = self.serialize(data, include_subordinate=to_include)
+            elif isinstance(data, collections.Iterable):
                 output.response['response_data'] = [
                     item.to_json(include_subordinate=to_include)
                     for item in data
@@ -0,0 +1,104 @@
+'''
+Pluggable JSON encoding for API responses.
+
+Objects the encoder backend can't handle natively (models, datetimes, ...) are
+converted through the ``type_encoders`` dispatch table, looked up along the
+object's MRO, instead of a global ``JSONEncoder.default`` monkeypatch. Anything
+else that has a ``to_json()`` method is still encoded through it.
+
+``get_backend`` picks the module doing the actual encoding: the stdlib ``json``
+by default (its C encoder is used for compact output), or any module given by
+name or object that provides a ``json.dumps`` compatible ``dumps``, such as
+simplejson.
+'''
+
+import datetime
+import decimal
+import importlib
+
+# type => function returning a JSON encodable replacement for instances of it
+type_encoders = {
+    datetime.datetime: unicode,
+    datetime.date: unicode,
+    datetime.time: unicode,
+    decimal.Decimal: unicode,
+}
+
+# concrete type => encoder resolved from type_encoders, filled in as types are seen
+_resolved = {}
+
+
+def register_type(klass, encoder):
+    '''Encodes instances of klass (and its subclasses) as encoder(instance).'''
+    type_encoders[klass] = encoder
+    _resolved.clear()
+
+
+def _resolve(klass):
+    for base in klass.__mro__:
+        if base in type_encoders:
+            return type_encoders[base]
+    to_json = getattr(klass, 'to_json', None)
+    if to_json is not None:
+        return to_json
+    return None
+
+
+def encode_default(obj):
+    '''``default`` hook handed to the backend's dumps.'''
+    klass = type(obj)
+    try:
+        encoder = _resolved[klass]
+    except KeyError:
+        encoder = _resolved[klass] = _resolve(klass)
+    if encoder is None:
+        raise TypeError('%r is not JSON serializable' % (obj, ))
+    return encoder(obj)
+
+
+_native = (basestring, int, long, float, bool, type(None))
+
+
+def to_plain(obj):
+    '''Returns obj as plain dicts/lists/scalars, converting everything else as encode_default does.'''
+    if isinstance(obj, _native):
+        return obj
+    if isinstance(obj, dict):
+        return dict((key, to_plain(value)) for (key, value) in obj.iteritems())
+    if isinstance(obj, (list, tuple)):
+        return [to_plain(value) for value in obj]
+    return to_plain(encode_default(obj))
+
+
+class JSONBackend(object):
+    '''Encodes response bodies with a json-compatible module.'''
+
+    def __init__(self, module):
+        self.module = module
+        self.name = module.__name__
+
+    def dumps(self, obj, indent=None, default=encode_default):
+        '''Compact output by default; sorted and indented when indent is given.'''
+        if indent:
+            return self.module.dumps(obj, default=default, sort_keys=True,
+                                     indent=indent, separators=(',', ': '))
+        return self.module.dumps(obj, default=default, separators=(',', ':'))
+
+    def __repr__(self):
+        return '<JSONBackend %s>' % self.name
+
+
+def get_backend(encoder=None):
+    '''
+    Returns a JSONBackend for encoder, which may be None (stdlib json), a module
+    name such as 'json' or 'simplejson', a module, or a JSONBackend.
+    '''
+    if isinstance(encoder, JSONBackend):
+        return encoder
+    if encoder is None:
+        encoder = 'json'
+    if isinstance(encoder, basestring):
+        encoder = importlib.import_module(encoder)
+    if not callable(getattr(encoder, 'dumps', None)):
+        raise ValueError('JSON encoder %r has no dumps()' % (encoder, ))
+    return JSONBackend(encoder)
@@ -1,20 +1,35 @@
+import atexit
 import logging
 from logging import Filter, Formatter
 import logging.config
+import logging.handlers
+import Queue
+import signal
+import threading
 import time
 import yaml
 import traceback
 import os
 
-from flask import request
+from flask import has_request_context, request
+
+from hoops.queries import current_queries
+from hoops.timing import current_timings
 
 this_dir = os.path.abspath(os.path.dirname(__file__))
 
 
-def configure_logging(app_name, config_filename=this_dir + '/logging.yaml', log_level='ERROR', log_path='.', logging_config=None):
+def configure_logging(app_name, config_filename=this_dir + '/logging.yaml', log_level='ERROR', log_path='.', logging_config=None,
+                      queue_size=0, queue_overflow='drop', reopen_signal=None):
     """
     Configures the logging according to the setting in the config file and the other parameters
+
+    With a queue_size, the handlers of the configured loggers are moved behind a queue of that many records,
+    written out by a background thread (see LogQueue); queue_overflow is what a full queue does with a new
+    record: 'drop' it (counted in queue_stats()) or 'block' until there is room.
+    reopen_signal (e.g. signal.SIGHUP) makes ReopenableFileHandlers reopen their files, for logrotate.
     """
+    stop_log_queue()
     if type(logging_config) is not dict:
         config_filename = config_filename or this_dir + '/logging.yaml'
         log_level = log_level or 'ERROR'
@@ -35,6 +50,14 @@ def configure_logging(app_name, config_filename=this_dir + '/logging.yaml', log_
     disabled_loglevel = max(logging.getLevelName(log_level) - 1, 1)
     logging.disable(disabled_loglevel)
 
+    if queue_size:
+        loggers = [logging.getLogger(name) for name in logging_config.get('loggers', {})]
+        if 'root' in logging_config:
+            loggers.append(logging.getLogger())
+        start_log_queue(loggers, queue_size, queue_overflow)
+    if reopen_signal is not None:
+        install_reopen_signal(reopen_signal)
+
 
 class ContextFilter(Filter):
     """
@@ -42,20 +65,25 @@ class ContextFilter(Filter):
     """
     def filter(self, record):
 
-        try:
-            if request:
-                # TODO: Only include this metadata when it is written by the log formatter
-                # record.remote_addr = request.remote_addr or 'localhost'
-                # record.request_method = request.environ.get('REQUEST_METHOD')
-                # record.path_info = request.environ.get('PATH_INFO')
-                record.request_uid = request.environ.get('REQUEST_UID', 'request_uid')
-            else:
-                # record.remote_addr = ''
-                # record.request_method = ''
-                # record.path_info = ''
-                record.request_uid = ''
-        except:
-            pass
+        # the filter runs again on the LogQueue's thread, outside of the request: what was
+        # filled in on the request's thread is kept
+        if has_request_context():
+            # TODO: Only include this metadata when it is written by the log formatter
+            # record.remote_addr = request.remote_addr or 'localhost'
+            # record.request_method = request.environ.get('REQUEST_METHOD')
+            # record.path_info = request.environ.get('PATH_INFO')
+            record.request_uid = request.environ.get('REQUEST_UID', 'request_uid')
+        elif not hasattr(record, 'request_uid'):
+            # record.remote_addr = ''
+            # record.request_method = ''
+            # record.path_info = ''
+            record.request_uid = ''
+        timings = current_timings()
+        if timings is not None:
+            record.timings = timings.fields()
+        queries = current_queries()
+        if queries is not None:
+            record.queries = queries.fields()
 
         return True
 
@@ -82,3 +110,189 @@ class UTCFormatter(Formatter):
         exception_message = u"".join(message_array)
 
         return exception_message
+
+
+class ReopenableFileHandler(logging.handlers.WatchedFileHandler):
+    """
+    Once a reopen signal is installed (see configure_logging), reopens its file after reopen_log_files()
+    instead of checking the file on every record; until then, it is a WatchedFileHandler.
+    """
+    def __init__(self, filename, mode='a', encoding=None, delay=False):
+        logging.handlers.WatchedFileHandler.__init__(self, filename, mode, encoding, delay)
+        self._generation = _reopen_generation[0]
+
+    def emit(self, record):
+        if not _reopen_signals:
+            logging.handlers.WatchedFileHandler.emit(self, record)
+            return
+        if self._generation != _reopen_generation[0]:
+            self._generation = _reopen_generation[0]
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+        logging.FileHandler.emit(self, record)
+
+# bumped to make every ReopenableFileHandler reopen its file on its next record
+_reopen_generation = [0]
+# signals calling reopen_log_files
+_reopen_signals = set()
+
+
+def reopen_log_files(*args):
+    """
+    Makes ReopenableFileHandlers reopen their files; safe to use as a signal handler, since the files are
+    reopened by the threads writing to them.
+    """
+    _reopen_generation[0] += 1
+
+
+def install_reopen_signal(signum):
+    """
+    Calls reopen_log_files on signum, along with any handler already installed for it
+    (gunicorn workers, for instance, reopen their own logs on SIGUSR1).
+    """
+    previous = signal.getsignal(signum)
+    # configuring the logging again replaces the handler installed before
+    previous = getattr(previous, 'previous_handler', previous)
+
+    def handler(signum, frame):
+        reopen_log_files()
+        if callable(previous):
+            previous(signum, frame)
+    handler.previous_handler = previous
+    try:
+        signal.signal(signum, handler)
+        _reopen_signals.add(signum)
+    except ValueError:
+        # signals can only be handled from the main thread
+        logging.getLogger('error').warning('Log files can\'t reopen on signal %s outside of the main thread', signum)
+
+
+class QueueHandler(logging.Handler):
+    """
+    Puts the records of one logger on a LogQueue, to be written out by the handlers the logger had.
+    """
+    def __init__(self, log_queue, handlers):
+        logging.Handler.__init__(self)
+        self.log_queue = log_queue
+        self.handlers = handlers
+        # request data is only available on the request's thread
+        self.addFilter(ContextFilter())
+
+    def prepare(self, record):
+        # arguments are formatted now, while the objects they refer to are in the state being logged
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.log_queue.put(self.prepare(record), self.handlers)
+        except Exception:
+            self.handleError(record)
+
+
+class LogQueue(object):
+    """
+    A bounded queue of log records, written out to their handlers by a background thread.
+
+    The thread is started again in processes forked after it started (e.g. by a pre-forking server).
+    """
+    def __init__(self, maxsize, overflow='drop'):
+        if overflow not in ('drop', 'block'):
+            raise ValueError('Unknown queue overflow policy %r' % overflow)
+        self.queue = Queue.Queue(maxsize)
+        self.overflow = overflow
+        self.dropped = self.written = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.stopped = False
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='hoops-log-queue')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Writes out the records queued so far and stops the thread; later records are written synchronously."""
+        self.stopped = True
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+        # records that were put behind the sentinel
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None:
+                self.write(*item)
+        self._thread = self._pid = None
+
+    def put(self, record, handlers):
+        if self.stopped:
+            # e.g. records logged at exit
+            self.write(record, handlers)
+            return
+        if self._pid != os.getpid():
+            self.start()
+        if self.overflow == 'block':
+            self.queue.put((record, handlers))
+            return
+        try:
+            self.queue.put_nowait((record, handlers))
+        except Queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            self.write(*item)
+
+    def write(self, record, handlers):
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        with self._lock:
+            self.written += 1
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'capacity': self.queue.maxsize, 'written': self.written,
+                'dropped': self.dropped}
+
+_log_queue = None
+
+
+def start_log_queue(loggers, maxsize, overflow='drop'):
+    """Moves the handlers of loggers behind a new LogQueue."""
+    global _log_queue
+    log_queue = LogQueue(maxsize, overflow)
+    for logger in loggers:
+        handlers = [handler for handler in logger.handlers if not isinstance(handler, QueueHandler)]
+        if handlers:
+            for handler in handlers:
+                logger.removeHandler(handler)
+            logger.addHandler(QueueHandler(log_queue, handlers))
+    log_queue.start()
+    _log_queue = log_queue
+    return log_queue
+
+
+def stop_log_queue():
+    """Writes out the queued records, and stops the LogQueue."""
+    global _log_queue
+    if _log_queue is not None:
+        _log_queue.stop()
+        _log_queue = None
+
+
+def queue_stats():
+    """Counters of the LogQueue of this process, or None without one."""
+    return _log_queue.stats() if _log_queue is not None else None
+
+atexit.register(stop_log_queue)
@@ -0,0 +1,403 @@
+'''
+Request metrics in the Prometheus text format.
+
+create_api's ``metrics_args`` (a dict, possibly empty) turns them on; API.register
+then records, for each route and method of the resources it registers:
+
+    hoops_requests_total: requests, by http_status and API status_code
+    hoops_request_duration_seconds: latency histogram
+    hoops_requests_in_flight: requests being handled
+    hoops_response_size_bytes: response body size histogram (as sent, compressed or not)
+
+along with the counters of the process's connection pools, result cache and log
+queue. They are served from ``route`` (default /metrics, None not to serve them),
+a plain Flask route that OAuth doesn't cover; ``latency_buckets`` and
+``size_buckets`` replace the default histogram buckets.
+
+Each process keeps its own values, unless ``directory`` names a directory shared
+by the workers of a pre-forking server: each worker then writes its values to
+memory-mapped files of its own there, and a scrape, whichever worker serves it,
+adds up the files of all workers (gauges only those of live workers). Empty the
+directory when the server starts. The pool, cache and log queue counters are
+those of the worker serving the scrape.
+'''
+
+import errno
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+
+from flask import Response, request
+
+from hoops.timing import clock
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class LocalStore(object):
+    '''Values of this process only.'''
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class MmapValues(object):
+    '''
+    Float values by key, in a memory-mapped file written by this process only.
+
+    The file holds the number of bytes used, then entries of a key length, the
+    UTF-8 key, padding, and the value as a double aligned on 8 bytes, so that
+    readers see either the old or the new value.
+    '''
+
+    def __init__(self, path, size=65536):
+        self.path = path
+        self._file = open(path, 'a+b')
+        self._size = max(size, os.fstat(self._file.fileno()).st_size)
+        self._file.truncate(self._size)
+        self._map = mmap.mmap(self._file.fileno(), self._size)
+        self._used = struct.unpack_from('<i', self._map, 0)[0] or 8
+        self._positions = dict((key, position) for (key, value, position) in read_entries(self._map, self._used))
+
+    def add(self, key, amount):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._append(key)
+        value = struct.unpack_from('<d', self._map, position)[0]
+        struct.pack_into('<d', self._map, position, value + amount)
+
+    def _append(self, key):
+        encoded = key.encode('utf-8')
+        position = _align(self._used + 4 + len(encoded))
+        while position + 8 > self._size:
+            self._size *= 2
+            self._file.truncate(self._size)
+            self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), self._size)
+        struct.pack_into('<i%ds' % len(encoded), self._map, self._used, len(encoded), encoded)
+        struct.pack_into('<d', self._map, position, 0.0)
+        self._used = position + 8
+        # written last, so readers don't see the entry before it is complete
+        struct.pack_into('<i', self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+
+def _align(position):
+    return (position + 7) & ~7
+
+
+def read_entries(data, used=None):
+    '''[(key, value, position)] of the MmapValues file content data.'''
+    if used is None:
+        used = struct.unpack_from('<i', data, 0)[0]
+    entries = []
+    position = 8
+    while position < used:
+        length = struct.unpack_from('<i', data, position)[0]
+        key = data[position + 4:position + 4 + length].decode('utf-8')
+        position = _align(position + 4 + length)
+        entries.append((key, struct.unpack_from('<d', data, position)[0], position))
+        position += 8
+    return entries
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class MmapStore(object):
+    '''Values of all the processes writing to directory.'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def add(self, kind, key, amount):
+        with self._lock:
+            if self._pid != os.getpid():
+                # files of the parent process are left to it
+                self._pid = os.getpid()
+                self._files = {}
+            values = self._files.get(kind)
+            if values is None:
+                values = self._files[kind] = MmapValues(os.path.join(self.directory, '%s_%d.db' % (kind, self._pid)))
+            values.add(key, amount)
+
+    def collect(self):
+        totals = {}
+        for path in glob.glob(os.path.join(self.directory, '*_*.db')):
+            (kind, pid) = os.path.basename(path)[:-3].rsplit('_', 1)
+            if kind == 'gauge' and not _alive(int(pid)):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            if len(data) < 8:
+                continue
+            for (key, value, position) in read_entries(data):
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+
+class Metric(object):
+    kind = 'counter'
+    type_name = 'counter'
+
+    def __init__(self, store, name, help, labelnames=()):
+        self.store = store
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._keys = {}
+
+    def key(self, labels, suffix='', bucket=None):
+        '''Store key of a sample, cached as it is the same for every request of a route'''
+        try:
+            return self._keys[(labels, suffix, bucket)]
+        except KeyError:
+            key = self._keys[(labels, suffix, bucket)] = json.dumps([self.name, suffix, list(labels), bucket])
+            return key
+
+    def label_names(self, suffix):
+        return self.labelnames
+
+    def samples(self, values):
+        '''[(suffix, labels, value)] of this metric from {(suffix, labels, bucket): value}'''
+        return [(suffix, labels, value) for ((suffix, labels, bucket), value) in sorted(values.items())]
+
+
+class Counter(Metric):
+
+    def inc(self, labels=(), amount=1):
+        self.store.add(self.kind, self.key(labels), amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+    type_name = 'gauge'
+
+    def inc(self, labels=(), amount=1):
+        self.store.add(self.kind, self.key(labels), amount)
+
+    def dec(self, labels=(), amount=1):
+        self.store.add(self.kind, self.key(labels), -amount)
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, store, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(store, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, labels, value):
+        # buckets are counted apart, and added up when rendered
+        bucket = len(self.buckets)
+        for (index, bound) in enumerate(self.buckets):
+            if value <= bound:
+                bucket = index
+                break
+        self.store.add(self.kind, self.key(labels, '_bucket', bucket), 1)
+        self.store.add(self.kind, self.key(labels, '_sum'), value)
+        self.store.add(self.kind, self.key(labels, '_count'), 1)
+
+    def samples(self, values):
+        samples = []
+        for labels in sorted(set(labels for (suffix, labels, bucket) in values)):
+            cumulative = 0
+            for (index, bound) in enumerate(self.buckets + ('+Inf', )):
+                cumulative += values.get(('_bucket', labels, index), 0)
+                samples.append(('_bucket', labels + (_format_value(bound), ), cumulative))
+            samples.append(('_sum', labels, values.get(('_sum', labels, None), 0)))
+            samples.append(('_count', labels, values.get(('_count', labels, None), 0)))
+        return samples
+
+    def label_names(self, suffix):
+        return self.labelnames + ('le', ) if suffix == '_bucket' else self.labelnames
+
+
+def _format_value(value):
+    if isinstance(value, basestring):
+        return value
+    if value == int(value):
+        return '%d' % value if isinstance(value, (int, long)) else repr(float(value))
+    return repr(value)
+
+
+def _escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample_line(name, labelnames, labels, value):
+    label_text = ','.join('%s="%s"' % (labelname, _escape(label)) for (labelname, label) in zip(labelnames, labels))
+    return u'%s%s %s' % (name, '{%s}' % label_text if label_text else '', _format_value(value))
+
+
+class MetricsRegistry(object):
+    '''Metrics kept in a LocalStore, or in a MmapStore when given a directory.'''
+
+    def __init__(self, directory=None):
+        self.store = MmapStore(directory) if directory else LocalStore()
+        self.metrics = []
+        self.collectors = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(self.store, name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(self.store, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self.store, name, help, labelnames, buckets))
+
+    def add_collector(self, collector):
+        '''
+        Adds metrics read at scrape time: collector() returns a list of
+        (name, type, help, labelnames, [(labels, value)]).
+        '''
+        self.collectors.append(collector)
+
+    def render(self):
+        '''The metrics in the Prometheus text format.'''
+        values = {}
+        for (key, value) in self.store.collect().items():
+            (name, suffix, labels, bucket) = json.loads(key)
+            values.setdefault(name, {})[(suffix, tuple(labels), bucket)] = value
+        lines = []
+        for metric in self.metrics:
+            lines.append(u'# HELP %s %s' % (metric.name, metric.help))
+            lines.append(u'# TYPE %s %s' % (metric.name, metric.type_name))
+            for (suffix, labels, value) in metric.samples(values.get(metric.name, {})):
+                lines.append(_sample_line(metric.name + suffix, metric.label_names(suffix), labels, value))
+        for collector in self.collectors:
+            for (name, type_name, help, labelnames, samples) in collector():
+                lines.append(u'# HELP %s %s' % (name, help))
+                lines.append(u'# TYPE %s %s' % (name, type_name))
+                for (labels, value) in samples:
+                    lines.append(_sample_line(name, labelnames, labels, value))
+        return u'\n'.join(lines) + u'\n'
+
+    def view(self):
+        '''Flask view serving the metrics.'''
+        return Response(self.render().encode('utf-8'), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+class RequestMetrics(object):
+    '''Metrics of the requests to the routes passed to track (API.register does it).'''
+
+    def __init__(self, registry, latency_buckets=LATENCY_BUCKETS, size_buckets=SIZE_BUCKETS):
+        self.routes = set()
+        labelnames = ('route', 'method')
+        self.requests = registry.counter('hoops_requests_total', 'Requests handled',
+                                         labelnames + ('http_status', 'status_code'))
+        self.latency = registry.histogram('hoops_request_duration_seconds', 'Time taken to handle requests',
+                                          labelnames, latency_buckets)
+        self.in_flight = registry.gauge('hoops_requests_in_flight', 'Requests being handled', labelnames)
+        self.size = registry.histogram('hoops_response_size_bytes', 'Size of the response bodies',
+                                       labelnames, size_buckets)
+
+    def track(self, route):
+        self.routes.add(route)
+
+    def init_app(self, app):
+        app.before_request(self.started)
+        app.after_request(self.finished)
+        app.teardown_request(self.ended)
+
+    def started(self):
+        rule = request.url_rule
+        if rule is None or rule.rule not in self.routes:
+            return
+        labels = (rule.rule, request.method)
+        request.environ['hoops.metrics'] = (labels, clock())
+        self.in_flight.inc(labels)
+
+    def finished(self, response):
+        started = request.environ.get('hoops.metrics')
+        if started is not None:
+            (labels, start) = started
+            self.latency.observe(labels, clock() - start)
+            if not (response.direct_passthrough or response.is_streamed):
+                self.size.observe(labels, len(response.get_data()))
+            status_code = request.environ.get('hoops.status_code', '')
+            self.requests.inc(labels + (str(response.status_code), str(status_code)))
+        return response
+
+    def ended(self, exc=None):
+        started = request.environ.pop('hoops.metrics', None)
+        if started is not None:
+            self.in_flight.dec(started[0])
+
+
+def process_collector(app):
+    '''Collector of the pool, result cache and log queue counters of this process.'''
+    from hoops.cache import result_cache
+    from hoops.logger import queue_stats
+    from hoops.pool import pool_stats
+
+    def collect():
+        families = []
+        pools = sorted(pool_stats(app).items())
+        if pools:
+            for counter in ('connects', 'checkouts', 'invalidations', 'ping_failures', 'timeouts'):
+                families.append(('hoops_db_pool_%s_total' % counter, 'counter', 'Connection pool %s' % counter.replace('_', ' '),
+                                 ('bind', ), [((bind or '', ), stats[counter]) for (bind, stats) in pools]))
+            families.append(('hoops_db_pool_checkout_wait_seconds_total', 'counter',
+                             'Time spent getting connections out of the pool', ('bind', ),
+                             [((bind or '', ), stats['checkout_wait']) for (bind, stats) in pools]))
+            families.append(('hoops_db_pool_checkout_wait_max_seconds', 'gauge',
+                             'Longest time spent getting a connection out of the pool', ('bind', ),
+                             [((bind or '', ), stats['checkout_wait_max']) for (bind, stats) in pools]))
+            families.append(('hoops_db_pool_checked_out', 'gauge', 'Connections checked out', ('bind', ),
+                             [((bind or '', ), stats['checked_out']) for (bind, stats) in pools]))
+            # only pools with a fixed size have an overflow
+            families.append(('hoops_db_pool_overflow', 'gauge', 'Connections opened beyond the pool size', ('bind', ),
+                             [((bind or '', ), stats['overflow']) for (bind, stats) in pools
+                              if stats['overflow'] is not None]))
+        cache = result_cache.stats()
+        for counter in ('hits', 'misses', 'invalidations'):
+            families.append(('hoops_result_cache_%s_total' % counter, 'counter', 'Result cache %s' % counter, (),
+                             [((), cache[counter])]))
+        queue = queue_stats()
+        if queue is not None:
+            families.append(('hoops_log_queue_dropped_total', 'counter', 'Log records dropped', (),
+                             [((), queue['dropped'])]))
+            families.append(('hoops_log_queue_queued', 'gauge', 'Log records waiting to be written', (),
+                             [((), queue['queued'])]))
+        return families
+    return collect
+
+
+def init_metrics(app, api, route='/metrics', directory=None, latency_buckets=LATENCY_BUCKETS,
+                 size_buckets=SIZE_BUCKETS):
+    '''Sets up app.metrics (a MetricsRegistry) and the request metrics recorded for the routes api registers.'''
+    registry = app.metrics = MetricsRegistry(directory)
+    api.request_metrics = RequestMetrics(registry, latency_buckets, size_buckets)
+    api.request_metrics.init_app(app)
+    registry.add_collector(process_collector(app))
+    if route:
+        app.add_url_rule(route, 'hoops_metrics', registry.view)
+    return registry
@@ -0,0 +1,159 @@
+'''
+Connection pool settings and instrumentation.
+
+``create_api`` takes the pool settings from ``db_config``:
+
+    pool_size: connections kept open per engine (Flask-SQLAlchemy's default is 10 for MySQL)
+    max_overflow: connections opened beyond pool_size under load, closed again when returned
+    pool_recycle: seconds after which a connection is replaced (keep it below MySQL's wait_timeout)
+    pool_timeout: seconds to wait for a free connection before failing
+    pool_pre_ping: test connections with ``SELECT 1`` on checkout and replace dead ones
+
+and instruments the engine of the database and of each of its binds with a
+PoolMetrics, found in ``flask_app.pool_metrics`` under the bind key (None for
+the primary database). ``pool_stats(app)`` returns a snapshot of all of them.
+
+SQLite engines begin their transactions themselves rather than leaving it to
+pysqlite, which only begins them before data changes and so loses SAVEPOINTs
+(bulk operations retry a failed chunk item by item in savepoints).
+'''
+
+import threading
+
+from sqlalchemy import event, exc
+
+from hoops.timing import clock
+
+# db_config key => Flask-SQLAlchemy setting
+POOL_SETTINGS = {
+    'pool_size': 'SQLALCHEMY_POOL_SIZE',
+    'max_overflow': 'SQLALCHEMY_MAX_OVERFLOW',
+    'pool_recycle': 'SQLALCHEMY_POOL_RECYCLE',
+    'pool_timeout': 'SQLALCHEMY_POOL_TIMEOUT',
+}
+
+
+def pool_config(db_config):
+    '''Returns the Flask-SQLAlchemy settings for the pool settings given in db_config.'''
+    return dict((setting, db_config[key]) for (key, setting) in POOL_SETTINGS.items()
+                if db_config.get(key) is not None)
+
+
+class PoolMetrics(object):
+    '''
+    Counters fed by the events of one engine's pool.
+
+    checkout_wait is the time spent getting a connection out of the pool, which
+    includes waiting for one to be returned and opening new ones; checked_out,
+    size and overflow are read from the pool when taking a snapshot.
+    '''
+    counters = ('connects', 'checkouts', 'checkins', 'invalidations', 'ping_failures', 'timeouts')
+
+    def __init__(self, engine, pre_ping=False):
+        self.engine = engine
+        self.pre_ping = pre_ping
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            for counter in self.counters:
+                setattr(self, counter, 0)
+            self.checkout_wait = 0.0
+            self.checkout_wait_max = 0.0
+
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkout_wait += seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+
+    def instrument(self):
+        '''Listens to the engine's pool events, and times its checkouts.'''
+        pool = self.engine.pool
+        if self.pre_ping:
+            event.listen(pool, 'checkout', self.ping)
+        event.listen(pool, 'connect', lambda *args: self.count('connects'))
+        event.listen(pool, 'checkout', lambda *args: self.count('checkouts'))
+        event.listen(pool, 'checkin', lambda *args: self.count('checkins'))
+        event.listen(pool, 'invalidate', lambda *args: self.count('invalidations'))
+        # pools have no event for the start of a checkout; the subclass keeps its
+        # metrics on the class, so that pools recreated by engine.dispose() keep them too
+        pool.__class__ = type(pool.__class__.__name__, (_TimedCheckout, pool.__class__), {'pool_metrics': self})
+        return self
+
+    def ping(self, dbapi_connection, connection_record, connection_proxy):
+        '''Checkout listener raising DisconnectionError for dead connections, which the pool then replaces.'''
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception:
+            self.count('ping_failures')
+            raise exc.DisconnectionError()
+
+    def snapshot(self):
+        pool = self.engine.pool
+        with self._lock:
+            stats = dict((counter, getattr(self, counter)) for counter in self.counters)
+            stats['checkout_wait'] = self.checkout_wait
+            stats['checkout_wait_max'] = self.checkout_wait_max
+        stats['checked_out'] = pool.checkedout() if hasattr(pool, 'checkedout') else stats['checkouts'] - stats['checkins']
+        stats['size'] = pool.size() if hasattr(pool, 'size') else None
+        stats['overflow'] = max(pool.overflow(), 0) if hasattr(pool, 'overflow') else None
+        return stats
+
+
+class _TimedCheckout(object):
+    pool_metrics = None
+
+    def _do_get(self):
+        # QueuePool._do_get calls itself again when it loses a race for an overflow slot
+        local = self.pool_metrics._local
+        if getattr(local, 'timing', False):
+            return super(_TimedCheckout, self)._do_get()
+        local.timing = True
+        start = clock()
+        try:
+            return super(_TimedCheckout, self)._do_get()
+        except exc.TimeoutError:
+            self.pool_metrics.count('timeouts')
+            raise
+        finally:
+            local.timing = False
+            self.pool_metrics.record_wait(clock() - start)
+
+
+def _sqlite_autocommit(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+def _sqlite_begin(connection):
+    # on the DBAPI connection, like pysqlite's own BEGIN, so it isn't timed and counted as a statement
+    connection.connection.execute('BEGIN')
+
+
+def begin_sqlite_transactions(engine):
+    '''Makes engine issue the BEGIN of its transactions instead of pysqlite, so that SAVEPOINTs work.'''
+    event.listen(engine, 'connect', _sqlite_autocommit)
+    event.listen(engine, 'begin', _sqlite_begin)
+
+
+def instrument_pools(app, database, pre_ping=False):
+    '''Creates the engines of database for app, instrumented with PoolMetrics, into app.pool_metrics.'''
+    app.pool_metrics = {}
+    for bind in [None] + sorted(app.config.get('SQLALCHEMY_BINDS') or {}):
+        engine = database.get_engine(app, bind=bind)
+        if engine.dialect.name == 'sqlite':
+            begin_sqlite_transactions(engine)
+        app.pool_metrics[bind] = PoolMetrics(engine, pre_ping=pre_ping).instrument()
+    return app.pool_metrics
+
+
+def pool_stats(app):
+    '''Returns {bind key: PoolMetrics snapshot} for app's engines.'''
+    return dict((bind, metrics.snapshot()) for (bind, metrics) in getattr(app, 'pool_metrics', {}).items())
@@ -0,0 +1,147 @@
+'''
+Per-request SQL statement statistics.
+
+Each request counts the statements it executes, the time they take, and how many
+times each statement (the SQL text with its placeholders, so the same query with
+other parameters counts as a repeat) runs. At the end of the request the counts
+are logged by the ``api.request`` logger, and they are added as a ``queries`` field
+to the request's log records (see hoops.logger.ContextFilter).
+
+Per-item patterns (lazy relationships, fetching in a loop) show up as repeats.
+In DEBUG, a statement running more than QUERY_REPEAT_LIMIT times (default 10,
+None to allow any) in one request logs a warning, or raises RepeatedQueryError
+where it ran once too many if QUERY_REPEAT_ACTION is 'fail'.
+
+Statements are only counted with the QUERY_STATS config value set, and within
+``query_budget`` blocks, with which tests can hold endpoints to a number of
+statements. The same engine listener times the statements for the ``db`` phase
+of hoops.timing.
+'''
+
+import collections
+import contextlib
+import logging
+
+from flask import _app_ctx_stack, current_app, g
+from sqlalchemy import event
+
+from hoops.timing import clock, current_timings
+
+request_logger = logging.getLogger('api.request')
+
+# longest SQL text kept in the log fields
+STATEMENT_LOG_CHARS = 200
+
+
+class RepeatedQueryError(Exception):
+    pass
+
+
+class RequestQueries(object):
+    '''Statements executed by one request (and by the calls of a batch request).'''
+
+    def __init__(self, repeat_limit=None):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = collections.Counter()
+        self.repeat_limit = repeat_limit
+        self.warned = set()
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+        if self.repeat_limit is not None and self.statements[statement] > self.repeat_limit:
+            self.repeated(statement)
+
+    def repeated(self, statement):
+        message = 'Statement ran %d times in one request: %s' % (self.statements[statement], statement)
+        if current_app.config.get('QUERY_REPEAT_ACTION', 'warn') == 'fail':
+            raise RepeatedQueryError(message)
+        if statement not in self.warned:
+            self.warned.add(statement)
+            request_logger.warning(message)
+
+    def repeats(self, top=5):
+        '''[(statement, times)] of the statements run more than once, most repeated first.'''
+        return [(statement, times) for (statement, times) in self.statements.most_common(top) if times > 1]
+
+    def fields(self):
+        '''Log record field'''
+        return {
+            'count': self.count,
+            'ms': round(self.seconds * 1000, 3),
+            'repeated': dict((statement[:STATEMENT_LOG_CHARS], times) for (statement, times) in self.repeats()),
+        }
+
+
+def current_queries():
+    '''The RequestQueries of the current request, or None if it isn't counted.'''
+    ctx = _app_ctx_stack.top
+    return getattr(ctx.g, 'request_queries', None) if ctx is not None else None
+
+
+def start_counting():
+    app = current_app
+    if app.config.get('QUERY_STATS', False) or getattr(app, 'query_budgets', None):
+        limit = app.config.get('QUERY_REPEAT_LIMIT', 10) if app.debug else None
+        g.request_queries = RequestQueries(limit)
+
+
+def log_queries(response):
+    queries = current_queries()
+    if queries is not None:
+        if current_app.config.get('QUERY_STATS', False):
+            request_logger.info('%d statements in %.1f ms', queries.count, queries.seconds * 1000)
+        for budget in getattr(current_app, 'query_budgets', ()):
+            budget.append(queries)
+    return response
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_queries() is not None or current_timings() is not None:
+        context._hoops_started = clock()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_hoops_started', None)
+    if started is not None:
+        seconds = clock() - started
+        queries = current_queries()
+        if queries is not None:
+            queries.add(statement, seconds)
+        timings = current_timings()
+        if timings is not None:
+            timings.add('db', seconds)
+
+
+def init_query_stats(app, engines=()):
+    '''Counts the statements each request of app executes on engines, and times them for hoops.timing.'''
+    app.before_request(start_counting)
+    app.after_request(log_queries)
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _before_execute)
+        event.listen(engine, 'after_cursor_execute', _after_execute)
+
+
+@contextlib.contextmanager
+def query_budget(app, max_queries):
+    '''
+    Fails (AssertionError) if a request made to app within the block executed more than max_queries statements.
+
+        with query_budget(self.app, 2):
+            self.client.get('/partners')
+
+    Yields the list of RequestQueries of those requests.
+    '''
+    budget = []
+    app.query_budgets = getattr(app, 'query_budgets', []) + [budget]
+    try:
+        yield budget
+    finally:
+        app.query_budgets = [other for other in app.query_budgets if other is not budget]
+    for queries in budget:
+        if queries.count > max_queries:
+            raise AssertionError('%d statements run, over the budget of %d:\n%s' % (
+                queries.count, max_queries, '\n'.join('%d x %s' % (times, statement) for (statement, times)
+                                                       in queries.statements.most_common())))
@@ -0,0 +1,78 @@
+'''
+Read-only transactions for read operations.
+
+APIResource.dispatch_operation calls ``use_read_only`` for every operation.
+Operations that want it (GET requests by default, see
+APIOperation.read_only_transaction) run in a read-only session mode:
+
+    - autoflush is off
+    - transactions start with the ``read_only_statements`` entry of the
+      database (START TRANSACTION READ ONLY on MySQL 5.6.5+, SET TRANSACTION
+      READ ONLY on PostgreSQL); drop the entry for servers that lack it
+    - flushing changes raises ReadOnlyTransactionError
+    - the transaction is rolled back at the end of the request, never committed
+
+The mode belongs to the request's session, so an operation that wants to
+write (such as the next call of a batch) first ends the read-only transaction.
+'''
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# key of Session.info present (holding the autoflush setting to restore) while the session is read only
+READ_ONLY = 'hoops_read_only'
+
+# dialect name => statement starting a read-only transaction
+read_only_statements = {
+    'mysql': 'START TRANSACTION READ ONLY',
+    'postgresql': 'SET TRANSACTION READ ONLY',
+}
+
+
+class ReadOnlyTransactionError(Exception):
+    pass
+
+
+def _session():
+    db = getattr(current_app, 'db', None)
+    return db.session() if db is not None else None
+
+
+def use_read_only(read_only):
+    '''Switches the request's session in or out of the read-only mode.'''
+    session = _session()
+    if session is None or (READ_ONLY in session.info) == bool(read_only):
+        return
+    if read_only:
+        session.info[READ_ONLY] = session.autoflush
+        session.autoflush = False
+    else:
+        # the transaction may have started read only
+        session.rollback()
+        session.autoflush = session.info.pop(READ_ONLY)
+
+
+def end_read_only(response_or_exc):
+    '''Teardown handler rolling back read-only transactions (ahead of any SQLALCHEMY_COMMIT_ON_TEARDOWN).'''
+    db = getattr(current_app, 'db', None)
+    if db is not None and db.session.registry.has():
+        session = db.session()
+        if READ_ONLY in session.info:
+            session.rollback()
+            session.autoflush = session.info.pop(READ_ONLY)
+    return response_or_exc
+
+
+@event.listens_for(Session, 'after_begin')
+def _begin_read_only(session, transaction, connection):
+    if READ_ONLY in session.info and not transaction.nested:
+        statement = read_only_statements.get(connection.dialect.name)
+        if statement:
+            connection.execute(statement)
+
+
+@event.listens_for(Session, 'before_flush')
+def _reject_writes(session, flush_context, instances):
+    if READ_ONLY in session.info and (session.new or session.dirty or session.deleted):
+        raise ReadOnlyTransactionError('Changes can\'t be flushed in a read-only transaction')
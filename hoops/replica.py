@@ -0,0 +1,103 @@
+'''
+Routes reads to read replicas.
+
+``create_api`` registers each entry of ``db_config['replicas']`` as a
+``replica_<n>`` bind and swaps the database's session for a RoutingSession.
+APIResource.dispatch_operation then calls ``route_request`` for every
+operation: operations that want a replica (GET requests by default, see
+APIOperation.read_replica) read from one chosen at random, everything else
+(and every flush) goes to the primary.
+
+Clients that just wrote something are kept on the primary for
+REPLICA_STICKY_SECONDS (default 5) so they read their own writes despite
+replication lag. Clients are told apart by address (honouring X-Forwarded-For),
+and this is tracked per process.
+'''
+
+import random
+import threading
+import time
+from functools import partial
+
+from flask import current_app, g, has_request_context, request, _app_ctx_stack
+from flask.ext.sqlalchemy import _SignallingSession
+from sqlalchemy import orm
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+
+class StickyClients(object):
+    '''Clients that wrote recently, with the time until which they stay on the primary.'''
+
+    def __init__(self, prune_every=1000):
+        self._until = {}
+        self._lock = threading.Lock()
+        self._prune_every = prune_every
+        self._marks = 0
+
+    def mark(self, client, seconds):
+        now = time.time()
+        with self._lock:
+            self._until[client] = now + seconds
+            self._marks += 1
+            if self._marks % self._prune_every == 0:
+                for (key, until) in self._until.items():
+                    if until <= now:
+                        del self._until[key]
+
+    def is_sticky(self, client):
+        return self._until.get(client, 0) > time.time()
+
+    def clear(self):
+        with self._lock:
+            self._until.clear()
+
+sticky_clients = StickyClients()
+
+
+def replica_binds(app):
+    return sorted(key for key in (app.config.get('SQLALCHEMY_BINDS') or {})
+                  if key.startswith(REPLICA_BIND_PREFIX))
+
+
+def client_key():
+    return (request.access_route or [request.remote_addr])[0]
+
+
+def route_request(use_replica):
+    '''Picks the bind reads of the current request go to: a replica, or None for the primary.'''
+    binds = replica_binds(current_app)
+    g.replica_bind = None
+    if not binds or not has_request_context():
+        return
+    client = client_key()
+    if request.method != 'GET':
+        sticky_clients.mark(client, current_app.config.get('REPLICA_STICKY_SECONDS', 5))
+    if use_replica and not sticky_clients.is_sticky(client):
+        g.replica_bind = random.choice(binds)
+
+
+class RoutingSession(_SignallingSession):
+    '''Sends reads to the replica picked by route_request; flushes always use the primary.'''
+
+    def __init__(self, db, *args, **kwargs):
+        self.db = db
+        super(RoutingSession, self).__init__(db, *args, **kwargs)
+
+    def get_bind(self, mapper=None, clause=None):
+        bind_key = getattr(g, 'replica_bind', None) if _app_ctx_stack.top is not None else None
+        if bind_key is not None and not self._flushing:
+            # tables with a bind of their own are left alone
+            if mapper is None or mapper.mapped_table.info.get('bind_key') is None:
+                return self.db.get_engine(self.app, bind=bind_key)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+def use_replicas(db):
+    '''Replaces db.session with a scoped RoutingSession, created with the session options of the one it replaces.'''
+    factory = db.session.session_factory
+    # Flask-SQLAlchemy's factory is a partial; a sessionmaker keeps its options in kw
+    options = dict(getattr(factory, 'keywords', None) or getattr(factory, 'kw', None) or {})
+    scopefunc = getattr(db.session.registry, 'scopefunc', _app_ctx_stack.__ident_func__)
+    db.session = orm.scoped_session(partial(RoutingSession, db, **options), scopefunc=scopefunc)
+    return db
@@ -14,6 +14,8 @@ response_template = {
 class APIResponse(object):
     response = None
     status = None
+    # weak ETag of the response, if any; see APIModelOperation.make_etag
+    etag = None
 
     def __init__(self, data, extra=None, status=None):
         self.response = copy.deepcopy(response_template)
@@ -37,18 +39,38 @@ class PaginatedAPIResponse(APIResponse):
         if extra is None:
             extra = {}
 
-        if pagination:
-            offset = pagination.per_page * (pagination.page - 1)
+        if pagination and hasattr(pagination, 'next_cursor'):
+            extra["pagination"] = {
+                "limit": pagination.per_page,
+                "cursor": pagination.cursor,
+                "next_cursor": pagination.next_cursor,
+                "sort_by": params.get('sort_by', 'id'),
+                "sort_dir": params.get('sort_order', 'asc'),
+            }
+        elif pagination:
+            if hasattr(pagination, 'has_next'):
+                has_next = pagination.has_next
+            else:
+                offset = pagination.per_page * (pagination.page - 1)
+                has_next = offset + pagination.per_page < pagination.total
             extra["pagination"] = {
                 "page": pagination.page,
                 "limit": pagination.per_page,
-                "next_page": (
-                    pagination.page + 1
-                    if offset + pagination.per_page < pagination.total
-                    else None),
+                "next_page": pagination.page + 1 if has_next else None,
                 "total": pagination.total,
                 "sort_by": params.get('sort_by', 'id'),
-                "sort_dir": params.get('sort_dir', 'asc'),
+                "sort_dir": params.get('sort_order', 'asc'),
             }
+            if not getattr(pagination, 'total_exact', True):
+                extra["pagination"]["total_exact"] = False
 
         APIResponse.__init__(self, data, extra, status)
+
+
+class CachedAPIResponse(APIResponse):
+    '''A response envelope restored from the result cache (see hoops.cache).'''
+
+    def __init__(self, http_status, response, etag=None):
+        self.response = response
+        self.etag = etag
+        self.status = hoops.status.APIStatus(http_status, response['status_code'], response['status_message'])
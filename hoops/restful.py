@@ -1,16 +1,22 @@
 from functools import wraps
-import json
+import random
+import re
 import sys
 import traceback
+import zlib
 from copy import deepcopy
 from flask.ext import restful
 from flask import make_response, request, Markup, g, current_app
+from werkzeug.datastructures import Headers
 from werkzeug.exceptions import HTTPException
 
 from hoops.status import library as status_library
+from hoops.cache import result_cache
 from hoops.response import APIResponse
 from hoops.exc import APIException, APIValidationException
+from hoops.json_encoding import get_backend
 from hoops.status import APIStatus
+from hoops.timing import current_timings, phase
 from hoops.utils import Struct
 import logging
 
@@ -23,11 +29,17 @@ error_map = {
     501: status_library.API_CODE_NOT_IMPLEMENTED,
 }
 
+# used for apps that weren't set up through create_api
+default_encoder = get_backend()
+
 api_logger = logging.getLogger('api.info')
 request_logger = logging.getLogger('api.request')
 api_error_logger = logging.getLogger('api.error')
 error_logger = logging.getLogger('error')
 
+# request.environ key of the OAuth credentials require_oauth verified the request with
+OAUTH_CREDENTIALS = 'hoops.oauth_credentials'
+
 
 class Resource(restful.Resource):
     # applies to all inherited resources; OauthAPI will append 'require_oauth' on init
@@ -35,6 +47,9 @@ class Resource(restful.Resource):
 
 
 class API(restful.Api):
+    # hoops.metrics.RequestMetrics of the registered routes, if metrics are on
+    request_metrics = None
+
     def __init__(self, *args, **kwargs):
         super(API, self).__init__(*args, **kwargs)
         self.representations = {
@@ -49,36 +64,34 @@ class API(restful.Api):
             message = getattr(args[0], 'response', None).get('status_message', None)
         except:
             message = args[0]
-        request_logger.info('%s: %s', response.data, message)
+        request.environ['hoops.status_code'] = getattr(getattr(args[0], 'status', None), 'status_code', '')
+        request_logger.info('%s: %s', LogExcerpt(response.data, log_excerpt_bytes()), message)
         if response.status_code >= 500:
-            error_logger.exception('%s: %s', response.data, message)
-        return response
+            error_logger.exception('%s: %s', LogExcerpt(response.data, log_excerpt_bytes()), message)
+        return compress_response(response)
 
     def handle_error(self, e):
+        response = self.error_response(e)
+        return self.make_response(response, response.status.http_status)
+
+    def error_response(self, e):
+        """Builds the APIResponse envelope describing exception e"""
         if isinstance(e, HTTPException):
-            return self.make_response(
-                APIResponse(None, status=error_map.get(e.code, APIStatus(http_status=e.code, status_code=e.code * 10, message=e.description))),
-                e.code)
+            return APIResponse(None, status=error_map.get(e.code, APIStatus(http_status=e.code, status_code=e.code * 10, message=e.description)))
         elif isinstance(e, APIValidationException):
-            return self.make_response(
-                APIResponse(None, status=e.status, extra=e.extra),
-                e.status.http_status)
+            return APIResponse(None, status=e.status, extra=e.extra)
         elif isinstance(e, APIException):
-            return self.make_response(
-                APIResponse(None, status=e.status),
-                e.status.http_status)
+            return APIResponse(None, status=e.status)
         status = status_library.API_UNHANDLED_EXCEPTION
         if current_app.config.get('DEBUG'):
             tb_info = sys.exc_info()
-            return self.make_response(
-                APIResponse(None, status=status, extra={
-                    'exception': traceback.format_exception_only(tb_info[0], tb_info[1])[0],
-                    'traceback': traceback.extract_tb(tb_info[2])
-                }), status.http_status)
+            return APIResponse(None, status=status, extra={
+                'exception': traceback.format_exception_only(tb_info[0], tb_info[1])[0],
+                'traceback': traceback.extract_tb(tb_info[2])
+            })
         # We don't use the default error handler
         # e.g.: return super(API, self).handle_error(e)
-        return self.make_response(
-            APIResponse(None, status=status), status.http_status)
+        return APIResponse(None, status=status)
 
     def _should_use_fr_error_handler(self):
         """ Determine if error should be handled with FR or default Flask
@@ -109,6 +122,15 @@ class API(restful.Api):
         if routes:
             [api_logger.debug('Adding route %s' % route) for route in routes]
             self.add_resource(cls, *routes, endpoint=cls.route)
+            if self.request_metrics is not None:
+                for route in routes:
+                    self.request_metrics.track(route)
+        # merge resource and operation schemas now rather than on every request
+        for (method, operation) in getattr(cls, 'operations', lambda: [])():
+            operation.compile_schemas()
+            # writes must invalidate cached responses even in processes that haven't cached any yet
+            for model in operation.cached_models():
+                result_cache.watch(model)
 
 
 class OAuthAPI(API):
@@ -133,14 +155,21 @@ def require_oauth(func):
         from hoops.oauth_provider import oauth_authentication
         # TODO: read server_oauth_creds from args/func
         server_oauth_creds = {}
-        oauth_creds = oauth_authentication(server_oauth_creds)
+        with phase('oauth'):
+            oauth_creds = oauth_authentication(server_oauth_creds)
         if not oauth_creds:
             # This is highly unlikely to occur, as oauth raises exceptions on problems
             restful.abort(401)  # pragma: no cover
+        request.environ[OAUTH_CREDENTIALS] = oauth_creds
         return func(*args, **kwargs)
     return wrapper
 
 
+def oauth_credentials():
+    """Returns the OAuth credentials (consumer_key, token, ...) the current request was verified with, or None."""
+    return request.environ.get(OAUTH_CREDENTIALS)
+
+
 def prepare_output(data, code, headers=None):
     if not isinstance(data, APIResponse):
         data = APIResponse(data, status=error_map.get(code, APIStatus(
@@ -150,23 +179,158 @@ def prepare_output(data, code, headers=None):
     out = data.to_json()
     code = data.status.http_status
 
-    return_string = unicode(data.response)
-    response_data = unicode(data.response.get('response_data')) if data.response.get('response_data') else return_string
-
-    request_logger.info('Response %d chars: %s...', len(return_string), unicode(response_data[:50]))
-    request_logger.debug('Response body: %s', return_string)
+    # rendered only if the records are written, see LogExcerpt
+    request_logger.info('Response: %s', LogExcerpt(data.response.get('response_data') or data.response, log_excerpt_bytes()))
+    if request_logger.isEnabledFor(logging.DEBUG) and log_body_sampled():
+        request_logger.debug('Response body: %s', LogExcerpt(data.response, current_app.config.get('LOG_BODY_MAX_BYTES')))
 
     return out, code
 
 
+class LogExcerpt(object):
+    """Log message argument rendering value (cut to max_bytes of UTF-8, unless None) when the record is formatted"""
+
+    def __init__(self, value, max_bytes=None):
+        self.value = value
+        self.max_bytes = max_bytes
+
+    def __unicode__(self):
+        value = self.value
+        if isinstance(value, str):
+            if self.max_bytes is not None and len(value) > self.max_bytes:
+                return value[:self.max_bytes].decode('utf-8', 'ignore') + u'...'
+            return value.decode('utf-8', 'replace')
+        text = value if isinstance(value, unicode) else unicode(value)
+        # a character takes at most 4 bytes, so shorter texts need no encoding
+        if self.max_bytes is not None and len(text) > self.max_bytes / 4:
+            encoded = text.encode('utf-8')
+            if len(encoded) > self.max_bytes:
+                return encoded[:self.max_bytes].decode('utf-8', 'ignore') + u'...'
+        return text
+
+    def __str__(self):
+        return unicode(self).encode('utf-8')
+
+
+def log_excerpt_bytes():
+    """Size of the responses logged at INFO: the LOG_RESPONSE_MAX_BYTES config value (default 1024, None for no limit)"""
+    return current_app.config.get('LOG_RESPONSE_MAX_BYTES', 1024)
+
+
+def log_body_sampled():
+    """Whether the current request's bodies are logged at DEBUG, drawn once per request.
+
+    The odds are the LOG_BODY_SAMPLE_RATES config value (a dict) for the request's url rule or endpoint,
+    or else LOG_BODY_SAMPLE_RATE (default 1.0), e.g. 0.01 to capture 1% of the requests.
+    """
+    sampled = request.environ.get('hoops.log_body_sampled')
+    if sampled is None:
+        rates = current_app.config.get('LOG_BODY_SAMPLE_RATES') or {}
+        rule = request.url_rule
+        rate = current_app.config.get('LOG_BODY_SAMPLE_RATE', 1.0)
+        if rule is not None:
+            rate = rates.get(rule.rule, rates.get(rule.endpoint, rate))
+        sampled = request.environ['hoops.log_body_sampled'] = rate >= 1 or random.random() < rate
+    return sampled
+
+
+def _gzip(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+# Content-Encoding => compressor, in order of preference when the client's q values tie
+compressors = (
+    ('gzip', _gzip),
+    ('deflate', zlib.compress),
+)
+
+
+def choose_encoding():
+    """Picks the compression to use from the request's Accept-Encoding, or None"""
+    best = (0, None)
+    for (encoding, compressor) in compressors:
+        quality = request.accept_encodings.quality(encoding)
+        if quality > best[0]:
+            best = (quality, encoding)
+    return best[1]
+
+
+def compress_response(response):
+    """Compresses the response body as negotiated through Accept-Encoding.
+
+    Controlled by the COMPRESS_MIN_SIZE (bytes, default 1024; small bodies, which
+    includes error envelopes, are sent as is) and COMPRESS_LEVEL (1-9, default 3)
+    config values; setting COMPRESS_MIN_SIZE to None disables compression.
+    """
+    min_size = current_app.config.get('COMPRESS_MIN_SIZE', 1024)
+    if (min_size is None or response.direct_passthrough or response.is_streamed or
+            'Content-Encoding' in response.headers):
+        return response
+    data = response.data
+    if len(data) < min_size:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    response.data = dict(compressors)[encoding](data, current_app.config.get('COMPRESS_LEVEL', 3))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def output_indent():
+    """Indentation for the JSON body: 4 when DEBUG is on, or whatever the client asked for
+    with an indent parameter on its Accept header (e.g. 'application/json; indent=2')."""
+    match = re.search(r'application/json[^,]*;\s*indent=(\d+)', request.headers.get('Accept', ''))
+    if match:
+        return int(match.group(1))
+    return 4 if current_app.config.get('DEBUG') else None
+
+
+def set_weak_etag(resp, etag):
+    """Sets the ETag header; Werkzeug's set_etag would spell the weak prefix w/ rather than W/"""
+    resp.headers['ETag'] = 'W/"%s"' % etag
+
+
+# headers of the full response that a 304 standing in for it repeats
+NOT_MODIFIED_HEADERS = ('Cache-Control', 'Vary')
+
+
+def not_modified(etag, headers=None):
+    """Makes an empty 304 response, for a request whose If-None-Match holds etag.
+
+    It has no Content-Type, and carries the Cache-Control and Vary headers of the
+    response it stands in for: those in headers, and the Vary on Accept-Encoding
+    of compressed responses.
+    """
+    resp = current_app.response_class(status=304)
+    del resp.headers['Content-Type']
+    set_weak_etag(resp, etag)
+    for (name, value) in Headers(headers or {}):
+        if name.title() in NOT_MODIFIED_HEADERS:
+            resp.headers.add(name, value)
+    if current_app.config.get('COMPRESS_MIN_SIZE', 1024) is not None:
+        resp.vary.add('Accept-Encoding')
+    return resp
+
+
 def output_json(data, code, headers=None):
-    """Makes a Flask response with a JSON encoded body"""
+    """Makes a Flask response with a JSON encoded body, or a 304 if the client has the one tagged by data.etag"""
+    etag = getattr(data, 'etag', None)
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        return not_modified(etag, headers)
     out, code = prepare_output(data, code, headers)
-    resp = make_response(json.dumps(out,
-                                    sort_keys=True,
-                                    indent=4,
-                                    separators=(',', ': ')), code)
+    encoder = getattr(current_app, 'api_encoder', default_encoder)
+    timings = current_timings()
+    if timings is None:
+        body = encoder.dumps(out, indent=output_indent())
+    else:
+        body = timings.encode(encoder, out, indent=output_indent())
+    resp = make_response(body, code)
     resp.headers.extend(headers or {})
+    if etag is not None:
+        set_weak_etag(resp, etag)
     return resp
 
 
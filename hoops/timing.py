@@ -0,0 +1,115 @@
+'''
+Per-request phase timing.
+
+With the REQUEST_TIMING config value set, each request records the time spent in:
+
+    oauth: oauth_authentication
+    validate: validating the url parameters and the input
+    db: executing SQL statements (timed by hoops.queries' statement listener)
+    serialize: turning model objects into JSON data (APIOperation.serialize, and the
+               to_json() calls made while encoding the response)
+    encode: encoding the response body, serialization excluded
+    total: from the start of the request until the response is made
+
+Phases can overlap: queries made while serializing count in both db and serialize.
+The timings go out in a Server-Timing header (unless SERVER_TIMING_HEADER is set
+to False), and in a ``timings`` field of the log records made during the request
+(see hoops.logger.ContextFilter), which the logstash formatter of the machine log
+writes out. Without REQUEST_TIMING, each instrumented spot costs a lookup of the
+current app context.
+'''
+
+import collections
+import time
+
+from flask import _app_ctx_stack, current_app, g
+
+from hoops.json_encoding import encode_default
+
+try:
+    from monotonic import monotonic as clock
+except ImportError:  # pragma: no cover
+    # no monotonic clock in the Python 2 stdlib; monotonic is a requirement, this only
+    # keeps checkouts without it working, with a clock that can go backwards
+    clock = time.time
+
+
+class RequestTimings(object):
+    '''Seconds spent in each phase of one request (and of the calls of a batch request).'''
+
+    def __init__(self):
+        self.start = clock()
+        self.phases = collections.OrderedDict()
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def milliseconds(self):
+        timings = collections.OrderedDict((name, seconds * 1000) for (name, seconds) in self.phases.items())
+        timings['total'] = (clock() - self.start) * 1000
+        return timings
+
+    def fields(self):
+        '''Log record field: {phase: milliseconds}'''
+        return dict((name, round(ms, 3)) for (name, ms) in self.milliseconds().items())
+
+    def header(self):
+        '''Server-Timing header value'''
+        return ', '.join('%s;dur=%.3f' % (name, ms) for (name, ms) in self.milliseconds().items())
+
+    def encode(self, encoder, data, indent=None):
+        '''Encodes data with encoder (a JSONBackend), telling the time spent in to_json() calls apart.'''
+        serializing = [0.0]
+
+        def timed_default(obj):
+            start = clock()
+            try:
+                return encode_default(obj)
+            finally:
+                serializing[0] += clock() - start
+        start = clock()
+        body = encoder.dumps(data, indent=indent, default=timed_default)
+        self.add('serialize', serializing[0])
+        self.add('encode', clock() - start - serializing[0])
+        return body
+
+
+def current_timings():
+    '''The RequestTimings of the current request, or None if it isn't timed.'''
+    ctx = _app_ctx_stack.top
+    return getattr(ctx.g, 'request_timings', None) if ctx is not None else None
+
+
+class phase(object):
+    '''Context manager adding the time spent in its block to the named phase of the current request.'''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = current_timings()
+        if self.timings is not None:
+            self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.add(self.name, clock() - self.start)
+
+
+def start_timing():
+    if current_app.config.get('REQUEST_TIMING'):
+        g.request_timings = RequestTimings()
+
+
+def add_server_timing(response):
+    timings = current_timings()
+    if timings is not None and current_app.config.get('SERVER_TIMING_HEADER', True):
+        response.headers['Server-Timing'] = timings.header()
+    return response
+
+
+def init_timing(app):
+    '''Times the requests of app when REQUEST_TIMING is set.'''
+    app.before_request(start_timing)
+    app.after_request(add_server_timing)
@@ -0,0 +1,220 @@
+'''
+Compiles formencode schemas into specialized validation functions.
+
+``compile_schema`` turns a ``Schema`` built by the ``parameter``/``url_parameter``
+decorators into a single generated function with the same signature as
+``Schema.to_python``. The generated code only handles the happy path for the
+validators hoops uses in practice; whenever a value fails (or is of a type the
+generated code doesn't know about) the whole dict is handed to the original
+schema instead, so error messages and ``Invalid.error_dict`` contents are exactly
+those formencode would produce.
+
+Schemas using anything else (pre/chained validators, extra fields, custom
+validator classes, ...) are not compiled at all and ``schema.to_python`` is
+returned unchanged.
+'''
+
+from formencode.api import NoDefault
+from formencode.schema import Schema
+from formencode.validators import Int, String, UnicodeString, OneOf, StringBool
+
+_missing = object()
+
+
+class CannotCompile(Exception):
+    pass
+
+
+class _Source(object):
+    '''Accumulates generated source lines and the constants they reference.'''
+
+    def __init__(self):
+        self.lines = []
+        self.namespace = {}
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def const(self, value):
+        name = '_c%d' % len(self.namespace)
+        self.namespace[name] = value
+        return name
+
+
+def _check_schema(schema):
+    if type(schema) is not Schema:
+        raise CannotCompile('custom schema class %s' % type(schema).__name__)
+    if schema.pre_validators or schema.chained_validators:
+        raise CannotCompile('pre/chained validators')
+    if schema.allow_extra_fields or schema.ignore_key_missing:
+        raise CannotCompile('extra or ignored fields')
+    if schema.if_empty is not NoDefault or schema.if_key_missing is not NoDefault:
+        raise CannotCompile('schema level defaults')
+
+
+def _check_validator(validator):
+    if type(validator) not in _field_compilers:
+        raise CannotCompile('unsupported validator %s' % type(validator).__name__)
+    if validator.if_invalid is not NoDefault or validator.if_empty is not NoDefault:
+        raise CannotCompile('if_invalid/if_empty')
+    if getattr(validator, 'accept_iterator', False):
+        raise CannotCompile('iterator values')
+
+
+def _emit_int(src, indent, validator, target):
+    src.emit(indent, 'try:')
+    src.emit(indent + 1, 'v = int(v)')
+    src.emit(indent, 'except ValueError:')
+    src.emit(indent + 1, 'return _fallback(value_dict, state)')
+    _emit_range(src, indent, validator)
+    src.emit(indent, '%s = v' % target)
+
+
+def _emit_range(src, indent, validator):
+    if validator.min is not None:
+        src.emit(indent, 'if v < %s:' % src.const(validator.min))
+        src.emit(indent + 1, 'return _fallback(value_dict, state)')
+    if validator.max is not None:
+        src.emit(indent, 'if v > %s:' % src.const(validator.max))
+        src.emit(indent + 1, 'return _fallback(value_dict, state)')
+
+
+def _emit_length(src, indent, validator):
+    # String.validate_other measures the value before any decoding
+    if validator.max is not None:
+        src.emit(indent, 'if len(v) > %s:' % src.const(validator.max))
+        src.emit(indent + 1, 'return _fallback(value_dict, state)')
+    if validator.min is not None:
+        src.emit(indent, 'if len(v) < %s:' % src.const(validator.min))
+        src.emit(indent + 1, 'return _fallback(value_dict, state)')
+
+
+def _emit_string(src, indent, validator, target):
+    if validator.encoding is not None:
+        raise CannotCompile('String with encoding')
+    _emit_length(src, indent, validator)
+    src.emit(indent, '%s = v' % target)
+
+
+def _emit_unicode_string(src, indent, validator, target):
+    _emit_length(src, indent, validator)
+    if validator.inputEncoding:
+        src.emit(indent, 'if type(v) is str:')
+        src.emit(indent + 1, 'try:')
+        src.emit(indent + 2, 'v = unicode(v, %s)' % src.const(validator.inputEncoding))
+        src.emit(indent + 1, 'except UnicodeDecodeError:')
+        src.emit(indent + 2, 'return _fallback(value_dict, state)')
+    src.emit(indent, '%s = v' % target)
+
+
+def _emit_one_of(src, indent, validator, target):
+    if validator.testValueList:
+        raise CannotCompile('OneOf with testValueList')
+    try:
+        allowed = frozenset(validator.list)
+    except TypeError:
+        raise CannotCompile('OneOf with unhashable values')
+    src.emit(indent, 'if v not in %s:' % src.const(allowed))
+    src.emit(indent + 1, 'return _fallback(value_dict, state)')
+    src.emit(indent, '%s = v' % target)
+
+
+def _emit_string_bool(src, indent, validator, target):
+    true_values = src.const(frozenset(validator.true_values))
+    false_values = src.const(frozenset(validator.false_values))
+    src.emit(indent, 'v = v.strip().lower()')
+    src.emit(indent, 'if v in %s:' % true_values)
+    src.emit(indent + 1, '%s = True' % target)
+    src.emit(indent, 'elif not v or v in %s:' % false_values)
+    src.emit(indent + 1, '%s = False' % target)
+    src.emit(indent, 'else:')
+    src.emit(indent + 1, 'return _fallback(value_dict, state)')
+
+
+def _emit_int_value(src, indent, validator, target):
+    _emit_range(src, indent, validator)
+    src.emit(indent, '%s = v' % target)
+
+
+def _emit_bool_value(src, indent, validator, target):
+    src.emit(indent, '%s = bool(v)' % target)
+
+
+# validator class => (string value emitter, other value types handled, other value emitter)
+_field_compilers = {
+    Int: (_emit_int, ('int', ), _emit_int_value),
+    String: (_emit_string, (), None),
+    UnicodeString: (_emit_unicode_string, (), None),
+    OneOf: (_emit_one_of, (), None),
+    StringBool: (_emit_string_bool, ('int', 'bool'), _emit_bool_value),
+}
+
+
+def _emit_field(src, name, validator):
+    _check_validator(validator)
+    (emit_string, other_types, emit_other) = _field_compilers[type(validator)]
+    key = src.const(name)
+    target = 'new[%s]' % key
+
+    src.emit(1, 'v = value_dict.get(%s, _missing)' % key)
+    src.emit(1, 'if v is _missing:')
+    if validator.if_missing is NoDefault:
+        src.emit(2, 'return _fallback(value_dict, state)')
+    else:
+        src.emit(2, '%s = %s' % (target, src.const(validator.if_missing)))
+    src.emit(1, 'else:')
+    src.emit(2, 'seen += 1')
+    src.emit(2, 't = type(v)')
+    src.emit(2, 'if t is str or t is unicode:')
+    if validator.strip:
+        src.emit(3, 'v = v.strip()')
+    src.emit(3, "if v == '':")
+    if validator.not_empty:
+        src.emit(4, 'return _fallback(value_dict, state)')
+    else:
+        src.emit(4, '%s = %s' % (target, src.const(validator.empty_value(''))))
+    src.emit(3, 'else:')
+    emit_string(src, 4, validator, target)
+    if other_types:
+        src.emit(2, 'elif %s:' % ' or '.join('t is %s' % t for t in other_types))
+        emit_other(src, 3, validator, target)
+    src.emit(2, 'else:')
+    src.emit(3, 'return _fallback(value_dict, state)')
+
+
+def generate_source(schema):
+    '''Returns the generated source and namespace for ``schema``; raises CannotCompile.'''
+    _check_schema(schema)
+    src = _Source()
+    src.emit(0, 'def to_python(value_dict, state=None):')
+    src.emit(1, 'if state is not None or not isinstance(value_dict, dict):')
+    src.emit(2, 'return _fallback(value_dict, state)')
+    src.emit(1, 'new = {}')
+    src.emit(1, 'seen = 0')
+    for name in sorted(schema.fields):
+        _emit_field(src, name, schema.fields[name])
+    # anything we didn't look at is an unexpected field; let formencode complain
+    src.emit(1, 'if seen != len(value_dict):')
+    src.emit(2, 'return _fallback(value_dict, state)')
+    src.emit(1, 'return new')
+    return '\n'.join(src.lines) + '\n', src.namespace
+
+
+def compile_schema(schema):
+    '''
+    Returns a function equivalent to ``schema.to_python``, generating specialized
+    code when every field uses a supported validator.
+    '''
+    try:
+        (source, namespace) = generate_source(schema)
+    except CannotCompile:
+        return schema.to_python
+    namespace.update({
+        '_fallback': schema.to_python,
+        '_missing': _missing,
+    })
+    code = compile(source, '<compiled schema %x>' % id(schema), 'exec')
+    exec code in namespace
+    to_python = namespace['to_python']
+    to_python.source = source
+    return to_python
@@ -7,12 +7,14 @@ import argparse
 from configure import Configuration
 
 from hoops.core import create_api
+from hoops.pool import POOL_SETTINGS
 from hoops.utils import find_subclasses
 
 
 DEFAULT_CONF = 'hoops-api.yml'
 DEFAULT_HOST = 'localhost'
 DEFAULT_PORT = 8000  # starting port number
+POOL_KEYS = sorted(POOL_SETTINGS) + ['pool_pre_ping']
 
 
 class HoopsSubParser(object):
@@ -166,6 +168,10 @@ class HoopsApi(object):
                 'hostname': config.db.get('host', 'localhost'),
                 'database': config.db.get('name', app_slug)
             }
+            # connection pool settings, see hoops.pool
+            for key in POOL_KEYS:
+                if key in config.db:
+                    db_config[key] = config.db[key]
             if 'models' in config.db:
                 db_module = config.db.models.get('module')
                 db_include = config.db.models.get('include')
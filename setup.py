@@ -32,6 +32,7 @@ setup(
         'PyYAML==3.11',
         'python-logstash==0.4.2',
         'logstash-formatter==0.5.8',
+        'monotonic==1.5',
     ],
     dependency_links=[
         'git://github.com/rhooper/python-oauth.git#egg=oauth',
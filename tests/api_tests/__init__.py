@@ -1,5 +1,24 @@
+import collections
+import contextlib
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
 import simplejson as json
+from flask import request
+from flask.ext.sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+
+import hoops.core
 from hoops import create_api
+from hoops.common import BareModel
+from hoops.restful import Resource, require_oauth
+from hoops.status import library as status_library
 
 from tests import TestBase, app_config, db_config, log_config
 from test_models.core import Partner, Language, PartnerAPIKey, Service, Package, PackageService, PackageServiceParam, Customer, CustomerPackage, User
@@ -185,6 +204,110 @@ class APITestBase(TestBase):
         return data
 
 
+# database of the models of the tests run on SQLite files (see SQLiteTestBase)
+sqlite_db = SQLAlchemy()
+
+
+class SQLiteModel(sqlite_db.Model, BareModel):
+    __abstract__ = True
+
+
+class SQLiteTestBase(unittest.TestCase):
+    '''
+    Runs each test against a new API whose database is a throwaway SQLite file.
+
+    Subclasses whose models don't derive from SQLiteModel name their SQLAlchemy
+    object in ``db``; ``db_config()``, ``flask_config`` and ``api_args()`` (further
+    create_api arguments) shape the API, and ``populate()`` adds rows. The SQL
+    statements executed are recorded into ``self.statements``, and the log files
+    are written next to the database.
+    '''
+    db = sqlite_db
+    app_name = 'sqlite_test'
+    flask_config = {}
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        api_args = self.api_args()
+        api_args['log_args'] = dict(api_args.get('log_args') or {}, log_path=self.tmp)
+        (self.app, _, self.api) = hoops.core.create_api(self.app_name, database=self.db, db_config=self.db_config(),
+                                                        flask_config=dict(self.flask_config), **api_args)
+        with self.app.app_context():
+            self.db.create_all()
+            self.populate()
+            self.db.session.commit()
+        self.statements = []
+        event.listen(self.app.pool_metrics[None].engine, 'before_cursor_execute', self.record_statement)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        for metrics in self.app.pool_metrics.values():
+            metrics.engine.dispose()
+        close_log_files(self.tmp)
+
+    def sqlite_path(self, name):
+        return os.path.join(self.tmp, name + '.db')
+
+    def db_config(self):
+        return {'uri': 'sqlite:///' + self.sqlite_path(self.app_name)}
+
+    def api_args(self):
+        return {}
+
+    def populate(self):
+        pass
+
+    def record_statement(self, connection, cursor, statement, *args):
+        self.statements.append(statement)
+
+
+def close_log_files(directory):
+    '''Closes and removes the logging handlers writing files in directory, then deletes it.'''
+    loggers = [logging.getLogger()] + [logger for logger in logging.Logger.manager.loggerDict.values()
+                                       if isinstance(logger, logging.Logger)]
+    for logger in loggers:
+        for handler in logger.handlers[:]:
+            if getattr(handler, 'baseFilename', '').startswith(directory):
+                logger.removeHandler(handler)
+                handler.close()
+    shutil.rmtree(directory)
+
+
+OAuthCredentials = collections.namedtuple('OAuthCredentials', 'consumer_key token')
+
+
+def trust_authorization_header(oauth_creds=None):
+    '''Stands in for hoops.oauth_provider's signature check, taking the credentials of the Authorization header'''
+    params = dict(re.findall(r'(oauth_\w+)="([^"]*)"', request.headers.get('Authorization', '')))
+    if 'oauth_consumer_key' not in params:
+        raise status_library.API_AUTHENTICATION_REQUIRED
+    return OAuthCredentials(params['oauth_consumer_key'], params.get('oauth_token'))
+
+header_oauth_provider = types.ModuleType('hoops.oauth_provider')
+header_oauth_provider.oauth_authentication = trust_authorization_header
+
+
+def oauth_header(consumer_key, token):
+    return {'Authorization': 'OAuth realm="", oauth_consumer_key="%s", oauth_token="%s", oauth_signature="signed"' % (
+        consumer_key, token)}
+
+
+@contextlib.contextmanager
+def oauth_required():
+    '''Requires OAuth on every resource within the block, trusting the credentials of oauth_header()'''
+    provider = sys.modules.get('hoops.oauth_provider')
+    sys.modules['hoops.oauth_provider'] = header_oauth_provider
+    Resource.method_decorators = [require_oauth]
+    try:
+        yield
+    finally:
+        Resource.method_decorators = []
+        if provider is None:
+            del sys.modules['hoops.oauth_provider']
+        else:
+            sys.modules['hoops.oauth_provider'] = provider
+
+
 class BaseKitLeak(Exception):
     pass
 
@@ -1,6 +1,7 @@
 
 from tests.api_tests import APITestBase, db_config, app_config
 import simplejson as json
+import zlib
 
 from hoops import create_api
 from hoops.base import APIResource
@@ -46,3 +47,37 @@ class TestAPIApp(APITestBase):
         assert 'status_code' in out
         assert 'status_message' in out
         assert out['response_data'] is None
+
+    def test_output_indent(self):
+        debug = self._app.config.get('DEBUG')
+        try:
+            self._app.config['DEBUG'] = False
+            compact = self.app.get("/").data
+            assert '\n' not in compact.strip(), compact
+            assert '", "' not in compact, compact
+            pretty = self.app.get("/", headers={'Accept': 'application/json; indent=2'}).data
+            assert '\n  "api_version"' in pretty, pretty
+            assert json.loads(compact) == json.loads(pretty)
+            self._app.config['DEBUG'] = True
+            assert '\n    "api_version"' in self.app.get("/").data
+        finally:
+            self._app.config['DEBUG'] = debug
+
+    def test_compression(self):
+        self._app.config['COMPRESS_MIN_SIZE'] = 0
+        try:
+            plain = self.app.get("/")
+            assert 'Content-Encoding' not in plain.headers
+            assert 'Accept-Encoding' in plain.headers['Vary']
+            gzipped = self.app.get("/", headers={'Accept-Encoding': 'gzip'})
+            assert gzipped.headers['Content-Encoding'] == 'gzip'
+            assert zlib.decompress(gzipped.data, 16 + zlib.MAX_WBITS) == plain.data
+            deflated = self.app.get("/", headers={'Accept-Encoding': 'gzip;q=0.5, deflate'})
+            assert deflated.headers['Content-Encoding'] == 'deflate'
+            assert zlib.decompress(deflated.data) == plain.data
+            self._app.config['COMPRESS_MIN_SIZE'] = 10 ** 6
+            small = self.app.get("/", headers={'Accept-Encoding': 'gzip'})
+            assert 'Content-Encoding' not in small.headers
+            assert small.data == plain.data
+        finally:
+            self._app.config.pop('COMPRESS_MIN_SIZE')
@@ -1,8 +1,15 @@
+import base64
+import datetime
+import decimal
+import json
+
 from flask import g
-from formencode.validators import String, Int
+from formencode.validators import String, Int, StringBool
+from sqlalchemy import Column, Numeric, event
 from hoops.status import library
-from hoops.base import APIOperation, APIModelOperation, APIResource, parameter, url_parameter
-from hoops.generic import ListOperation, RetrieveOperation, NotSpecified
+from hoops.base import APIOperation, APIModelOperation, APIResource, parameter, url_parameter, schema_cache
+from hoops.generic import ListOperation, RetrieveOperation, NotSpecified, include_related, encode_cursor, decode_cursor, total_cache
+from hoops.generic import BulkCreateOperation, BulkUpdateOperation, BulkDeleteOperation, ExportOperation
 from tests.api_tests import APITestBase
 
 from test_models.core import Customer, Partner, Language, Package, CustomerPackage, User
@@ -57,6 +64,7 @@ class CustomerAPI(APIResource):
 
 
 @CustomerAPI.method('list')
+@include_related('include_users', 'users', StringBool(if_missing=False), "Includes users in output")
 @parameter('include_suspended', String, "Include Suspended", False, False)
 @parameter('include_inactive', String, "Include Inactive", False, False)
 class ListCustomers(ListOperation):
@@ -69,6 +77,43 @@ class RetrieveCustomer(RetrieveOperation):
     id_column = 'id'
 
 
+class BulkCustomerAPI(APIResource):
+    route = "/bulk_customers"
+    object_route = "/bulk_customers/<string:customer_id>"
+    object_id_param = 'customer_id'
+    model = Customer
+    read_only = False
+
+
+@BulkCustomerAPI.method('bulk_create')
+@parameter('name', String(max=64), "Name", required=True)
+@parameter('my_identifier', String(max=64), "Identifier", required=True)
+@parameter('partner_id', Int, "Partner ID", required=True)
+class BulkCreateCustomers(BulkCreateOperation):
+    chunk_size = 2
+
+
+@BulkCustomerAPI.method('bulk_update')
+@parameter('name', String(max=64, if_missing=NotSpecified()), "Name")
+class BulkUpdateCustomers(BulkUpdateOperation):
+    force_update = True
+
+
+@BulkCustomerAPI.method('bulk_remove')
+class BulkDeleteCustomers(BulkDeleteOperation):
+    force_delete = True
+
+
+class CustomerExportAPI(APIResource):
+    route = "/customers/export"
+    model = Customer
+
+
+@CustomerExportAPI.method('list')
+class ExportCustomers(ExportOperation):
+    batch_size = 2
+
+
 class TestBaseClasses(APITestBase):
 
     def test_api_operation(self):
@@ -107,6 +152,29 @@ class TestBaseClasses(APITestBase):
         assert 'test' in op.combined_params
         assert 'test2' in op.combined_params
 
+    def test_schema_cache(self):
+        """Test merged schemas are built once and invalidated by parameter decorators"""
+        @parameter('person_id', Int, "test")
+        class test_res(APIResource):
+            pass
+
+        @test_res.method('list')
+        @parameter('customer_id', Int, "test")
+        class test_op(APIOperation):
+            pass
+
+        op = test_res.list
+        op.compile_schemas()
+        schema = op._combine_schema('schema')
+        assert schema is op._combine_schema('schema')
+        assert 'person_id' in schema.fields
+        assert 'customer_id' in schema.fields
+
+        parameter('account_id', Int, "test")(test_res)
+        schema = op._combine_schema('schema')
+        assert 'account_id' in schema.fields
+        assert schema_cache.get(op._schema_key('schema')) is schema
+
     def test_validation(self):
         """Test validation works"""
         rv = self.app.get("/test/Yup?test=Works")
@@ -304,3 +372,178 @@ class TestBaseClasses(APITestBase):
         rv = self.app.get(url)
         out = self.validate(rv, library.API_OK)
         assert customer_id == out['response_data']['id']
+
+    def test_cursor_pagination(self):
+        """Walking next_cursor returns the same rows as numbered pages"""
+        url = self.url_for('/customers', limit=100, sort_by='name', sort_order='desc')
+        expected = [item['id'] for item in self.validate(self.app.get(url), library.API_OK)['response_data']]
+
+        found = []
+        cursor = ''
+        while cursor is not None:
+            url = self.url_for('/customers', limit=2, sort_by='name', sort_order='desc', cursor=cursor)
+            out = json.loads(self.app.get(url).data)
+            assert 'total' not in out['pagination']
+            found.extend(item['id'] for item in out['response_data'] or [])
+            cursor = out['pagination']['next_cursor']
+        assert found == expected, '%s != %s' % (found, expected)
+
+        url = self.url_for('/customers', cursor='garbage')
+        self.validate(self.app.get(url), library.get('API_INVALID_VALUE', value='cursor'))
+
+    def test_cursor_encoding(self):
+        """Cursors round-trip sort values and refuse to be reused with different sorting"""
+        cursor = encode_cursor('created_at', 'desc', datetime.datetime(2014, 1, 2, 3, 4, 5, 6), 7)
+        assert decode_cursor(cursor, 'created_at', 'desc', Customer.created_at, Customer.id) == (datetime.datetime(2014, 1, 2, 3, 4, 5, 6), 7)
+        try:
+            decode_cursor(cursor, 'created_at', 'asc', Customer.created_at, Customer.id)
+            assert False, "Cursor accepted with a different sort order"
+        except APIException:
+            assert True
+
+    def test_crafted_cursors(self):
+        """Cursor values that don't fit the sort and id columns are invalid values, not errors"""
+        price = Column('price', Numeric(10, 2))
+        crafted = [
+            (price, ['price', 'asc', 'abc', 2]),
+            (price, ['price', 'asc', 'NaN', 2]),
+            (price, ['price', 'asc', '1.5', 'abc']),
+            (Customer.id, ['id', 'asc', [1], [1]]),
+            (Customer.id, ['id', 'asc', {'a': 1}, {'b': 2}]),
+            (Customer.id, ['id', 'asc', True, True]),
+            (Customer.id, ['id', 'asc', None, None]),
+            (price, ['price', 'asc', None, None]),
+            (Customer.name, ['name', 'asc', 3, 2]),
+        ]
+        for (field, data) in crafted:
+            cursor = base64.urlsafe_b64encode(json.dumps(data))
+            try:
+                decode_cursor(cursor, data[0], 'asc', field, Customer.id)
+                assert False, "Cursor %s accepted" % data
+            except APIException as e:
+                assert e.status_code == library.API_INVALID_VALUE.status_code, e
+        cursor = base64.urlsafe_b64encode(json.dumps(['price', 'asc', '1.50', 2]))
+        assert decode_cursor(cursor, 'price', 'asc', price, Customer.id) == (decimal.Decimal('1.50'), 2)
+
+        # NULLs are only valid sort values of nullable columns
+        assert decode_cursor(base64.urlsafe_b64encode(json.dumps(['price', 'asc', None, 2])),
+                             'price', 'asc', price, Customer.id) == (None, 2)
+        url = self.url_for('/customers', cursor=base64.urlsafe_b64encode(json.dumps(['id', 'asc', None, 2])))
+        self.validate(self.app.get(url), library.get('API_INVALID_VALUE', value='cursor'))
+
+    def test_total_policies(self):
+        """Each total policy reports the same next_page as an exact count"""
+        url = self.url_for('/customers', limit=2, page=2)
+        exact = self.validate(self.app.get(url), library.API_OK)['pagination']
+        try:
+            for policy in ('cached', 'estimate', 'none'):
+                CustomerAPI.total_policy = policy
+                total_cache.clear()
+                out = self.validate(self.app.get(url), library.API_OK)['pagination']
+                assert out['next_page'] == exact['next_page'], (policy, out, exact)
+                if policy == 'none':
+                    assert out['total'] is None
+                    assert out['total_exact'] is False
+                else:
+                    assert out['total'] == exact['total'], (policy, out, exact)
+                out = self.validate(self.app.get(self.url_for('/customers', limit=2, page=2, exact_total=1)), library.API_OK)
+                assert out['pagination'] == exact
+        finally:
+            del CustomerAPI.total_policy
+
+    def test_include_related_query_count(self):
+        """Related collections are loaded with one query per relationship, whatever the page size"""
+        queries = []
+
+        def count_query(*args):
+            queries.append(args[2])
+
+        event.listen(self.db.engine, 'before_cursor_execute', count_query)
+        try:
+            counts = []
+            for limit in (1, 5):
+                del queries[:]
+                url = self.url_for('/customers', limit=limit, include_users=1, cursor='')
+                out = self.validate(self.app.get(url), library.API_OK)
+                assert all('users' in item for item in out['response_data'])
+                assert all('customer_id' not in user for item in out['response_data'] for user in item['users'])
+                counts.append(len(queries))
+            assert counts[0] == counts[1], counts
+        finally:
+            event.remove(self.db.engine, 'before_cursor_execute', count_query)
+
+    def test_sparse_fields(self):
+        """fields= limits both the columns selected and the serialized output"""
+        queries = []
+
+        def record_query(conn, cursor, statement, *args):
+            queries.append(statement)
+
+        event.listen(self.db.engine, 'before_cursor_execute', record_query)
+        try:
+            out = self.validate(self.app.get(self.url_for('/customers', fields='name', limit=5)), library.API_OK)
+            assert all(sorted(item.keys()) == ['id', 'name'] for item in out['response_data']), out['response_data']
+            assert 'my_identifier' not in queries[0], queries[0]
+
+            customer_id = out['response_data'][0]['id']
+            out = self.validate(self.app.get(self.url_for('/customers', customer_id=customer_id, fields='name')), library.API_OK)
+            assert sorted(out['response_data'].keys()) == ['id', 'name'], out['response_data']
+        finally:
+            event.remove(self.db.engine, 'before_cursor_execute', record_query)
+
+        out = self.validate(self.app.get(self.url_for('/customers', fields='name,nope')), library.API_INPUT_VALIDATION_FAILED)
+        assert 'nope' in out['validation_errors']['fields']
+
+    def test_bulk_operations(self):
+        """Bulk create/update/delete report a status per item and write valid items only"""
+        partner_id = Partner.query.first().id
+        body = [
+            {'name': 'bulk 1', 'my_identifier': 'bulk_1', 'partner_id': partner_id},
+            {'name': 'bulk 2', 'my_identifier': 'bulk_2', 'partner_id': partner_id},
+            {'name': 'bulk 3'},
+            {'name': 'bulk 1 again', 'my_identifier': 'bulk_1', 'partner_id': partner_id},
+            'bulk 4',
+        ]
+        rv = self.app.post('/bulk_customers', data=json.dumps(body), content_type='application/json')
+        out = self.validate(rv, library.API_OK)
+        codes = [item['status_code'] for item in out['response_data']]
+        assert codes == [1000, 1000, 4100, 4191, 4100], out
+        assert 'my_identifier' in out['response_data'][2]['validation_errors']
+        assert (out['succeeded'], out['failed']) == (2, 3)
+        created = Customer.query.filter(Customer.my_identifier.in_(['bulk_1', 'bulk_2'])).order_by(Customer.id).all()
+        assert [c.name for c in created] == ['bulk 1', 'bulk 2']
+        ids = [c.id for c in created]
+
+        body = [{'id': ids[0], 'name': 'renamed'}, {'id': -1, 'name': 'nope'}, {'name': 'no id'}]
+        rv = self.app.put('/bulk_customers', data=json.dumps(body), content_type='application/json')
+        out = self.validate(rv, library.API_OK)
+        assert [item['status_code'] for item in out['response_data']] == [1000, 4204, 4100], out
+        assert out['response_data'][0]['response_data']['name'] == 'renamed'
+        self.db.session.expire_all()
+        assert Customer.query.get(ids[0]).name == 'renamed'
+
+        rv = self.app.delete('/bulk_customers', data=json.dumps(ids + [-1]), content_type='application/json')
+        out = self.validate(rv, library.API_OK)
+        assert [item['status_code'] for item in out['response_data']] == [1000, 1000, 4204], out
+        assert Customer.query.filter(Customer.id.in_(ids)).count() == 0
+
+        rv = self.app.post('/bulk_customers', data=json.dumps({'name': 'x'}), content_type='application/json')
+        self.validate(rv, library.API_CODE_NOT_IMPLEMENTED)
+
+    def test_export(self):
+        """ExportOperation streams every row, in order, as NDJSON or CSV"""
+        expected = [c.id for c in Customer.query.order_by(Customer.id.desc())]
+        rv = self.app.get(self.url_for('/customers/export', sort_order='desc', fields='name'))
+        assert rv.status_code == 200
+        assert rv.mimetype == 'application/x-ndjson'
+        rows = [json.loads(line) for line in rv.data.splitlines()]
+        assert [row['id'] for row in rows] == expected, rows
+        assert all(sorted(row.keys()) == ['id', 'name'] for row in rows)
+
+        rv = self.app.get(self.url_for('/customers/export', format='csv', fields='name'))
+        lines = rv.data.splitlines()
+        assert rv.mimetype == 'text/csv'
+        assert lines[0] == 'id,name'
+        assert len(lines) == len(expected) + 1
+
+        self.validate(self.app.get(self.url_for('/customers/export', sort_by='nope')), library.API_INPUT_VALIDATION_FAILED)
@@ -0,0 +1,73 @@
+import json
+
+from formencode.validators import Int
+
+from hoops import core
+from hoops.base import APIOperation, APIResource, parameter, url_parameter
+from hoops.batch import BatchResource
+from hoops.response import APIResponse
+from hoops.status import library
+from tests.api_tests import APITestBase
+
+
+class DoubleAPI(APIResource):
+    route = '/double'
+    object_route = '/double/<int:value>'
+    object_id_param = 'value'
+
+
+@DoubleAPI.method('retrieve')
+@url_parameter('value', Int, "Value to double")
+class DoubleOperation(APIOperation):
+
+    def process_request(self, *args, **kwargs):
+        if self.url_params['value'] == 0:
+            raise library.API_INVALID_DATA_FORMAT
+        return APIResponse({'value': self.url_params['value'] * 2})
+
+
+@DoubleAPI.method('list')
+@parameter('value', Int, "Value to double", required=True)
+class DoubleListOperation(APIOperation):
+
+    def process_request(self, *args, **kwargs):
+        return APIResponse([self.params['value'] * 2])
+
+
+class TestBatch(APITestBase):
+
+    @classmethod
+    def setup_app(cls):
+        super(TestBatch, cls).setup_app()
+        for (route, isolate) in (('/batch', True), ('/batch_strict', False)):
+            batch = BatchResource.configure(core.api, route=route, max_requests=4, isolate_failures=isolate)
+            core.api.add_resource(batch, route, endpoint=route)
+
+    def batch(self, route, calls):
+        return self.app.post(route, data=json.dumps(calls), content_type='application/json')
+
+    def test_batch(self):
+        calls = [
+            {'path': '/double/2'},
+            {'path': '/double', 'params': {'value': 5}},
+            {'path': '/double/0'},
+            {'method': 'GET', 'path': '/missing'},
+        ]
+        out = self.validate(self.batch('/batch', calls), library.API_OK)
+        responses = out['response_data']
+        assert [r['status_code'] for r in responses] == [1000, 1000, 4120, 4004], responses
+        assert responses[0]['response_data'] == {'value': 4}
+        assert responses[1]['response_data'] == [10]
+        assert all('api_version' in r for r in responses)
+
+    def test_batch_stops_without_isolation(self):
+        calls = [{'path': '/double/1'}, {'path': '/double/0'}, {'path': '/double/3'}]
+        out = self.validate(self.batch('/batch_strict', calls), library.API_OK)
+        assert [r['status_code'] for r in out['response_data']] == [1000, 4120], out
+
+    def test_batch_limits(self):
+        self.validate(self.batch('/batch', [{'path': '/double/1'}] * 5), library.API_REQUEST_ENTITY_TOO_LARGE)
+        self.validate(self.batch('/batch', {'path': '/double/1'}), library.API_INVALID_DATA_FORMAT)
+        out = self.validate(self.batch('/batch', [{'path': '/batch'}, {'method': 'PATCH', 'path': 'double'}]), library.API_OK)
+        errors = [r['validation_errors'] for r in out['response_data']]
+        assert 'path' in errors[0] and 'method' in errors[1] and 'path' in errors[1], errors
@@ -0,0 +1,143 @@
+import json
+
+from formencode.validators import Int, String
+
+from hoops.base import APIResource, parameter, url_parameter
+from hoops.cache import LRUBackend, result_cache
+from hoops.generic import BulkCreateOperation, ListOperation, RetrieveOperation, UpdateOperation
+from tests.api_tests import SQLiteModel, SQLiteTestBase, oauth_header, oauth_required, sqlite_db as db
+
+
+class Gizmo(SQLiteModel):
+    __tablename__ = 'cache_gizmo'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.Unicode(64))
+
+    def updates_permitted(self):
+        return True
+
+
+class GizmoAPI(APIResource):
+    route = '/gizmos'
+    object_route = '/gizmos/<int:gizmo_id>'
+    object_id_param = 'gizmo_id'
+    model = Gizmo
+    read_only = False
+    cache_ttl = 60
+
+
+@GizmoAPI.method('list')
+class ListGizmos(ListOperation):
+    pass
+
+
+@GizmoAPI.method('retrieve')
+@url_parameter('gizmo_id', Int, "Gizmo ID")
+class RetrieveGizmo(RetrieveOperation):
+    pass
+
+
+@GizmoAPI.method('update')
+@parameter('name', String(max=64), "Name", required=True)
+@url_parameter('gizmo_id', Int, "Gizmo ID")
+class UpdateGizmo(UpdateOperation):
+    pass
+
+
+@GizmoAPI.method('bulk_create')
+@parameter('name', String(max=64), "Name", required=True)
+class BulkCreateGizmos(BulkCreateOperation):
+    pass
+
+
+class TestResultCache(SQLiteTestBase):
+
+    app_name = 'cache_test'
+    queries = 0
+
+    def api_args(self):
+        return {'cache_backend': LRUBackend(), 'batch_args': {}}
+
+    def populate(self):
+        db.session.add(Gizmo(id=1, name=u'first'))
+
+    def record_statement(self, connection, cursor, statement, *args):
+        if statement.startswith('SELECT'):
+            self.queries += 1
+
+    def get(self, path, **kwargs):
+        self.queries = 0
+        rv = self.client.get(path, **kwargs)
+        assert rv.status_code == 200, rv.data
+        return json.loads(rv.data)['response_data']
+
+    def test_hits(self):
+        stats = result_cache.stats()
+        assert self.get('/gizmos/1')['name'] == 'first'
+        assert self.queries == 1
+        assert self.get('/gizmos/1')['name'] == 'first'
+        assert self.queries == 0
+        assert result_cache.stats()['hits'] == stats['hits'] + 1
+        assert result_cache.stats()['misses'] == stats['misses'] + 1
+        # other params: other entries
+        self.get('/gizmos/1?fields=name')
+        assert self.queries == 1
+
+    def batch_get(self, path, headers):
+        self.queries = 0
+        rv = self.client.post('/batch', data=json.dumps([{'method': 'GET', 'path': path}]),
+                              content_type='application/json', headers=headers)
+        assert rv.status_code == 200, rv.data
+        [call] = json.loads(rv.data)['response_data']
+        assert call['status_code'] == 1000, call
+        return call['response_data']
+
+    def test_oauth_scope(self):
+        with oauth_required():
+            self.get('/gizmos/1', headers=oauth_header('consumer', 'token'))
+            assert self.queries == 1
+            self.get('/gizmos/1', headers=oauth_header('consumer', 'token'))
+            assert self.queries == 0
+            # other consumers, and other tokens of the same consumer: other entries
+            self.get('/gizmos/1', headers=oauth_header('other consumer', 'token'))
+            assert self.queries == 1
+            self.get('/gizmos/1', headers=oauth_header('consumer', 'other token'))
+            assert self.queries == 1
+
+    def test_oauth_scope_batch(self):
+        with oauth_required():
+            self.batch_get('/gizmos/1', oauth_header('consumer', 'token'))
+            assert self.queries == 1
+            self.batch_get('/gizmos/1', oauth_header('consumer', 'token'))
+            assert self.queries == 0
+            self.batch_get('/gizmos/1', oauth_header('other consumer', 'token'))
+            assert self.queries == 1
+            # the batch and its calls share the entries of their credentials
+            self.get('/gizmos/1', headers=oauth_header('other consumer', 'token'))
+            assert self.queries == 0
+
+    def test_oauth_without_scope(self):
+        RetrieveGizmo.cache_scope = lambda self: None
+        try:
+            with oauth_required():
+                self.get('/gizmos/1', headers=oauth_header('consumer', 'token'))
+                self.get('/gizmos/1', headers=oauth_header('consumer', 'token'))
+                assert self.queries == 1
+        finally:
+            del RetrieveGizmo.cache_scope
+
+    def test_invalidation(self):
+        assert len(self.get('/gizmos')) == 1
+        self.get('/gizmos/1')
+        rv = self.client.put('/gizmos/1', data=json.dumps({'name': 'second'}), content_type='application/json')
+        assert rv.status_code == 200, rv.data
+        assert self.get('/gizmos/1')['name'] == 'second'
+        assert self.queries == 1
+        # executemany inserts bypass the ORM's events
+        rv = self.client.post('/gizmos', data=json.dumps([{'name': 'third'}]), content_type='application/json')
+        assert rv.status_code == 200, rv.data
+        assert len(self.get('/gizmos')) == 2
+        with self.app.app_context():
+            Gizmo.query.filter(Gizmo.id == 1).update({'name': u'fourth'}, synchronize_session=False)
+            db.session.commit()
+        assert self.get('/gizmos/1')['name'] == 'fourth'
@@ -0,0 +1,54 @@
+import json
+import threading
+import time
+
+from formencode.validators import Int
+
+from hoops.base import APIOperation, APIResource, parameter
+from hoops.response import APIResponse
+from tests.api_tests import APITestBase
+
+
+class EchoAPI(APIResource):
+    route = '/echo'
+
+
+@EchoAPI.method('list')
+@parameter('value', Int, "Value to echo", required=True)
+class EchoOperation(APIOperation):
+
+    def process_request(self, *args, **kwargs):
+        # give other requests a chance to run while we hold our params
+        time.sleep(0.001)
+        return APIResponse({'value': self.params['value']})
+
+
+class TestConcurrency(APITestBase):
+
+    def test_params_do_not_leak(self):
+        """Concurrent requests against one worker each see only their own params"""
+        leaks = []
+
+        def worker(offset):
+            client = self._app.test_client()
+            for i in range(20):
+                value = offset + i
+                data = json.loads(client.get('/echo?value=%d' % value).data)
+                if data['response_data']['value'] != value:
+                    leaks.append((value, data['response_data']['value']))
+
+        threads = [threading.Thread(target=worker, args=(n * 1000,)) for n in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not leaks, leaks
+
+    def test_for_request(self):
+        """Request-scoped copies share configuration but not state"""
+        op = EchoAPI.list
+        copy = op.for_request()
+        assert copy is not op
+        assert copy.resource is op.resource
+        copy.params = {'value': 1}
+        assert not hasattr(op, 'params')
@@ -0,0 +1,109 @@
+import json
+
+from coaster.sqlalchemy import BaseMixin
+from formencode.validators import Int, String
+
+from hoops.base import APIResource, parameter, url_parameter
+from hoops.generic import ListOperation, RetrieveOperation, UpdateOperation
+from hoops.restful import not_modified
+from tests.api_tests import SQLiteModel, SQLiteTestBase, oauth_header, oauth_required, sqlite_db as db
+
+
+class Doohickey(BaseMixin, SQLiteModel):
+    __tablename__ = 'etag_doohickey'
+    name = db.Column(db.Unicode(64))
+
+    def updates_permitted(self):
+        return True
+
+
+class DoohickeyAPI(APIResource):
+    route = '/doohickeys'
+    object_route = '/doohickeys/<int:doohickey_id>'
+    object_id_param = 'doohickey_id'
+    model = Doohickey
+    read_only = False
+
+
+@DoohickeyAPI.method('list')
+class ListDoohickeys(ListOperation):
+    pass
+
+
+@DoohickeyAPI.method('retrieve')
+@url_parameter('doohickey_id', Int, "Doohickey ID")
+class RetrieveDoohickey(RetrieveOperation):
+    pass
+
+
+@DoohickeyAPI.method('update')
+@parameter('name', String(max=64), "Name", required=True)
+@url_parameter('doohickey_id', Int, "Doohickey ID")
+class UpdateDoohickey(UpdateOperation):
+    pass
+
+
+class TestETags(SQLiteTestBase):
+
+    app_name = 'etag_test'
+
+    def populate(self):
+        db.session.add(Doohickey(id=1, name=u'first'))
+        db.session.add(Doohickey(id=2, name=u'second'))
+
+    def get(self, path, etag=None, headers=None):
+        self.statements = []
+        headers = dict(headers or {})
+        if etag:
+            headers['If-None-Match'] = etag
+        return self.client.get(path, headers=headers)
+
+    def test_retrieve(self):
+        rv = self.get('/doohickeys/1')
+        assert rv.status_code == 200
+        etag = rv.headers['ETag']
+        assert etag.startswith('W/"')
+        assert self.get('/doohickeys/1').headers['ETag'] == etag
+        assert self.get('/doohickeys/1?fields=name').headers['ETag'] != etag
+        # only the id and timestamp are loaded to answer a matching If-None-Match
+        rv = self.get('/doohickeys/1', etag=etag)
+        assert rv.status_code == 304
+        assert rv.data == ''
+        assert rv.headers['ETag'] == etag
+        assert rv.headers['Vary'] == 'Accept-Encoding'
+        assert len(self.statements) == 1
+        assert 'name' not in self.statements[0]
+
+        self.client.put('/doohickeys/1', data=json.dumps({'name': 'renamed'}), content_type='application/json')
+        rv = self.get('/doohickeys/1', etag=etag)
+        assert rv.status_code == 200
+        assert rv.headers['ETag'] != etag
+        assert json.loads(rv.data)['response_data']['name'] == 'renamed'
+
+    def test_list(self):
+        rv = self.get('/doohickeys')
+        assert rv.status_code == 200
+        etag = rv.headers['ETag']
+        assert self.get('/doohickeys', etag=etag).status_code == 304
+        assert self.get('/doohickeys?limit=1', etag=etag).status_code == 200
+        self.client.put('/doohickeys/2', data=json.dumps({'name': 'renamed'}), content_type='application/json')
+        assert self.get('/doohickeys', etag=etag).status_code == 200
+
+    def test_not_modified_headers(self):
+        with self.app.test_request_context('/doohickeys/1'):
+            resp = not_modified('abc', {'Cache-Control': 'private, max-age=60', 'Vary': 'Origin', 'X-Other': '1'})
+        assert resp.status_code == 304
+        assert 'Content-Type' not in resp.headers, resp.headers
+        assert resp.headers['ETag'] == 'W/"abc"'
+        assert resp.headers['Cache-Control'] == 'private, max-age=60'
+        assert resp.headers['Vary'] == 'Origin, Accept-Encoding'
+        assert 'X-Other' not in resp.headers
+
+    def test_oauth_scope(self):
+        with oauth_required():
+            for path in ('/doohickeys/1', '/doohickeys'):
+                etag = self.get(path, headers=oauth_header('consumer', 'token')).headers['ETag']
+                assert self.get(path, etag, oauth_header('consumer', 'token')).status_code == 304
+                # other consumers may see other rows at the same URL
+                assert self.get(path, etag, oauth_header('other consumer', 'token')).status_code == 200
+                assert self.get(path, etag, oauth_header('consumer', 'other token')).status_code == 200
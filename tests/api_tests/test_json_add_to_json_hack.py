@@ -1,6 +1,7 @@
 
 from tests.api_tests import APITestBase
 import json
+import hoops.json_add_to_json_hack
 
 
 class TestAPIApp(APITestBase):
@@ -11,7 +12,8 @@ class TestAPIApp(APITestBase):
             def to_json(self):
                 return {'test': 1}
 
-        # This will fail if the monkeypatch in json_add_to_json_hack is not loaded
+        # This will fail if the monkeypatch in json_add_to_json_hack is not loaded;
+        # create_api no longer loads it, responses go through hoops.json_encoding
         json.dumps(WithToJson())
         assert True
 
@@ -0,0 +1,62 @@
+import datetime
+import decimal
+import json
+
+from hoops.json_encoding import get_backend, register_type, JSONBackend
+
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class Point3D(Point):
+    pass
+
+
+class WithToJson(object):
+    def to_json(self):
+        return {'test': 1}
+
+
+class TestJSONEncoding(object):
+
+    def test_backends(self):
+        assert get_backend('json').module is json
+        assert get_backend(json).name == 'json'
+        backend = get_backend()
+        assert get_backend(backend) is backend
+        try:
+            get_backend(datetime)
+            assert False, 'modules without dumps() are not encoders'
+        except ValueError:
+            pass
+
+    def test_compact_and_indented(self):
+        backend = get_backend('json')
+        data = {'b': [1, 2], 'a': None}
+        assert ' ' not in backend.dumps(data)
+        assert backend.dumps(data, indent=4) == json.dumps(data, sort_keys=True, indent=4, separators=(',', ': '))
+
+    def test_type_dispatch(self):
+        backend = get_backend('json')
+        data = {
+            'when': datetime.datetime(2014, 1, 2, 3, 4, 5),
+            'day': datetime.date(2014, 1, 2),
+            'price': decimal.Decimal('1.50'),
+            'obj': WithToJson(),
+        }
+        assert json.loads(backend.dumps(data)) == {
+            'when': '2014-01-02 03:04:05',
+            'day': '2014-01-02',
+            'price': '1.50',
+            'obj': {'test': 1},
+        }
+        try:
+            backend.dumps(Point(1, 2))
+            assert False, 'Point is not registered yet'
+        except TypeError:
+            pass
+        register_type(Point, lambda p: [p.x, p.y])
+        assert backend.dumps([Point(1, 2), Point3D(3, 4)]) == '[[1,2],[3,4]]'
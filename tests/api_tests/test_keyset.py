@@ -0,0 +1,71 @@
+import json
+
+from hoops.base import APIResource
+from hoops.generic import ExportOperation, ListOperation
+from tests.api_tests import SQLiteModel, SQLiteTestBase, sqlite_db as db
+
+
+class Widget(SQLiteModel):
+    __tablename__ = 'keyset_widget'
+    id = db.Column(db.Integer, primary_key=True)
+    rank = db.Column(db.Integer, nullable=True)
+
+
+class WidgetAPI(APIResource):
+    route = '/keyset_widgets'
+    model = Widget
+
+
+@WidgetAPI.method('list')
+class ListWidgets(ListOperation):
+    pass
+
+
+class WidgetExportAPI(APIResource):
+    route = '/keyset_widgets/export'
+    model = Widget
+
+
+@WidgetExportAPI.method('list')
+class ExportWidgets(ExportOperation):
+    batch_size = 2
+
+
+class TestKeysetNulls(SQLiteTestBase):
+    '''Keyset queries walk past NULL sort values: first in ascending order, last in descending order'''
+
+    app_name = 'keyset_test'
+    # (id, rank) in ascending rank order
+    ascending = [2, 4, 6, 3, 5, 1]
+
+    def populate(self):
+        for (widget_id, rank) in ((1, 3), (2, None), (3, 1), (4, None), (5, 2), (6, None)):
+            db.session.add(Widget(id=widget_id, rank=rank))
+
+    def export(self, sort_order):
+        rv = self.client.get('/keyset_widgets/export', query_string={'sort_by': 'rank', 'sort_order': sort_order})
+        assert rv.status_code == 200, rv.data
+        return [json.loads(line)['id'] for line in rv.data.splitlines()]
+
+    def test_export(self):
+        # batches of two end on the NULLs of widgets 4 (ascending) and 6 (descending)
+        assert self.export('asc') == self.ascending
+        assert self.export('desc') == list(reversed(self.ascending))
+
+    def walk(self, sort_order):
+        found = []
+        cursor = ''
+        while cursor is not None:
+            rv = self.client.get('/keyset_widgets', query_string={
+                'sort_by': 'rank', 'sort_order': sort_order, 'limit': 2, 'cursor': cursor})
+            out = json.loads(rv.data)
+            assert rv.status_code == 200, out
+            assert out['pagination']['sort_dir'] == sort_order, out['pagination']
+            found.extend(item['id'] for item in out['response_data'] or [])
+            cursor = out['pagination']['next_cursor']
+        return found
+
+    def test_cursor(self):
+        # the first next_cursor holds the NULL rank of widget 4 (ascending)
+        assert self.walk('asc') == self.ascending
+        assert self.walk('desc') == list(reversed(self.ascending))
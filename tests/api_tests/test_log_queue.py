@@ -0,0 +1,135 @@
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+from flask import Flask
+
+from hoops import logger as hoops_logger
+from hoops.logger import configure_logging, queue_stats, stop_log_queue
+
+
+class GatedHandler(logging.Handler):
+    '''Holds every record until the gate opens'''
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.gate = threading.Event()
+        self.records = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.gate.wait()
+        self.threads.add(threading.current_thread().name)
+        self.records.append(record.getMessage())
+
+
+def logging_config(tmp):
+    return {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'gated': {'()': GatedHandler, 'level': 'DEBUG'},
+            'file': {'class': 'hoops.logger.ReopenableFileHandler', 'filename': os.path.join(tmp, 'queue.log')},
+            'request': {'class': 'hoops.logger.ReopenableFileHandler', 'filename': os.path.join(tmp, 'request.log'),
+                        'formatter': 'request', 'filters': ['request_context']},
+        },
+        'formatters': {'request': {'format': '%(request_uid)s %(message)s'}},
+        'filters': {'request_context': {'()': 'hoops.logger.ContextFilter'}},
+        'loggers': {
+            'log_queue_test': {'level': 'DEBUG', 'handlers': ['gated'], 'propagate': False},
+            'log_queue_test.file': {'level': 'DEBUG', 'handlers': ['file'], 'propagate': False},
+            'log_queue_test.request': {'level': 'DEBUG', 'handlers': ['request'], 'propagate': False},
+        },
+    }
+
+
+class TestLogQueue(unittest.TestCase):
+    '''Records are written out by a background thread'''
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log = logging.getLogger('log_queue_test')
+
+    def tearDown(self):
+        stop_log_queue()
+        hoops_logger._reopen_signals.clear()
+        logging.disable(logging.NOTSET)
+        for name in ('log_queue_test', 'log_queue_test.file', 'log_queue_test.request'):
+            for handler in logging.getLogger(name).handlers[:]:
+                logging.getLogger(name).removeHandler(handler)
+        shutil.rmtree(self.tmp)
+
+    def configure(self, **kwargs):
+        configure_logging('hoops', logging_config=logging_config(self.tmp), log_level='DEBUG', **kwargs)
+        [handler] = self.log.handlers
+        return handler.handlers[0] if kwargs.get('queue_size') else handler
+
+    def test_written_by_background_thread(self):
+        gated = self.configure(queue_size=10)
+        gated.gate.set()
+        self.log.info('value %s', [1])
+        stop_log_queue()
+        assert gated.records == ['value [1]'], gated.records
+        assert gated.threads == set(['hoops-log-queue']), gated.threads
+
+    def test_arguments_formatted_when_logged(self):
+        gated = self.configure(queue_size=10)
+        value = [1]
+        self.log.info('value %s', value)
+        value.append(2)
+        gated.gate.set()
+        stop_log_queue()
+        assert gated.records == ['value [1]'], gated.records
+
+    def test_request_context_kept(self):
+        self.configure(queue_size=10)
+        log = logging.getLogger('log_queue_test.request')
+        with Flask(__name__).test_request_context('/', environ_base={'REQUEST_UID': 'uid-123'}):
+            log.info('in the request')
+        log.info('outside of it')
+        stop_log_queue()
+        lines = open(os.path.join(self.tmp, 'request.log')).read().splitlines()
+        assert lines == ['uid-123 in the request', ' outside of it'], lines
+
+    def test_drop_when_full(self):
+        gated = self.configure(queue_size=2)
+        self.log.info('record 0')
+        # the listener holds the first record while the gate is closed
+        while queue_stats()['queued']:
+            time.sleep(0.01)
+        for i in range(1, 10):
+            self.log.info('record %d', i)
+        stats = queue_stats()
+        assert stats['dropped'] == 7, stats
+        assert stats['capacity'] == 2, stats
+        gated.gate.set()
+        stop_log_queue()
+        assert gated.records == ['record 0', 'record 1', 'record 2'], gated.records
+
+    def test_block_when_full(self):
+        gated = self.configure(queue_size=1, queue_overflow='block')
+        timer = threading.Timer(0.2, gated.gate.set)
+        timer.start()
+        for i in range(5):
+            self.log.info('record %d', i)
+        stats = queue_stats()
+        stop_log_queue()
+        assert stats['dropped'] == 0, stats
+        assert gated.records == ['record %d' % i for i in range(5)], gated.records
+
+    def test_reopen_on_signal(self):
+        self.configure(reopen_signal=signal.SIGUSR2)
+        log = logging.getLogger('log_queue_test.file')
+        path = os.path.join(self.tmp, 'queue.log')
+        log.info('before rotation')
+        os.rename(path, path + '.1')
+        log.info('still in the rotated file')
+        os.kill(os.getpid(), signal.SIGUSR2)
+        log.info('after rotation')
+        assert open(path + '.1').read() == 'before rotation\nstill in the rotated file\n'
+        assert open(path).read() == 'after rotation\n'
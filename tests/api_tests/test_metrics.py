@@ -0,0 +1,140 @@
+import re
+import shutil
+import tempfile
+import unittest
+
+from formencode.validators import Int
+
+from hoops.base import APIOperation, APIResource, url_parameter
+from hoops.core import create_api
+from hoops.metrics import MmapValues
+from hoops.response import APIResponse
+from hoops.restful import Resource
+from hoops.status import library as status_library
+from tests.api_tests import close_log_files
+
+
+class GadgetAPI(APIResource):
+    route = '/gadgets'
+    object_route = '/gadgets/<int:gadget_id>'
+    object_id_param = 'gadget_id'
+
+
+@GadgetAPI.method('list')
+class ListGadgets(APIOperation):
+
+    def process_request(self, *args, **kwargs):
+        return APIResponse([{'id': i} for i in range(100)])
+
+
+@GadgetAPI.method('retrieve')
+@url_parameter('gadget_id', Int, "Gadget ID")
+class RetrieveGadget(APIOperation):
+
+    def process_request(self, *args, **kwargs):
+        if self.url_params['gadget_id'] == 0:
+            raise status_library.API_RESOURCE_NOT_FOUND
+        return APIResponse({'id': self.url_params['gadget_id']})
+
+
+def sample(text, line_start):
+    '''Value of the sample starting with line_start, or None'''
+    match = re.search('^%s (\S+)$' % re.escape(line_start), text, re.M)
+    return float(match.group(1)) if match else None
+
+
+class TestMetrics(unittest.TestCase):
+    '''Request metrics are served in the Prometheus text format'''
+
+    metrics_args = {}
+
+    def setUp(self):
+        self.log_path = tempfile.mkdtemp()
+        (self.app, _, api) = create_api('metrics_test', metrics_args=dict(self.metrics_args),
+                                        log_args={'log_path': self.log_path})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        close_log_files(self.log_path)
+
+    def scrape(self):
+        rv = self.client.get('/metrics')
+        assert rv.status_code == 200, rv.data
+        assert rv.mimetype == 'text/plain', rv.mimetype
+        return rv.data
+
+    def test_request_counts(self):
+        self.client.get('/gadgets')
+        self.client.get('/gadgets/1')
+        self.client.get('/gadgets/2')
+        self.client.get('/gadgets/0')
+        text = self.scrape()
+        assert '# TYPE hoops_requests_total counter' in text, text
+        assert sample(text, 'hoops_requests_total{route="/gadgets",method="GET",http_status="200",status_code="1000"}') == 1
+        assert sample(text, 'hoops_requests_total{route="/gadgets/<int:gadget_id>",method="GET",http_status="200",status_code="1000"}') == 2
+        assert sample(text, 'hoops_requests_total{route="/gadgets/<int:gadget_id>",method="GET",http_status="404",status_code="4004"}') == 1
+        assert sample(text, 'hoops_requests_in_flight{route="/gadgets",method="GET"}') == 0
+        # the scrapes themselves aren't counted
+        assert 'route="/metrics"' not in self.scrape()
+
+    def test_histograms(self):
+        self.client.get('/gadgets')
+        self.client.get('/gadgets/1')
+        text = self.scrape()
+        route = 'route="/gadgets/<int:gadget_id>",method="GET"'
+        assert sample(text, 'hoops_request_duration_seconds_bucket{%s,le="10.0"}' % route) == 1, text
+        assert sample(text, 'hoops_request_duration_seconds_bucket{%s,le="+Inf"}' % route) == 1, text
+        assert sample(text, 'hoops_request_duration_seconds_count{%s}' % route) == 1, text
+        # the list page is over 1024 bytes, the single gadget under 256
+        assert sample(text, 'hoops_response_size_bytes_bucket{%s,le="256"}' % route) == 1, text
+        assert sample(text, 'hoops_response_size_bytes_bucket{route="/gadgets",method="GET",le="1024"}') == 0, text
+        assert sample(text, 'hoops_response_size_bytes_count{route="/gadgets",method="GET"}') == 1, text
+        assert sample(text, 'hoops_result_cache_hits_total') is not None, text
+
+
+class TestSharedMetrics(TestMetrics):
+    '''Workers add up their metrics through a shared directory'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.metrics_args = {'directory': self.directory}
+        super(TestSharedMetrics, self).setUp()
+
+    def tearDown(self):
+        super(TestSharedMetrics, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def other_worker(self, kind, pid, value):
+        values = MmapValues('%s/%s_%d.db' % (self.directory, kind, pid))
+        metric = 'hoops_requests_total' if kind == 'counter' else 'hoops_requests_in_flight'
+        labels = ['/gadgets', 'GET', '200', '1000'] if kind == 'counter' else ['/gadgets', 'GET']
+        values.add('["%s", "", %s, null]' % (metric, str(labels).replace("'", '"')), value)
+
+    def test_other_workers(self):
+        self.client.get('/gadgets')
+        self.other_worker('counter', 1, 5)
+        # no process has that pid, so its gauges are left out
+        self.other_worker('gauge', 2 ** 22 + 1, 3)
+        text = self.scrape()
+        assert sample(text, 'hoops_requests_total{route="/gadgets",method="GET",http_status="200",status_code="1000"}') == 6, text
+        assert sample(text, 'hoops_requests_in_flight{route="/gadgets",method="GET"}') == 0, text
+
+
+class TestMetricsWithOAuth(unittest.TestCase):
+    '''The metrics route doesn't require OAuth'''
+
+    def setUp(self):
+        self.log_path = tempfile.mkdtemp()
+        (self.app, _, api) = create_api('metrics_oauth_test', metrics_args={'route': '/status/metrics'},
+                                        oauth_args={'consumer_key': None, 'consumer_secret': None},
+                                        log_args={'log_path': self.log_path})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        Resource.method_decorators = []
+        close_log_files(self.log_path)
+
+    def test_scrape(self):
+        rv = self.client.get('/status/metrics')
+        assert rv.status_code == 200, rv.data
+        assert '# TYPE hoops_requests_total counter' in rv.data, rv.data
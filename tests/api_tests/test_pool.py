@@ -0,0 +1,116 @@
+import re
+
+from flask.ext.sqlalchemy import SQLAlchemy
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from hoops.common import BareModel
+from hoops.pool import pool_stats
+from tests.api_tests import SQLiteTestBase
+
+
+class QueuePoolSQLAlchemy(SQLAlchemy):
+    '''SQLite file databases don't use a QueuePool by default; MySQL ones do'''
+
+    def apply_driver_hacks(self, app, info, options):
+        super(QueuePoolSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        options['poolclass'] = QueuePool
+
+db = QueuePoolSQLAlchemy()
+
+
+class Model(db.Model, BareModel):
+    __abstract__ = True
+
+
+class Widget(Model):
+    __tablename__ = 'pool_widget'
+    id = db.Column(db.Integer, primary_key=True)
+
+
+class TestPool(SQLiteTestBase):
+
+    db = db
+    app_name = 'pool_test'
+
+    def setUp(self):
+        super(TestPool, self).setUp()
+        self.engine = self.app.pool_metrics[None].engine
+        self.app.pool_metrics[None].reset()
+
+    def api_args(self):
+        return {'metrics_args': {}}
+
+    def db_config(self):
+        config = super(TestPool, self).db_config()
+        config.update(pool_size=2, max_overflow=1, pool_timeout=0.1, pool_recycle=3600, pool_pre_ping=True)
+        return config
+
+    def test_settings(self):
+        assert self.app.config['SQLALCHEMY_POOL_SIZE'] == 2
+        assert self.app.config['SQLALCHEMY_MAX_OVERFLOW'] == 1
+        assert self.app.config['SQLALCHEMY_POOL_RECYCLE'] == 3600
+        assert self.engine.pool.size() == 2
+
+    def test_checkout_metrics(self):
+        connections = [self.engine.connect() for n in range(3)]
+        stats = pool_stats(self.app)[None]
+        assert stats['checkouts'] == 3
+        assert stats['checked_out'] == 3
+        assert stats['overflow'] == 1
+        self.assertRaises(exc.TimeoutError, self.engine.connect)
+        stats = pool_stats(self.app)[None]
+        assert stats['timeouts'] == 1
+        assert stats['checkout_wait_max'] >= 0.1
+        for connection in connections:
+            connection.close()
+        stats = pool_stats(self.app)[None]
+        assert stats['checkins'] == 3
+        assert stats['checked_out'] == 0
+
+    def test_pre_ping(self):
+        connection = self.engine.connect()
+        dbapi_connection = connection.connection.connection
+        connection.close()
+        dbapi_connection.close()  # the server went away while it was in the pool
+        connection = self.engine.connect()
+        assert connection.execute('SELECT 1').scalar() == 1
+        connection.close()
+        stats = pool_stats(self.app)[None]
+        assert stats['ping_failures'] == 1
+        assert stats['invalidations'] == 1
+        # metrics survive the pool being recreated
+        self.engine.dispose()
+        self.engine.connect().close()
+        assert pool_stats(self.app)[None]['checkouts'] == 3
+
+    def test_sqlite_savepoints(self):
+        with self.app.app_context():
+            db.session.add(Widget(id=1))
+            db.session.flush()
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(Widget.__table__.insert(), {'id': 1})
+            except exc.IntegrityError:
+                pass
+            db.session.add(Widget(id=2))
+            db.session.commit()
+            assert [widget.id for widget in Widget.query.order_by(Widget.id)] == [1, 2]
+
+    def test_metrics(self):
+        connections = [self.engine.connect() for n in range(3)]
+        text = self.client.get('/metrics').data
+        for connection in connections:
+            connection.close()
+        stats = pool_stats(self.app)[None]
+
+        def sample(name):
+            match = re.search('^%s{bind=""} (\S+)$' % name, text, re.M)
+            assert match, (name, text)
+            return float(match.group(1))
+        assert sample('hoops_db_pool_checkouts_total') == 3
+        assert sample('hoops_db_pool_checked_out') == 3
+        assert sample('hoops_db_pool_overflow') == 1
+        assert '# TYPE hoops_db_pool_checkout_wait_seconds_total counter' in text, text
+        assert abs(sample('hoops_db_pool_checkout_wait_seconds_total') - stats['checkout_wait']) < 1e-6
+        assert 0 <= sample('hoops_db_pool_checkout_wait_max_seconds') <= sample('hoops_db_pool_checkout_wait_seconds_total')
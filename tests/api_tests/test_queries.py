@@ -0,0 +1,131 @@
+import logging
+
+from formencode.validators import Int
+
+from hoops.base import APIModelOperation, APIResource, url_parameter
+from hoops.generic import RetrieveOperation
+from hoops.queries import query_budget
+from hoops.response import APIResponse
+from tests.api_tests import SQLiteModel, SQLiteTestBase, sqlite_db as db
+
+
+class Gizmo(SQLiteModel):
+    __tablename__ = 'queries_gizmo'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.Unicode(64))
+
+
+class GizmoAPI(APIResource):
+    route = '/queries_gizmos'
+    object_route = '/queries_gizmos/<int:gizmo_id>'
+    object_id_param = 'gizmo_id'
+    model = Gizmo
+
+
+@GizmoAPI.method('list')
+class ListGizmosOneByOne(APIModelOperation):
+    '''Fetches the gizmos one query at a time'''
+
+    def process_request(self, *args, **kwargs):
+        ids = [gizmo_id for (gizmo_id, ) in db.session.query(Gizmo.id)]
+        return APIResponse([db.session.query(Gizmo).filter_by(id=gizmo_id).one() for gizmo_id in ids])
+
+
+@GizmoAPI.method('retrieve')
+@url_parameter('gizmo_id', Int, "Gizmo ID")
+class RetrieveGizmo(RetrieveOperation):
+    pass
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        # formatted while the objects logged are still attached to the session
+        record.message = record.getMessage()
+        self.records.append(record)
+
+
+class TestQueries(SQLiteTestBase):
+    '''Requests count their statements, and catch statements repeated once per item'''
+
+    app_name = 'queries_test'
+    flask_config = {'DEBUG': True, 'QUERY_STATS': True, 'QUERY_REPEAT_LIMIT': 3}
+
+    def setUp(self):
+        super(TestQueries, self).setUp()
+        self.handler = RecordingHandler()
+        logging.getLogger('api.request').addHandler(self.handler)
+
+    def tearDown(self):
+        logging.getLogger('api.request').removeHandler(self.handler)
+        super(TestQueries, self).tearDown()
+
+    def api_args(self):
+        return {'log_config': {
+            'version': 1,
+            'disable_existing_loggers': False,
+            'loggers': {'api.request': {'level': 'DEBUG', 'propagate': False}},
+        }}
+
+    def populate(self):
+        db.session.add_all([Gizmo(name=u'gizmo %d' % i) for i in range(5)])
+
+    def get(self, path, status_code=200):
+        rv = self.client.get(path)
+        assert rv.status_code == status_code, rv.data
+        return rv
+
+    def test_budget(self):
+        with query_budget(self.app, 1) as budget:
+            self.get('/queries_gizmos/1')
+        assert budget[0].count == 1, budget[0].statements
+
+    def test_budget_exceeded(self):
+        try:
+            with query_budget(self.app, 2):
+                self.get('/queries_gizmos')
+        except AssertionError as e:
+            assert '6 statements run, over the budget of 2' in str(e), e
+            assert '5 x SELECT' in str(e), e
+        else:
+            self.fail('budget not enforced')
+
+    def test_repeats_logged(self):
+        self.get('/queries_gizmos')
+        [warning] = [record for record in self.handler.records if record.levelno == logging.WARNING]
+        assert warning.message.startswith('Statement ran 4 times in one request: SELECT'), warning.message
+        [summary] = [record.message for record in self.handler.records if 'statements in' in record.message]
+        assert summary.startswith('6 statements in'), summary
+
+    def test_repeats_fail(self):
+        self.app.config['QUERY_REPEAT_ACTION'] = 'fail'
+        self.get('/queries_gizmos', status_code=500)
+        self.get('/queries_gizmos/1')
+
+    def test_repeats_allowed_outside_debug(self):
+        self.app.debug = False
+        self.app.config['QUERY_REPEAT_ACTION'] = 'fail'
+        self.get('/queries_gizmos')
+        assert not [record for record in self.handler.records if record.levelno == logging.WARNING]
+
+    def test_shared_with_timing(self):
+        self.app.config['REQUEST_TIMING'] = True
+        with query_budget(self.app, 6) as budget:
+            rv = self.get('/queries_gizmos')
+        # one listener times each statement for both
+        timings = rv.headers['Server-Timing'].split(', ')
+        assert 'db;dur=%.3f' % (budget[0].seconds * 1000) in timings, (timings, budget[0].seconds)
+
+    def test_disabled(self):
+        self.app.config['QUERY_STATS'] = False
+        self.get('/queries_gizmos')
+        assert not [record for record in self.handler.records
+                    if record.levelno == logging.WARNING or 'statements in' in record.message]
+        # budgets count the statements regardless
+        with query_budget(self.app, 6) as budget:
+            self.get('/queries_gizmos')
+        assert budget[0].count == 6, budget[0].statements
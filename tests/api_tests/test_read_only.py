@@ -0,0 +1,149 @@
+import json
+
+from coaster.sqlalchemy import BaseMixin
+from formencode.validators import Int, String
+from sqlalchemy import event
+
+from hoops import read_only
+from hoops.base import APIResource, parameter, url_parameter
+from hoops.generic import CreateOperation, ExportOperation, ListOperation, RetrieveOperation, UpdateOperation
+from tests.api_tests import SQLiteModel, SQLiteTestBase, sqlite_db as db
+
+
+class Doohickey(BaseMixin, SQLiteModel):
+    __tablename__ = 'read_only_doohickey'
+    name = db.Column(db.Unicode(64))
+
+    def updates_permitted(self):
+        return True
+
+
+class DoohickeyAPI(APIResource):
+    route = '/read_only_doohickeys'
+    object_route = '/read_only_doohickeys/<int:doohickey_id>'
+    object_id_param = 'doohickey_id'
+    model = Doohickey
+    read_only = False
+
+
+@DoohickeyAPI.method('list')
+class ListDoohickeys(ListOperation):
+    pass
+
+
+@DoohickeyAPI.method('retrieve')
+@url_parameter('doohickey_id', Int, "Doohickey ID")
+class RenamingRetrieve(RetrieveOperation):
+    '''Writes while reading, which a read-only transaction rejects'''
+
+    def process_request(self, *args, **kwargs):
+        self.fetch().name = u'renamed'
+        db.session.flush()
+
+
+@DoohickeyAPI.method('create')
+@parameter('name', String(max=64), "Name", required=True)
+class CreateDoohickey(CreateOperation):
+    pass
+
+
+@DoohickeyAPI.method('update')
+@parameter('name', String(max=64), "Name", required=True)
+@url_parameter('doohickey_id', Int, "Doohickey ID")
+class UpdateDoohickey(UpdateOperation):
+    pass
+
+
+class DoohickeyExportAPI(APIResource):
+    route = '/read_only_doohickeys/export'
+    model = Doohickey
+
+
+@DoohickeyExportAPI.method('list')
+class ExportDoohickeys(ExportOperation):
+    pass
+
+
+class TestReadOnly(SQLiteTestBase):
+    '''GET operations run in read-only transactions'''
+
+    app_name = 'read_only_test'
+
+    def setUp(self):
+        super(TestReadOnly, self).setUp()
+        # SQLite has no read-only transactions; a harmless statement stands in for one
+        read_only.read_only_statements['sqlite'] = 'SELECT 1'
+        event.listen(self.app.pool_metrics[None].engine, 'commit', lambda connection: self.statements.append('COMMIT'))
+
+    def tearDown(self):
+        del read_only.read_only_statements['sqlite']
+        super(TestReadOnly, self).tearDown()
+
+    def api_args(self):
+        return {'batch_args': {}}
+
+    def populate(self):
+        db.session.add(Doohickey(name=u'first'))
+
+    def send(self, method, path, params=None):
+        self.statements = []
+        if method == 'GET':
+            return self.client.get(path, query_string=params or {})
+        return self.client.open(path, method=method, data=json.dumps(params or {}), content_type='application/json')
+
+    def names(self):
+        with self.app.app_context():
+            return [doohickey.name for doohickey in Doohickey.query.order_by(Doohickey.id)]
+
+    def test_get_starts_read_only_transaction(self):
+        rv = self.send('GET', '/read_only_doohickeys')
+        assert rv.status_code == 200, rv.data
+        assert self.statements[0] == 'SELECT 1', self.statements
+        assert 'COMMIT' not in self.statements, self.statements
+
+    def test_streamed_export(self):
+        rv = self.send('GET', '/read_only_doohickeys/export')
+        assert rv.status_code == 200, rv.data
+        assert [json.loads(line)['name'] for line in rv.data.splitlines()] == ['first']
+        assert self.statements[0] == 'SELECT 1', self.statements
+        assert 'COMMIT' not in self.statements, self.statements
+
+    def test_write_not_read_only(self):
+        rv = self.send('POST', '/read_only_doohickeys', {'name': 'second'})
+        assert rv.status_code == 200, rv.data
+        assert 'SELECT 1' not in self.statements, self.statements
+        assert 'COMMIT' in self.statements, self.statements
+        assert self.names() == ['first', 'second']
+
+    def test_get_rejects_writes(self):
+        rv = self.send('GET', '/read_only_doohickeys/1')
+        assert rv.status_code >= 500, rv.data
+        assert not any(statement.startswith('UPDATE') for statement in self.statements), self.statements
+        assert self.names() == ['first']
+
+    def test_session_mode(self):
+        with self.app.test_request_context('/read_only_doohickeys'):
+            session = db.session()
+            read_only.use_read_only(True)
+            assert not session.autoflush
+            Doohickey.query.get(1).name = u'renamed'
+            self.assertRaises(read_only.ReadOnlyTransactionError, session.flush)
+            session.rollback()
+            read_only.use_read_only(False)
+            assert read_only.READ_ONLY not in session.info
+
+    def test_batch_get_then_put(self):
+        rv = self.client.post('/batch', content_type='application/json', data=json.dumps([
+            {'method': 'GET', 'path': '/read_only_doohickeys'},
+            {'method': 'PUT', 'path': '/read_only_doohickeys/1', 'params': {'name': 'renamed'}},
+            {'method': 'GET', 'path': '/read_only_doohickeys'},
+        ]))
+        assert rv.status_code == 200, rv.data
+        assert [call['status_code'] for call in json.loads(rv.data)['response_data']] == [1000] * 3, rv.data
+        assert self.names() == ['renamed']
+
+
+class TestReadOnlyCommitOnTeardown(TestReadOnly):
+    '''Read-only transactions are rolled back before Flask-SQLAlchemy commits on teardown'''
+
+    flask_config = {'SQLALCHEMY_COMMIT_ON_TEARDOWN': True}
@@ -0,0 +1,106 @@
+import json
+import shutil
+import sqlite3
+
+from flask.ext.sqlalchemy import SQLAlchemy
+from formencode.validators import Int, String
+
+from hoops.base import APIResource, parameter, url_parameter
+from hoops.common import BareModel
+from hoops.generic import RetrieveOperation, UpdateOperation
+from hoops.replica import RoutingSession, sticky_clients, use_replicas
+from tests.api_tests import SQLiteTestBase
+
+# a database of its own, as its session is swapped for a RoutingSession
+db = SQLAlchemy()
+
+
+class Model(db.Model, BareModel):
+    __abstract__ = True
+
+
+class Gadget(Model):
+    __tablename__ = 'replica_gadget'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.Unicode(64))
+
+    def updates_permitted(self):
+        return True
+
+
+class GadgetAPI(APIResource):
+    route = '/replica_gadgets'
+    object_route = '/replica_gadgets/<int:gadget_id>'
+    object_id_param = 'gadget_id'
+    model = Gadget
+    read_only = False
+
+
+@GadgetAPI.method('retrieve')
+@url_parameter('gadget_id', Int, "Gadget ID")
+class RetrieveGadget(RetrieveOperation):
+    pass
+
+
+@GadgetAPI.method('update')
+@parameter('name', String(max=64), "Name", required=True)
+@url_parameter('gadget_id', Int, "Gadget ID")
+class UpdateGadget(UpdateOperation):
+    pass
+
+
+class TestReplicaRouting(SQLiteTestBase):
+    '''Two SQLite files stand in for the primary and its replica'''
+
+    db = db
+    app_name = 'replica_test'
+
+    def setUp(self):
+        super(TestReplicaRouting, self).setUp()
+        shutil.copy(self.sqlite_path('primary'), self.sqlite_path('replica'))
+        connection = sqlite3.connect(self.sqlite_path('replica'))
+        connection.execute("UPDATE replica_gadget SET name = 'replica'")
+        connection.commit()
+        connection.close()
+        sticky_clients.clear()
+
+    def tearDown(self):
+        RetrieveGadget.read_replica = None
+        super(TestReplicaRouting, self).tearDown()
+
+    def db_config(self):
+        return {
+            'uri': 'sqlite:///' + self.sqlite_path('primary'),
+            'replicas': [{'uri': 'sqlite:///' + self.sqlite_path('replica')}],
+            'replica_sticky_seconds': 60,
+        }
+
+    def populate(self):
+        db.session.add(Gadget(id=1, name=u'primary'))
+
+    def name(self, **kwargs):
+        return json.loads(self.client.get('/replica_gadgets/1', **kwargs).data)['response_data']['name']
+
+    def test_routing(self):
+        with self.app.app_context():
+            assert isinstance(db.session(), RoutingSession)
+        assert self.name() == 'replica'
+        RetrieveGadget.read_replica = False
+        assert self.name() == 'primary'
+
+    def test_read_your_writes(self):
+        rv = self.client.put('/replica_gadgets/1', data=json.dumps({'name': 'written'}), content_type='application/json')
+        assert rv.status_code == 200, rv.data
+        # the writer stays on the primary, other clients keep using the replica
+        assert self.name() == 'written'
+        assert self.name(environ_base={'REMOTE_ADDR': '10.1.2.3'}) == 'replica'
+        sticky_clients.clear()
+        assert self.name() == 'replica'
+
+    def test_session_options(self):
+        database = use_replicas(SQLAlchemy(session_options={'expire_on_commit': False}))
+        database.init_app(self.app)
+        with self.app.app_context():
+            session = database.session()
+            assert isinstance(session, RoutingSession)
+            assert not session.expire_on_commit
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import logging
+import unittest
+
+from formencode.validators import Int
+
+from hoops.base import APIOperation, APIResource, parameter
+from hoops.core import create_api
+from hoops.response import APIResponse
+from hoops.restful import LogExcerpt
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class RowsAPI(APIResource):
+    route = '/rows'
+
+
+@RowsAPI.method('list')
+@parameter('count', Int, "Number of rows", required=True)
+class ListRows(APIOperation):
+
+    def process_request(self, *args, **kwargs):
+        return APIResponse([{'id': i, 'name': u'row %d' % i} for i in range(self.params['count'])])
+
+
+class Unrenderable(object):
+
+    def __unicode__(self):
+        raise AssertionError('rendered')
+
+
+class TestLogExcerpt(unittest.TestCase):
+
+    def test_lazy(self):
+        excerpt = LogExcerpt(Unrenderable(), 10)
+        logging.getLogger('response_logging_test.disabled').debug('%s', excerpt)
+        self.assertRaises(AssertionError, unicode, excerpt)
+
+    def test_cut_to_bytes(self):
+        assert unicode(LogExcerpt('abcdef', 4)) == u'abcd...'
+        assert unicode(LogExcerpt('abc', 4)) == u'abc'
+        # characters cut in the middle are left out
+        assert unicode(LogExcerpt(u'ééé', 5)) == u'éé...'
+        assert unicode(LogExcerpt([1, 2], None)) == u'[1, 2]'
+
+
+class TestResponseLogging(unittest.TestCase):
+    '''Responses are logged cut to LOG_RESPONSE_MAX_BYTES, and bodies for a sample of the requests'''
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        log_config = {
+            'version': 1,
+            'disable_existing_loggers': False,
+            'loggers': {'api.request': {'level': 'DEBUG', 'propagate': False}},
+        }
+        (self.app, _, api) = create_api('response_logging_test', log_config=log_config, flask_config={
+            'DEBUG': True,
+            'LOG_RESPONSE_MAX_BYTES': 40,
+        })
+        logging.getLogger('api.request').addHandler(self.handler)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        logging.getLogger('api.request').removeHandler(self.handler)
+        logging.disable(logging.NOTSET)
+
+    def messages(self, prefix):
+        return [record.getMessage() for record in self.handler.records if record.getMessage().startswith(prefix)]
+
+    def test_capped_excerpts(self):
+        rv = self.client.get('/rows', query_string={'count': 100})
+        assert rv.status_code == 200, rv.data
+        [excerpt] = self.messages('Response: ')
+        assert len(excerpt) <= len('Response: ') + 40 + 3, excerpt
+        [body] = self.messages('Response body: ')
+        assert 'row 99' in body, body
+        [logged] = self.messages('{')
+        assert len(logged) <= 40 + 3 + len(': Ok'), logged
+
+    def test_sampled_bodies(self):
+        self.app.config['LOG_BODY_SAMPLE_RATES'] = {'/rows': 0}
+        rv = self.client.get('/rows', query_string={'count': 3})
+        assert rv.status_code == 200, rv.data
+        assert self.messages('Response: ')
+        assert not self.messages('Response body: ')
+        assert not self.messages('Request: ')
+        self.app.config['LOG_BODY_SAMPLE_RATES'] = {}
+        self.app.config['LOG_BODY_SAMPLE_RATE'] = 1.0
+        self.client.get('/rows', query_string={'count': 3})
+        assert self.messages('Response body: ')
+        assert self.messages('Request: ')
+
+    def test_body_cap(self):
+        self.app.config['LOG_BODY_MAX_BYTES'] = 100
+        self.client.get('/rows', query_string={'count': 100})
+        [body] = self.messages('Response body: ')
+        assert len(body) <= len('Response body: ') + 100 + 3, body
+
+    def test_disabled_levels_not_rendered(self):
+        logging.disable(logging.INFO)
+        rv = self.client.get('/rows', query_string={'count': 3})
+        assert rv.status_code == 200, rv.data
+        assert not self.handler.records
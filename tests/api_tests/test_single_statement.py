@@ -0,0 +1,116 @@
+import json
+
+from formencode.validators import Int, String
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from hoops.base import APIResource, parameter, url_parameter
+from hoops.generic import DeleteOperation, NotSpecified, UpdateOperation
+from hoops.status import library as status_library
+from tests.api_tests import SQLiteModel, SQLiteTestBase, sqlite_db as db
+
+
+class Thingamajig(SQLiteModel):
+    __tablename__ = 'single_statement_thingamajig'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.Unicode(64))
+    locked = db.Column(db.Boolean, default=False)
+
+    def updates_permitted(self):
+        return not self.locked
+
+    @classmethod
+    def updates_permitted_clause(cls):
+        return cls.locked == False
+
+
+class ThingamajigAPI(APIResource):
+    route = '/thingamajigs'
+    object_route = '/thingamajigs/<int:thingamajig_id>'
+    object_id_param = 'thingamajig_id'
+    model = Thingamajig
+    read_only = False
+
+
+@ThingamajigAPI.method('update')
+@parameter('name', String(max=64, if_missing=NotSpecified()), "Name")
+@url_parameter('thingamajig_id', Int, "Thingamajig ID")
+class UpdateThingamajig(UpdateOperation):
+    single_statement = True
+
+
+@ThingamajigAPI.method('remove')
+@url_parameter('thingamajig_id', Int, "Thingamajig ID")
+class DeleteThingamajig(DeleteOperation):
+    single_statement = True
+
+
+class TestSingleStatement(SQLiteTestBase):
+
+    app_name = 'single_statement_test'
+
+    def populate(self):
+        db.session.add(Thingamajig(id=1, name=u'open'))
+        db.session.add(Thingamajig(id=2, name=u'locked', locked=True))
+
+    def record_statement(self, connection, cursor, statement, *args):
+        self.statements.append(statement.split()[0])
+
+    def put(self, id, name=None):
+        self.statements = []
+        params = {} if name is None else {'name': name}
+        rv = self.client.put('/thingamajigs/%d' % id, data=json.dumps(params), content_type='application/json')
+        return (rv.status_code, json.loads(rv.data))
+
+    def delete(self, id):
+        self.statements = []
+        rv = self.client.delete('/thingamajigs/%d' % id, data='{}', content_type='application/json')
+        return (rv.status_code, json.loads(rv.data))
+
+    def names(self):
+        with self.app.app_context():
+            return dict(db.session.query(Thingamajig.id, Thingamajig.name))
+
+    def test_update(self):
+        (code, body) = self.put(1, 'renamed')
+        assert code == 200, body
+        assert body['response_data'] == {'id': 1, 'name': 'renamed', 'locked': False}
+        # no SELECT ahead of the UPDATE, and none after the commit
+        assert self.statements == ['UPDATE', 'SELECT'], self.statements
+        assert self.put(2, 'renamed')[1]['status_code'] == status_library.API_FORBIDDEN_UPDATE.status.status_code
+        assert self.put(3, 'renamed')[0] == 404
+        assert self.names() == {1: 'renamed', 2: 'locked'}
+
+    def test_delete(self):
+        (code, body) = self.delete(1)
+        assert code == 200, body
+        assert body['response_data']['name'] == 'open'
+        assert self.statements == ['SELECT', 'DELETE'], self.statements
+        assert self.delete(2)[1]['status_code'] == status_library.API_FORBIDDEN_DELETE.status.status_code
+        assert self.delete(3)[0] == 404
+        assert self.names() == {2: 'locked'}
+
+    def test_empty_update(self):
+        (code, body) = self.put(1)
+        assert code == 200, body
+        assert body['response_data']['name'] == 'open'
+        assert self.statements == ['SELECT'], self.statements
+        assert self.put(2)[1]['status_code'] == status_library.API_FORBIDDEN_UPDATE.status.status_code
+        assert self.names() == {1: 'open', 2: 'locked'}
+
+    def test_returning(self):
+        table = Thingamajig.__table__
+        with self.app.test_request_context('/thingamajigs/1', method='PUT'):
+            operation = UpdateThingamajig(ThingamajigAPI(), 'put')
+            operation.params = {'name': u'renamed'}
+            operation.url_params = {'thingamajig_id': 1}
+            # SQLite has no RETURNING; PostgreSQL does
+            assert not operation.use_returning()
+            dialect = postgresql.dialect(implicit_returning=True)
+            assert operation.use_returning(dialect)
+            statement = operation.row_statement(table.update().values(name=u'renamed'), True)
+            sql = str(statement.compile(dialect=dialect))
+            assert 'RETURNING' in sql, sql
+            assert 'locked = false' in sql, sql
+            obj = operation.row_object(db.session.execute(select(table.columns).where(table.c.id == 1)).first())
+            assert (obj.id, obj.name, obj.locked) == (1, 'open', False)
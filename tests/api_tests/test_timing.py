@@ -0,0 +1,101 @@
+import logging
+
+from formencode.validators import Int
+
+from hoops.base import APIResource, url_parameter
+from hoops.generic import ListOperation, RetrieveOperation
+from hoops.logger import ContextFilter
+from tests.api_tests import SQLiteModel, SQLiteTestBase, sqlite_db as db
+
+
+class Whatchamacallit(SQLiteModel):
+    __tablename__ = 'timing_whatchamacallit'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.Unicode(64))
+
+
+class WhatchamacallitAPI(APIResource):
+    route = '/whatchamacallits'
+    object_route = '/whatchamacallits/<int:whatchamacallit_id>'
+    object_id_param = 'whatchamacallit_id'
+    model = Whatchamacallit
+
+
+@WhatchamacallitAPI.method('list')
+class ListWhatchamacallits(ListOperation):
+    pass
+
+
+@WhatchamacallitAPI.method('retrieve')
+@url_parameter('whatchamacallit_id', Int, "Whatchamacallit ID")
+class RetrieveWhatchamacallit(RetrieveOperation):
+    pass
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+        self.addFilter(ContextFilter())
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestTiming(SQLiteTestBase):
+    '''Requests report the time spent in each phase'''
+
+    app_name = 'timing_test'
+    flask_config = {'DEBUG': True, 'REQUEST_TIMING': True}
+
+    def setUp(self):
+        super(TestTiming, self).setUp()
+        self.handler = RecordingHandler()
+        logging.getLogger('api.request').addHandler(self.handler)
+
+    def tearDown(self):
+        logging.getLogger('api.request').removeHandler(self.handler)
+        super(TestTiming, self).tearDown()
+
+    def api_args(self):
+        return {'log_config': {
+            'version': 1,
+            'disable_existing_loggers': False,
+            'loggers': {'api.request': {'level': 'DEBUG', 'propagate': False}},
+        }}
+
+    def populate(self):
+        db.session.add_all([Whatchamacallit(name=u'thing %d' % i) for i in range(5)])
+
+    def server_timing(self, path):
+        rv = self.client.get(path)
+        assert rv.status_code == 200, rv.data
+        header = rv.headers.get('Server-Timing')
+        if header is None:
+            return None
+        timings = {}
+        for entry in header.split(', '):
+            (name, duration) = entry.split(';dur=')
+            timings[name] = float(duration)
+        return timings
+
+    def test_server_timing(self):
+        timings = self.server_timing('/whatchamacallits')
+        assert set(['validate', 'db', 'serialize', 'encode', 'total']) <= set(timings), timings
+        assert timings['total'] >= timings['db'], timings
+
+    def test_selected_fields_serialized(self):
+        timings = self.server_timing('/whatchamacallits/1?fields=name')
+        assert 'serialize' in timings, timings
+
+    def test_log_fields(self):
+        self.app.config['SERVER_TIMING_HEADER'] = False
+        assert self.server_timing('/whatchamacallits') is None
+        timings = self.handler.records[-1].timings
+        assert 'db' in timings and 'total' in timings, timings
+
+    def test_disabled(self):
+        self.app.config['REQUEST_TIMING'] = False
+        assert self.server_timing('/whatchamacallits') is None
+        assert not any(hasattr(record, 'timings') for record in self.handler.records)
@@ -0,0 +1,78 @@
+from formencode import Invalid, Schema
+from formencode.validators import String, UnicodeString, StringBool, Email
+
+from hoops.base import APIResource, parameter
+from hoops.generic import ListOperation
+from hoops.validation import compile_schema
+from tests.api_tests import APITestBase
+
+
+@parameter('flag', StringBool(if_missing=False), "Flag")
+@parameter('name', UnicodeString(max=5), "Name", required=True)
+@parameter('code', String(max=3, if_missing=None), "Code")
+class ValidationResource(APIResource):
+    route = '/validation'
+
+
+@ValidationResource.method('list')
+class ListValidation(ListOperation):
+    pass
+
+
+def run(to_python, params):
+    try:
+        return ('ok', to_python(params))
+    except Invalid as e:
+        return ('error', e.msg, dict((k, v.msg) for (k, v) in (e.error_dict or {}).items()))
+
+
+class TestCompiledValidation(APITestBase):
+
+    def test_matches_formencode(self):
+        """Compiled schemas must return the same values and errors as formencode"""
+        schema = ValidationResource.list._combine_schema('schema')
+        compiled = compile_schema(schema)
+        assert compiled is not schema.to_python
+        trials = (
+            {'name': u'abc'},
+            {},
+            {'name': ''},
+            {'name': u'abcdef'},
+            {'name': 'x', 'limit': '5', 'page': '2', 'sort_order': 'desc', 'flag': 'YES'},
+            {'name': 'x', 'limit': '500'},
+            {'name': 'x', 'limit': '0'},
+            {'name': 'x', 'limit': 'ab'},
+            {'name': 'x', 'limit': ''},
+            {'name': 'x', 'limit': 7},
+            {'name': 'x', 'limit': [1]},
+            {'name': 'x', 'page': '-1'},
+            {'name': 'x', 'sort_order': 'up'},
+            {'name': 'x', 'extra': 1},
+            {'name': 'x', 'flag': 'maybe'},
+            {'name': 'x', 'flag': 1},
+            {'name': 'x', 'flag': ''},
+            {'name': '\xff'},
+            {'name': None},
+            {'name': 'x', 'code': 'abcd'},
+            {'name': 'x', 'code': u'ab'},
+        )
+        for params in trials:
+            expected = run(schema.to_python, params)
+            got = run(compiled, params)
+            assert repr(expected) == repr(got), '%s: %s != %s' % (params, got, expected)
+
+    def test_fallback(self):
+        """Schemas with unsupported validators are left to formencode"""
+        schema = Schema()
+        schema.add_field('email', Email())
+        assert compile_schema(schema) == schema.to_python
+
+    def test_operation_opt_in(self):
+        """compiled_validation swaps in the compiled function"""
+        op = ValidationResource.list
+        assert op._schema_validator('schema') == op._combine_schema('schema').to_python
+        op.compiled_validation = True
+        try:
+            assert hasattr(op._schema_validator('schema'), 'source')
+        finally:
+            del op.compiled_validation
@@ -0,0 +1,66 @@
+import json
+
+from coaster.sqlalchemy import BaseMixin
+from formencode.validators import Int, String
+
+from hoops.base import APIResource, parameter, url_parameter
+from hoops.generic import CreateOperation, UpdateOperation
+from tests.api_tests import SQLiteModel, SQLiteTestBase, sqlite_db as db
+
+
+class Whatsit(BaseMixin, SQLiteModel):
+    __tablename__ = 'round_trips_whatsit'
+    name = db.Column(db.Unicode(64))
+
+    def updates_permitted(self):
+        return True
+
+
+class WhatsitAPI(APIResource):
+    route = '/whatsits'
+    object_route = '/whatsits/<int:whatsit_id>'
+    object_id_param = 'whatsit_id'
+    model = Whatsit
+    read_only = False
+
+
+@WhatsitAPI.method('create')
+@parameter('name', String(max=64), "Name", required=True)
+class CreateWhatsit(CreateOperation):
+    pass
+
+
+@WhatsitAPI.method('update')
+@parameter('name', String(max=64), "Name", required=True)
+@url_parameter('whatsit_id', Int, "Whatsit ID")
+class UpdateWhatsit(UpdateOperation):
+    pass
+
+
+class TestWriteRoundTrips(SQLiteTestBase):
+    '''Created and updated objects are serialized without being reloaded after the commit'''
+
+    app_name = 'round_trips_test'
+
+    def record_statement(self, connection, cursor, statement, *args):
+        self.statements.append(statement.split()[0])
+
+    def send(self, method, path, params):
+        self.statements = []
+        rv = self.client.open(path, method=method, data=json.dumps(params), content_type='application/json')
+        assert rv.status_code == 200, rv.data
+        return json.loads(rv.data)['response_data']
+
+    def test_create(self):
+        data = self.send('POST', '/whatsits', {'name': 'new'})
+        assert data['id'] == 1
+        assert data['name'] == 'new'
+        assert data['created_at'] and data['updated_at']
+        assert self.statements == ['INSERT'], self.statements
+
+    def test_update(self):
+        created = self.send('POST', '/whatsits', {'name': 'new'})
+        data = self.send('PUT', '/whatsits/1', {'name': 'renamed'})
+        assert data['name'] == 'renamed'
+        assert data['updated_at'] >= created['updated_at']
+        assert self.statements == ['SELECT', 'UPDATE'], self.statements
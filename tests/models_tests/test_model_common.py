@@ -338,3 +338,14 @@ class TestCommonModels(unittest.TestCase):
         dbhelper.add(MyModel(status='suspended', value=2), db)
         dbhelper.add(MyModel(status='deleted', value=3), db)
         assert MyModel.query_active_or_suspended.count() == 2, MyModel.query_active_or_suspended.count()
+
+    def test_to_json_is_stable_when_expired(self):
+        '''to_json returns the same keys and values whether attributes are loaded or expired'''
+        item = dbhelper.add(MyModel(status='active', value='stable'), db)
+        loaded = item.to_json()
+        db.session.expire(item)
+        expired = item.to_json()
+        assert loaded == expired, (loaded, expired)
+        assert set(['id', 'status', 'value']) <= set(expired), expired.keys()
+        assert 'mymodelb' not in expired
+        assert item.to_json(fields=('id', 'value')) == {'id': item.id, 'value': 'stable'}